@@ -1,56 +1,135 @@
 """
 The `activity_monitor.py` script is part of the StreamMatey OBS Plugin software. It provides an `ActivityMonitor` class for tracking chat activity and a `Bot` class for interacting with Twitch chat.
 
-The `ActivityMonitor` class is responsible for monitoring the rate of chat messages. It uses a deque to store the timestamps of the most recent messages within a specified window size.
+The `ActivityMonitor` class is responsible for monitoring the rate of chat messages over real time windows. Messages are counted into fixed-width time buckets (1 second by default) held in a ring, and a running total is kept for each configured window (5, 30, 60 and 300 seconds by default, plus the `window_size` passed to the constructor). Adding a message and reading a rate are both O(1), and memory is bounded by the widest window no matter how busy chat gets.
 
-The `ActivityMonitor` class has two methods:
+The `ActivityMonitor` class has the following methods:
 
-- `add_message(message)`: Adds the timestamp of a new message to the deque.
-- `get_activity_level()`: Calculates and returns the current activity level, defined as the number of messages per second.
+- `add_message(message, timestamp=None)`: Counts a new message into the bucket for its timestamp (the current time if none is given).
+- `get_message_count(window=None, timestamp=None)`: Returns the number of messages seen in the given window (the `window_size` window by default).
+- `get_activity_level(window=None, timestamp=None)`: Calculates and returns the current activity level, defined as the number of messages per second over the given window.
+- `get_activity_levels(timestamp=None)`: Returns the activity level for every configured window as a dictionary.
 
-The `Bot` class is a subclass of `commands.Bot` from the `twitchio.ext` module. It extends the base class with an `activity_monitor` attribute and overrides the `event_message` method to add each incoming message to the activity monitor.
+The `Bot` class is a subclass of `commands.Bot` from the `twitchio.ext` module. It extends the base class with an `activity_monitor` attribute and overrides the `event_message` method to add each incoming message to the activity monitor. Importing twitchio (and aiohttp under it) takes a few hundred milliseconds, and the rest of the plugin only needs `ActivityMonitor`, so the `Bot` class is only built, and twitchio only imported, the first time `Bot` is accessed.
 
 The `Bot` class also includes a command for checking the current activity level. The `activity_command` method responds to the "!activity" command by printing the current activity level.
 
-In the main part of the script, an `ActivityMonitor` instance and a `Bot` instance are created. The `ActivityMonitor` instance is set to monitor a 1-minute window of activity. The `Bot` instance is initialized with the necessary Twitch credentials and the `ActivityMonitor` instance, and is set to join two channels.
+In the main part of the script, an `ActivityMonitor` instance and a `Bot` instance are created. The `ActivityMonitor` instance is set to report activity over a 1-minute window. The `Bot` instance is initialized with the necessary Twitch credentials and the `ActivityMonitor` instance, and is set to join two channels.
 
 Finally, the bot is run with the `run` method. This starts the bot and begins monitoring chat activity.
 """
 
-import asyncio
-import collections
+import math
 import time
-from twitchio.ext import commands
+
+DEFAULT_WINDOWS = (5, 30, 60, 300)  # seconds
 
 class ActivityMonitor:
-    def __init__(self, window_size):
+    def __init__(self, window_size, windows=DEFAULT_WINDOWS, bucket_width=1.0, clock=time.time):
         self.window_size = window_size
-        self.timestamps = collections.deque(maxlen=window_size)
-
-    def add_message(self, message):
-        self.timestamps.append(time.time())
-
-    def get_activity_level(self):
-        if len(self.timestamps) < 2:
+        self.windows = tuple(sorted(set(windows) | {window_size}))
+        self.bucket_width = bucket_width
+        self.clock = clock
+        self._window_buckets = {window: max(1, math.ceil(window / bucket_width)) for window in self.windows}
+        # One extra slot so the bucket leaving the widest window is still intact when it is subtracted
+        self._ring_size = max(self._window_buckets.values()) + 1
+        self._counts = [0] * self._ring_size
+        self._window_counts = dict.fromkeys(self.windows, 0)
+        self._current_bucket = None
+        self._first_timestamp = None
+        self.total_messages = 0
+
+    def _advance(self, bucket):
+        if self._current_bucket is None:
+            self._current_bucket = bucket
+            return
+        gap = bucket - self._current_bucket
+        if gap <= 0:
+            return
+        if gap >= self._ring_size:
+            self._counts = [0] * self._ring_size
+            self._window_counts = dict.fromkeys(self.windows, 0)
+        else:
+            counts = self._counts
+            for new_bucket in range(self._current_bucket + 1, bucket + 1):
+                for window, size in self._window_buckets.items():
+                    self._window_counts[window] -= counts[(new_bucket - size) % self._ring_size]
+                counts[new_bucket % self._ring_size] = 0
+        self._current_bucket = bucket
+
+    def add_message(self, message, timestamp=None):
+        if timestamp is None:
+            timestamp = self.clock()
+        if self._first_timestamp is None or timestamp < self._first_timestamp:
+            self._first_timestamp = timestamp
+        bucket = int(timestamp // self.bucket_width)
+        self._advance(bucket)
+        age = self._current_bucket - bucket
+        if age >= self._ring_size - 1:
+            return  # Older than the widest window, nothing to count it towards
+        self._counts[bucket % self._ring_size] += 1
+        for window, size in self._window_buckets.items():
+            if age < size:
+                self._window_counts[window] += 1
+        self.total_messages += 1
+
+    def get_message_count(self, window=None, timestamp=None):
+        window = self.window_size if window is None else window
+        if window not in self._window_counts:
+            raise ValueError(f"Unknown activity window: {window}")
+        if timestamp is None:
+            timestamp = self.clock()
+        self._advance(int(timestamp // self.bucket_width))
+        return self._window_counts[window]
+
+    def get_activity_level(self, window=None, timestamp=None):
+        window = self.window_size if window is None else window
+        if timestamp is None:
+            timestamp = self.clock()
+        count = self.get_message_count(window, timestamp)
+        if not count:
             return 0
-        time_diff = self.timestamps[-1] - self.timestamps[0]
-        return len(self.timestamps) / time_diff if time_diff else 0
-
-class Bot(commands.Bot):
-    def __init__(self, irc_token, client_id, nick, prefix, initial_channels, activity_monitor):
-        super().__init__(irc_token=irc_token, client_id=client_id, nick=nick, prefix=prefix, initial_channels=initial_channels)
-        self.activity_monitor = activity_monitor
-
-    async def event_message(self, message):
-        print(message.content)
-        self.activity_monitor.add_message(message)
-
-    @commands.command(name='activity')
-    async def activity_command(self, ctx):
-        activity_level = self.activity_monitor.get_activity_level()
-        print(f'Activity level: {activity_level} messages per second')
+        # The window spans its full buckets plus the elapsed part of the current one
+        bucket_start = self._current_bucket * self.bucket_width
+        covered = (self._window_buckets[window] - 1) * self.bucket_width + (timestamp - bucket_start)
+        covered = min(covered, timestamp - self._first_timestamp)
+        return count / covered if covered > 0 else 0
+
+    def get_activity_levels(self, timestamp=None):
+        if timestamp is None:
+            timestamp = self.clock()
+        return {window: self.get_activity_level(window, timestamp) for window in self.windows}
+
+def _bot_class():
+    from twitchio.ext import commands
+
+    class Bot(commands.Bot):
+        def __init__(self, irc_token, client_id, nick, prefix, initial_channels, activity_monitor):
+            super().__init__(irc_token=irc_token, client_id=client_id, nick=nick, prefix=prefix, initial_channels=initial_channels)
+            self.activity_monitor = activity_monitor
+
+        async def event_message(self, message):
+            print(message.content)
+            self.activity_monitor.add_message(message)
+
+        @commands.command(name='activity')
+        async def activity_command(self, ctx):
+            activity_level = self.activity_monitor.get_activity_level()
+            print(f'Activity level: {activity_level} messages per second')
+
+    Bot.__module__, Bot.__qualname__ = __name__, "Bot"
+    return Bot
+
+def __getattr__(name):
+    # Only code that uses the bot pays for importing twitchio
+    if name == 'Bot':
+        global Bot
+        Bot = _bot_class()
+        return Bot
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
+    Bot = _bot_class()
     window_size = 60  # 1 minute window
     activity_monitor = ActivityMonitor(window_size)
 
@@ -0,0 +1,321 @@
+"""
+The `analytics.py` script is part of the StreamMatey OBS Plugin software. It reads the chat stored in the database (see `database.py`) back after a stream, to find the moments that deserved a clip, including the ones the live pipeline missed, and to see how different thresholds would have behaved.
+
+The chat is never loaded whole. `scan_chat` reads the `chat_messages` table a page of `chunk_size` rows at a time, each page a separate query that carries on from the last row of the previous one (keyset paging), so memory stays bounded and the database is free for other readers and the writer between pages. Only the timestamp and sentiment of each message are read. A whole-database scan walks the table in rowid order, which reads it sequentially; a scan of one channel or a time range follows the `(channel, timestamp)` or `timestamp` index instead. The database is opened read-only, so the analysis can run while the plugin is writing to it.
+
+The database usually holds many streams, days apart. Before the scan, `get_streams` splits the chat into streams wherever it goes quiet for more than `stream_gap` seconds (30 minutes by default). It finds the gaps from the timestamp index alone: one pass lists the `stream_gap`-long cells that have any chat, and a lookup at the edges of each gives the silence between them. Each stream gets its own `ChatSeries`, and each page of the scan is added to the series of the stream it falls in with NumPy's `bincount`: the number of messages and the sum and count of sentiment scores per second (`bucket_width`). A series covers the time span of its stream rather than the rows in it, so a day of chat takes a few megabytes however busy the channel was, and the offline time between streams takes nothing. From each series it derives, over a sliding `window`:
+
+- The activity, in messages per second, and the mean sentiment of the scored messages (spam is stored without a score).
+- A hype score: the z-score of the activity plus the z-score of the mean sentiment, both against the whole stream, so a moment ranks high when chat is both busier and happier than usual for this stream. The quiet time between streams never lowers the baseline.
+- The top `top_n` hype moments, at least `min_gap` seconds apart, each marked with whether a stored clip covers it. The moments of all the streams are ranked together by score.
+- With `activity_threshold` (messages per second) and `sentiment_threshold`, the number of seconds where both are exceeded, for comparing thresholds with the pipeline configuration (see `pipeline.py`).
+
+The script provides the following:
+
+- `get_streams(database_path, channel=None, start=None, end=None, stream_gap=1800.0)`: Returns the `(first, last)` timestamps of each stream in the stored chat.
+- `scan_chat(database_path, channel=None, start=None, end=None, chunk_size=50000)`: Yields the chat as `(timestamps, sentiments)` pairs of NumPy arrays, one per page, with NaN for messages without a score.
+- `ChatSeries(start, end, bucket_width=1.0)`: The per-second series of one stream. `add(timestamps, sentiments)` adds a page, `activity(window)`, `sentiment(window)` and `hype_scores(window)` return the windowed series, and `hype_moments(top_n, window, min_gap)` returns the top moments.
+- `analyze_chat(database_path, channel=None, start=None, end=None, ...)`: Scans the chat and returns a dictionary with the number of rows, the scan rate in rows per second, the time span, the streams and the top hype moments.
+
+Example:
+
+    python analytics.py comments.db --channel channel1 --top 10
+"""
+
+import argparse
+import datetime
+import sqlite3
+import time
+
+DEFAULT_CHUNK_SIZE = 50000  # rows per page
+DEFAULT_STREAM_GAP = 1800.0  # seconds of silence that end a stream
+
+
+def _connect_read_only(database_path):
+    return sqlite3.connect(f'file:{database_path}?mode=ro', uri=True)
+
+
+def _filters(channel, start, end):
+    clauses, params = [], []
+    if channel is not None:
+        clauses.append('channel = ?')
+        params.append(channel)
+    if start is not None:
+        clauses.append('timestamp >= ?')
+        params.append(start)
+    if end is not None:
+        clauses.append('timestamp < ?')
+        params.append(end)
+    return clauses, params
+
+
+def get_time_span(database_path, channel=None, start=None, end=None):
+    """
+    This function returns the first and last timestamps of the stored chat, or `(None, None)` if there is none. Both are read from an index.
+    """
+    clauses, params = _filters(channel, start, end)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    connection = _connect_read_only(database_path)
+    try:
+        first = connection.execute(f'SELECT MIN(timestamp) FROM chat_messages {where}', params).fetchone()[0]
+        last = connection.execute(f'SELECT MAX(timestamp) FROM chat_messages {where}', params).fetchone()[0]
+    finally:
+        connection.close()
+    return first, last
+
+
+def get_streams(database_path, channel=None, start=None, end=None, stream_gap=DEFAULT_STREAM_GAP):
+    """
+    This function returns the first and last timestamps of each stream in the stored chat, in order, where a stream ends when the chat is silent for more than `stream_gap` seconds.
+    """
+    clauses, params = _filters(channel, start, end)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    first_query = f"SELECT MIN(timestamp) FROM chat_messages WHERE {' AND '.join(clauses + ['timestamp >= ?'])}"
+    last_query = f"SELECT MAX(timestamp) FROM chat_messages WHERE {' AND '.join(clauses + ['timestamp < ?'])}"
+    connection = _connect_read_only(database_path)
+    try:
+        # A silence longer than a cell can only fall between two cells with chat, so only the edges of those cells are looked up
+        cells = sorted(cell for (cell,) in connection.execute(
+            f'SELECT DISTINCT CAST(timestamp / ? AS INTEGER) FROM chat_messages {where}', (stream_gap, *params)))
+        streams = []
+        for cell in cells:
+            first = connection.execute(first_query, (*params, cell * stream_gap)).fetchone()[0]
+            last = connection.execute(last_query, (*params, (cell + 1) * stream_gap)).fetchone()[0]
+            if streams and first - streams[-1][1] <= stream_gap:
+                streams[-1][1] = last
+            else:
+                streams.append([first, last])
+    finally:
+        connection.close()
+    return [tuple(stream) for stream in streams]
+
+
+def scan_chat(database_path, channel=None, start=None, end=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    This function yields the stored chat one page at a time as a pair of NumPy arrays: the timestamps and the sentiment scores, NaN where a message has none.
+    """
+    import numpy as np
+
+    clauses, params = _filters(channel, start, end)
+    # Following the rowid reads the table in order; an index is only worth it for part of the table
+    by_rowid = channel is None and start is None and end is None
+    if by_rowid:
+        query = 'SELECT id, timestamp, sentiment FROM chat_messages WHERE id > ? ORDER BY id LIMIT ?'
+    else:
+        query = (f"SELECT id, timestamp, sentiment FROM chat_messages WHERE {' AND '.join(clauses)} "
+                 'AND (timestamp, id) > (?, ?) ORDER BY timestamp, id LIMIT ?')
+    connection = _connect_read_only(database_path)
+    try:
+        last_id, last_timestamp = -1, float('-inf')
+        while True:
+            key = (last_id,) if by_rowid else (*params, last_timestamp, last_id)
+            rows = connection.execute(query, (*key, chunk_size)).fetchall()
+            if not rows:
+                return
+            # None becomes NaN in a float array
+            page = np.array(rows, dtype=np.float64)
+            last_id, last_timestamp = rows[-1][0], rows[-1][1]
+            del rows
+            yield page[:, 1], page[:, 2]
+            if len(page) < chunk_size:
+                return
+    finally:
+        connection.close()
+
+
+def _rolling_sum(values, window):
+    import numpy as np
+
+    totals = np.concatenate(([0], np.cumsum(values)))
+    ends = np.arange(1, len(values) + 1)
+    return totals[ends] - totals[np.maximum(ends - window, 0)]
+
+
+def _z_scores(values):
+    import numpy as np
+
+    defined = ~np.isnan(values)
+    if not defined.any():
+        return np.zeros_like(values)
+    deviation = values[defined].std()
+    z_scores = (values - values[defined].mean()) / (deviation if deviation > 0 else 1.0)
+    # Seconds without a value rank below every second with one
+    z_scores[~defined] = -np.inf
+    return z_scores
+
+
+class ChatSeries:
+    def __init__(self, start, end, bucket_width=1.0):
+        import numpy as np
+
+        self.start = start
+        self.bucket_width = bucket_width
+        self.size = int((end - start) // bucket_width) + 1
+        self.counts = np.zeros(self.size, dtype=np.int64)
+        self.sentiment_sums = np.zeros(self.size, dtype=np.float64)
+        self.sentiment_counts = np.zeros(self.size, dtype=np.int64)
+        self.rows = 0
+
+    def add(self, timestamps, sentiments):
+        import numpy as np
+
+        buckets = ((timestamps - self.start) // self.bucket_width).astype(np.intp)
+        np.clip(buckets, 0, self.size - 1, out=buckets)
+        self.counts += np.bincount(buckets, minlength=self.size)
+        scored = ~np.isnan(sentiments)
+        self.sentiment_sums += np.bincount(buckets[scored], weights=sentiments[scored], minlength=self.size)
+        self.sentiment_counts += np.bincount(buckets[scored], minlength=self.size)
+        self.rows += len(timestamps)
+
+    def _buckets(self, window):
+        return max(1, int(round(window / self.bucket_width)))
+
+    def timestamps(self):
+        import numpy as np
+        return self.start + np.arange(self.size) * self.bucket_width
+
+    def activity(self, window=1.0):
+        buckets = self._buckets(window)
+        return _rolling_sum(self.counts, buckets) / (buckets * self.bucket_width)
+
+    def sentiment(self, window=1.0):
+        import numpy as np
+
+        buckets = self._buckets(window)
+        counts = _rolling_sum(self.sentiment_counts, buckets)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, _rolling_sum(self.sentiment_sums, buckets) / counts, np.nan)
+
+    def hype_scores(self, window=10.0):
+        return _z_scores(self.activity(window)) + _z_scores(self.sentiment(window))
+
+    def hype_moments(self, top_n=10, window=10.0, min_gap=30.0):
+        """
+        Returns up to `top_n` moments in order of their hype score, each the window ending at a second whose score is the highest within `min_gap` seconds of any moment ranked above it.
+        """
+        import numpy as np
+
+        scores = self.hype_scores(window)
+        activity = self.activity(window)
+        sentiment = self.sentiment(window)
+        message_counts = _rolling_sum(self.counts, self._buckets(window))
+        gap = self._buckets(min_gap)
+        moments = []
+        chosen = []
+        for bucket in np.argsort(scores, kind='stable')[::-1]:
+            if len(moments) == top_n or not np.isfinite(scores[bucket]):
+                break
+            if any(abs(bucket - other) < gap for other in chosen):
+                continue
+            chosen.append(bucket)
+            end = self.start + (bucket + 1) * self.bucket_width
+            moments.append({
+                'timestamp': float(end),
+                'start': float(max(self.start, end - window)),
+                'messages': int(message_counts[bucket]),
+                'activity': float(activity[bucket]),
+                'sentiment': float(sentiment[bucket]),
+                'score': float(scores[bucket]),
+            })
+        return moments
+
+    def seconds_over(self, activity_threshold, sentiment_threshold, window=10.0):
+        import numpy as np
+
+        with np.errstate(invalid='ignore'):
+            over = (self.activity(window) > activity_threshold) & (self.sentiment(window) > sentiment_threshold)
+        return float(over.sum() * self.bucket_width)
+
+
+def _get_clips(database_path, start, end):
+    connection = _connect_read_only(database_path)
+    try:
+        return connection.execute('SELECT start_time, end_time FROM clips WHERE end_time >= ? AND start_time <= ?', (start, end)).fetchall()
+    except sqlite3.OperationalError:
+        return []  # A database from before the clips table
+    finally:
+        connection.close()
+
+
+def analyze_chat(database_path, channel=None, start=None, end=None, top_n=10, window=10.0, min_gap=30.0, bucket_width=1.0,
+                 chunk_size=DEFAULT_CHUNK_SIZE, activity_threshold=None, sentiment_threshold=None, stream_gap=DEFAULT_STREAM_GAP):
+    """
+    This function scans the stored chat and returns a dictionary with the rows scanned, the time taken, the scan rate, the time span, the streams and the top hype moments.
+    Each stream is scored against itself, and each moment carries the index of its stream in `streams`.
+    """
+    import numpy as np
+
+    scan_start = time.perf_counter()
+    streams = get_streams(database_path, channel, start, end, stream_gap)
+    result = {'rows': 0, 'start': streams[0][0] if streams else None, 'end': streams[-1][1] if streams else None,
+              'streams': [], 'moments': [], 'seconds_over_thresholds': None}
+    if streams:
+        series = [ChatSeries(first, last, bucket_width) for first, last in streams]
+        stream_starts = np.array([first for first, _ in streams])
+        for timestamps, sentiments in scan_chat(database_path, channel, start, end, chunk_size):
+            stream_indexes = np.searchsorted(stream_starts, timestamps, side='right') - 1
+            np.clip(stream_indexes, 0, len(series) - 1, out=stream_indexes)
+            # Most pages fall within one stream
+            if (stream_indexes == stream_indexes[0]).all():
+                series[stream_indexes[0]].add(timestamps, sentiments)
+                continue
+            for index in np.unique(stream_indexes):
+                in_stream = stream_indexes == index
+                series[index].add(timestamps[in_stream], sentiments[in_stream])
+        clips = _get_clips(database_path, result['start'], result['end'])
+        moments = []
+        for index, stream in enumerate(series):
+            result['streams'].append({'start': streams[index][0], 'end': streams[index][1], 'rows': stream.rows})
+            for moment in stream.hype_moments(top_n, window, min_gap):
+                moment['stream'] = index
+                moments.append(moment)
+        for moment in sorted(moments, key=lambda moment: moment['score'], reverse=True)[:top_n]:
+            moment['clipped'] = any(clip_start <= moment['timestamp'] and clip_end >= moment['start'] for clip_start, clip_end in clips)
+            result['moments'].append(moment)
+        if activity_threshold is not None and sentiment_threshold is not None:
+            result['seconds_over_thresholds'] = sum(stream.seconds_over(activity_threshold, sentiment_threshold, window) for stream in series)
+        result['rows'] = sum(stream.rows for stream in series)
+    result['elapsed'] = time.perf_counter() - scan_start
+    result['rows_per_second'] = result['rows'] / result['elapsed'] if result['elapsed'] else 0.0
+    return result
+
+
+def _format_time(timestamp, stream_start):
+    offset = int(timestamp - stream_start)
+    wall = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    return f"{wall} UTC (+{offset // 3600}:{offset // 60 % 60:02d}:{offset % 60:02d})"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the hype moments in the chat stored by StreamMatey")
+    parser.add_argument('database', nargs='?', default='comments.db')
+    parser.add_argument('--channel', help="only this channel's chat")
+    parser.add_argument('--start', type=float, help="first timestamp to include")
+    parser.add_argument('--end', type=float, help="timestamp to stop at")
+    parser.add_argument('--top', type=int, default=10, help="number of moments to list")
+    parser.add_argument('--window', type=float, default=10.0, help="seconds of chat each moment covers")
+    parser.add_argument('--min-gap', type=float, default=30.0, help="minimum seconds between listed moments")
+    parser.add_argument('--stream-gap', type=float, default=DEFAULT_STREAM_GAP, help="seconds of silent chat that end a stream")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="rows read per page")
+    parser.add_argument('--activity-threshold', type=float, help="messages per second, to count the seconds over both thresholds")
+    parser.add_argument('--sentiment-threshold', type=float, help="mean sentiment, to count the seconds over both thresholds")
+    args = parser.parse_args(argv)
+
+    result = analyze_chat(args.database, args.channel, args.start, args.end, args.top, args.window, args.min_gap,
+                          chunk_size=args.chunk_size, activity_threshold=args.activity_threshold, sentiment_threshold=args.sentiment_threshold,
+                          stream_gap=args.stream_gap)
+    print(f"Scanned {result['rows']:,} messages in {result['elapsed']:.2f}s ({result['rows_per_second']:,.0f} rows/s)")
+    if not result['rows']:
+        return
+    for number, stream in enumerate(result['streams'], start=1):
+        print(f"Stream {number}: {_format_time(stream['start'], stream['start'])} to {_format_time(stream['end'], stream['start'])}, {stream['rows']:,} messages")
+    if result['seconds_over_thresholds'] is not None:
+        print(f"Seconds over both thresholds: {result['seconds_over_thresholds']:.0f}")
+    for rank, moment in enumerate(result['moments'], start=1):
+        print(f"{rank:>3}. stream {moment['stream'] + 1}, {_format_time(moment['start'], result['streams'][moment['stream']]['start'])}: {moment['messages']} messages, "
+              f"{moment['activity']:.1f} msgs/s, sentiment {moment['sentiment']:+.3f}, score {moment['score']:.2f}"
+              f"{'' if moment['clipped'] else ', missed'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,727 @@
+"""
+The `benchmarks.py` script is part of the StreamMatey OBS Plugin software. It collects the microbenchmarks used to measure the hot paths of the plugin without connecting to Twitch or OBS.
+
+Each benchmark is a subcommand of the script and prints its results to the console:
+
+- `activity`: Replays a synthetic burst trace (a quiet channel interrupted by raid-sized bursts) through an `ActivityMonitor` and reports the cost of `add_message` and `get_activity_level`, the size of the bucket ring, and whether the reported counts match an exact recount of the trace.
+- `clip`: Runs a simulated chat loop while `ClipCreator` records clips against a fake OBS connection with slow, blocking requests, and compares message throughput before and during the recording.
+- `sentiment`: Replays a chat log through `SentimentAnalyzer.analyze_sentiment` with and without the in-memory sentiment cache and reports per-message latency percentiles and the cache hit rate. The log is either a file (`--log`, one JSON object with a `message` field or one plain message per line) or a synthetic, emote-heavy log.
+- `batch`: Scores batches of distinct messages with `SentimentAnalyzer.analyze_sentiment_batch` using 1, 2, 4, ... processes and reports messages/sec for each process count.
+- `database`: Loads a database with 10 million chat messages and scores (`--rows` to change) and reports the query plans and the cost of indexed score lookups and channel time-range queries.
+- `ingest`: Publishes messages into a `ChatConnector` queue as fast as possible while a consumer drains it with `get_messages`, and reports the consumed rate and dropped count for each overflow policy. `--consumer-delay` slows the consumer down to exercise the overflow policies.
+- `shards`: Spreads synthetic chat for many channels over 1, 2, ... shard processes with `channel_shards.assign_channels` and reports overall messages/sec and how evenly the channels were spread. The shards load VADER and their database before a barrier, and only the time from the first shard starting to score until the last one finishes is counted.
+- `logging`: Logs at a steady 10,000 lines/sec (`--rate` to change) through a `Logger` writing directly to its handlers and through one using a queue, and reports the per-call latency of each.
+- `analytics`: Loads a database with 5 million chat messages (`--rows` to change) from a bursty trace whose bursts are also happier, runs `analytics.analyze_chat` over all channels and over one, and reports rows/sec scanned, peak memory and how many of the top hype moments fall in a burst.
+- `replay`: Replays a chat log (`--log`, or a synthetic bursty one) end to end through `replay.py` at 1x, 10x and maximum speed, and reports messages/sec, per-stage latency percentiles, peak memory and the clip decisions for each speed.
+- `pipeline`: Replays a chat log (`--log`, or a synthetic bursty one) at maximum speed through the `Pipeline` with different stage settings (everything on the event loop, the defaults, scoring on a thread pool and scoring on a process pool), and reports messages/sec, the clip decisions, which should not change, and the busiest stage for each.
+- `obs`: Starts a fake obs-websocket server on a local port and reports `OBSClient` throughput with requests sent one at a time and pipelined, then checks that a request OBS never answers times out, that the client reconnects when the server drops it, and that a wrong password is refused.
+- `startup`: Imports each module of the plugin in a fresh interpreter with `python -X importtime`, from an empty directory, and reports its import time and slowest dependencies. It exits with an error if a module takes longer than `--budget-ms` to import or creates any file when imported, so it can guard startup latency in CI.
+- `persistence`: Writes the same comments and scores to SQLite with a commit per row (the old path) and through a `WriteBehindQueue`, and reports rows/sec for each.
+
+Example:
+
+    python benchmarks.py activity --messages 1000000
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import zlib
+
+
+def burst_trace(message_count, base_rate=2.0, burst_rate=2000.0, burst_length=30.0, burst_every=300.0, seed=0):
+    """
+    This function generates message timestamps for a channel that idles at `base_rate` messages per second and bursts to `burst_rate` messages per second for `burst_length` seconds every `burst_every` seconds.
+    """
+    rng = random.Random(seed)
+    timestamp = 0.0
+    for _ in range(message_count):
+        in_burst = (timestamp % burst_every) < burst_length
+        timestamp += rng.expovariate(burst_rate if in_burst else base_rate)
+        yield timestamp
+
+
+def bench_activity(args):
+    from activity_monitor import ActivityMonitor
+
+    trace = list(burst_trace(args.messages))
+    monitor = ActivityMonitor(60)
+
+    start = time.perf_counter()
+    for timestamp in trace:
+        monitor.add_message(None, timestamp)
+    add_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for timestamp in trace[::100]:
+        monitor.get_activity_level(timestamp=timestamp)
+    read_elapsed = time.perf_counter() - start
+    reads = len(trace[::100])
+
+    end = trace[-1]
+    mismatches = []
+    for window in monitor.windows:
+        first_bucket = int(end // monitor.bucket_width) - monitor._window_buckets[window] + 1
+        expected = sum(1 for timestamp in trace if int(timestamp // monitor.bucket_width) >= first_bucket)
+        actual = monitor.get_message_count(window, end)
+        if expected != actual:
+            mismatches.append((window, expected, actual))
+
+    duration = trace[-1] - trace[0]
+    print(f"Replayed {len(trace)} messages covering {duration:.0f}s ({len(trace) / duration * 60:.0f} msgs/min on average)")
+    print(f"add_message:        {add_elapsed / len(trace) * 1e9:.0f} ns/call")
+    print(f"get_activity_level: {read_elapsed / reads * 1e9:.0f} ns/call")
+    print(f"Bucket ring:        {monitor._ring_size} buckets, {sys.getsizeof(monitor._counts)} bytes")
+    print("Rates at end of trace: " + ", ".join(f"{window}s={rate:.1f}/s" for window, rate in monitor.get_activity_levels(end).items()))
+    print("Window counts match exact recount" if not mismatches else f"Window count mismatches: {mismatches}")
+
+
+EMOTES = ["LUL", "PogChamp", "KEKW", "Kappa", "monkaS", "OMEGALUL", "PepeHands", "5Head", "Pog", "catJAM"]
+PHRASES = ["gg", "what a play", "no way", "this is so bad", "let's go", "clip it", "rip", "nice shot", "I love this stream", "that was terrible"]
+HYPE_PHRASES = ["nice shot", "I love this stream", "amazing play", "best moment ever", "haha yes"]
+
+
+def synthetic_chat(message_count, seed=0):
+    """
+    This function generates chat messages that look like busy Twitch chat: mostly repeated emotes, some common phrases, and a tail of one-off messages.
+    """
+    rng = random.Random(seed)
+    for index in range(message_count):
+        roll = rng.random()
+        if roll < 0.6:
+            emote = EMOTES[min(int(rng.paretovariate(1.2)) - 1, len(EMOTES) - 1)]
+            yield " ".join([emote] * rng.randint(1, 3))
+        elif roll < 0.9:
+            yield rng.choice(PHRASES)
+        else:
+            yield f"{rng.choice(PHRASES)} {index}"
+
+
+def load_chat_log(path):
+    """
+    This function reads chat messages from a file with either one JSON object per line (using its `message` field) or one plain message per line.
+    """
+    with open(path, encoding="utf-8") as log_file:
+        for line in log_file:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            if line.startswith("{"):
+                yield json.loads(line)["message"]
+            else:
+                yield line
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def latency_summary(latencies_ns):
+    latencies_ns = sorted(latencies_ns)
+    mean = sum(latencies_ns) / len(latencies_ns)
+    return f"mean={mean / 1000:.1f}us p50={percentile(latencies_ns, 0.5) / 1000:.1f}us p99={percentile(latencies_ns, 0.99) / 1000:.1f}us"
+
+
+async def _chat_loop(duration):
+    processed = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        processed += 1
+        await asyncio.sleep(0)
+    return processed / duration
+
+
+async def _bench_clip(args):
+    from clip_creator import ClipCreator
+    from replay import FakeOBSConnection
+
+    clip_creator = ClipCreator("localhost", 4444, "", clip_sensitivity=0, clip_length=args.clip_length,
+                               obs_client=FakeOBSConnection(latency=args.obs_latency))
+
+    idle_rate = await _chat_loop(args.clip_length)
+    await clip_creator.create_clip()
+    recording_rate = await _chat_loop(args.clip_length / 2)
+    await clip_creator.create_clip()  # merged into the running clip
+    await clip_creator.wait_for_clip()
+    clip_creator.close()
+    clip_creator.obs_connection.close()
+
+    print(f"Chat loop while idle:      {idle_rate:.0f} msgs/s")
+    print(f"Chat loop while recording: {recording_rate:.0f} msgs/s ({recording_rate / idle_rate:.0%} of idle)")
+    print(f"Clips created: {clip_creator.clips_created}, triggers merged: {clip_creator.triggers_merged}")
+    print(f"OBS requests: {[request for _, request in clip_creator.obs_connection.calls]}")
+
+
+def bench_clip(args):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            asyncio.run(_bench_clip(args))
+        finally:
+            os.chdir(cwd)
+
+
+def _replay_sentiment(analyzer, messages):
+    latencies = []
+    for message in messages:
+        start = time.perf_counter_ns()
+        analyzer.analyze_sentiment(message)
+        latencies.append(time.perf_counter_ns() - start)
+    analyzer.database.close()
+    return latencies
+
+
+def bench_sentiment(args):
+    from database import Database
+    from sentiment_analyzer import SentimentAnalyzer
+
+    messages = list(load_chat_log(args.log) if args.log else synthetic_chat(args.messages))
+    with tempfile.TemporaryDirectory() as directory:
+        uncached = _replay_sentiment(SentimentAnalyzer(Database(os.path.join(directory, "uncached.db")), cache_size=0), messages)
+        analyzer = SentimentAnalyzer(Database(os.path.join(directory, "cached.db")))
+        cached = _replay_sentiment(analyzer, messages)
+
+    print(f"Replayed {len(messages)} messages ({len(set(messages))} distinct)")
+    print(f"Without cache: {latency_summary(uncached)}")
+    print(f"With cache:    {latency_summary(cached)}")
+    print(f"Cache stats:   {analyzer.cache.stats()}")
+
+
+def bench_persistence(args):
+    from write_behind import WriteBehindQueue
+
+    rows = [(message, (index % 200 - 100) / 100) for index, message in enumerate(synthetic_chat(args.rows))]
+    create_table = "CREATE TABLE IF NOT EXISTS comments (comment TEXT, sentiment REAL)"
+    insert = "INSERT INTO comments VALUES (?, ?)"
+
+    with tempfile.TemporaryDirectory() as directory:
+        per_row_path = os.path.join(directory, "per_row.db")
+        connection = sqlite3.connect(per_row_path)
+        connection.execute(create_table)
+        start = time.perf_counter()
+        for row in rows[:args.per_row_limit]:
+            connection.execute(insert, row)
+            connection.commit()
+        per_row_elapsed = time.perf_counter() - start
+        per_row_count = min(len(rows), args.per_row_limit)
+        connection.close()
+
+        batched_path = os.path.join(directory, "batched.db")
+        connection = sqlite3.connect(batched_path)
+        connection.execute(create_table)
+        connection.close()
+        # Blocking, so every row is written and timed; the benchmark has no event loop to stall
+        writer = WriteBehindQueue(batched_path, batch_size=args.batch_size, overflow_policy="block")
+        start = time.perf_counter()
+        for row in rows:
+            writer.put(insert, row)
+        put_elapsed = time.perf_counter() - start
+        writer.close()
+        batched_elapsed = time.perf_counter() - start
+
+    print(f"Commit per row:   {per_row_count / per_row_elapsed:,.0f} rows/s ({per_row_count} rows)")
+    print(f"Write-behind:     {len(rows) / batched_elapsed:,.0f} rows/s ({len(rows)} rows, batch size {args.batch_size})")
+    print(f"put() cost:       {put_elapsed / len(rows) * 1e6:.2f} us/row")
+    print(f"Writer stats:     {writer.stats()}")
+
+
+def bench_batch(args):
+    from database import Database
+    from sentiment_analyzer import SentimentAnalyzer
+
+    rng = random.Random(0)
+    words = [word for phrase in PHRASES for word in phrase.split()] + EMOTES
+    counts = []
+    cores = 1
+    while cores < args.max_processes:
+        counts.append(cores)
+        cores *= 2
+    counts.append(args.max_processes)
+
+    print(f"Scoring {args.messages} distinct messages in batches of {args.batch_size}")
+    with tempfile.TemporaryDirectory() as directory:
+        for processes in counts:
+            messages = [f"{' '.join(rng.choices(words, k=rng.randint(3, 12)))} {processes}-{index}" for index in range(args.messages)]
+            analyzer = SentimentAnalyzer(Database(os.path.join(directory, f"batch{processes}.db")), processes=processes)
+            analyzer.analyze_sentiment_batch(messages[:args.batch_size])  # starts the pool
+            start = time.perf_counter()
+            for offset in range(args.batch_size, len(messages), args.batch_size):
+                analyzer.analyze_sentiment_batch(messages[offset:offset + args.batch_size])
+            elapsed = time.perf_counter() - start
+            analyzer.close()
+            analyzer.database.close()
+            print(f"{processes:>3} process(es): {(len(messages) - args.batch_size) / elapsed:,.0f} msgs/s")
+
+
+async def _ingest(policy, queue_size, message_count, batch_size, consumer_delay):
+    from chat_connector import ChatConnector
+
+    # The connector is a twitchio Bot holding an asyncio.Queue, so it is built on the loop that runs it
+    chat_connector = ChatConnector("", "", "bench", "!", [], max_queue_size=queue_size, overflow_policy=policy)
+
+    async def produce():
+        for index in range(message_count):
+            await chat_connector.publish(types.SimpleNamespace(content=f"message {index}"))
+            if index % 100 == 0:
+                await asyncio.sleep(0)  # let the consumer run, as the IRC reader would between reads
+
+    consumed = 0
+    producer = asyncio.create_task(produce())
+    start = time.perf_counter()
+    while not producer.done() or not chat_connector.messages.empty():
+        batch = await chat_connector.get_messages(batch_size, timeout=0.01)
+        consumed += len(batch)
+        if consumer_delay:
+            await asyncio.sleep(consumer_delay)
+    await producer
+    return consumed, time.perf_counter() - start, chat_connector.dropped_messages
+
+
+def bench_ingest(args):
+    from chat_connector import OVERFLOW_POLICIES
+
+    print(f"Publishing {args.messages} messages, queue size {args.queue_size}, consumer pause {args.consumer_delay * 1000:.1f}ms per batch")
+    for policy in OVERFLOW_POLICIES:
+        consumed, elapsed, dropped = asyncio.run(_ingest(policy, args.queue_size, args.messages, args.batch_size, args.consumer_delay))
+        print(f"{policy:>11}: {consumed / elapsed:,.0f} msgs/s consumed, {consumed} consumed, {dropped} dropped")
+
+
+def _shard_worker(channels, messages_per_channel, database_path, ready, results):
+    from channel_shards import DEFAULT_SETTINGS, ShardProcessor
+
+    processor = ShardProcessor(channels, {**DEFAULT_SETTINGS, 'database_path': database_path})
+    messages = [
+        (channels[index % len(channels)], message, index * 0.001)
+        for index, message in enumerate(synthetic_chat(messages_per_channel * len(channels), seed=zlib.crc32(",".join(channels).encode())))
+    ]
+    # Load VADER and open the database before the clock starts, then start together with the other shards
+    processor.analyzer.warm_up()
+    ready.wait()
+    start = time.monotonic()
+    triggers = 0
+    for offset in range(0, len(messages), 500):
+        triggers += len(processor.process_batch(messages[offset:offset + 500]))
+    end = time.monotonic()
+    processor.analyzer.database.close()
+    results.put((len(messages), start, end, triggers))
+
+
+def bench_shards(args):
+    import multiprocessing
+    from channel_shards import assign_channels
+
+    channels = [f"channel{index}" for index in range(args.channels)]
+    context = multiprocessing.get_context("spawn")
+    print(f"{args.channels} channels, {args.messages_per_channel} messages each")
+    with tempfile.TemporaryDirectory() as directory:
+        for shard_count in range(1, args.max_shards + 1):
+            assignments = assign_channels(channels, shard_count)
+            # Every shard waits here after starting up, so only the steady state is timed
+            ready = context.Barrier(len(assignments))
+            results = context.Queue()
+            processes = [
+                context.Process(target=_shard_worker, args=(shard_channels, args.messages_per_channel, os.path.join(directory, f"shard{shard_count}-{shard}.db"), ready, results))
+                for shard, shard_channels in assignments.items()
+            ]
+            for process in processes:
+                process.start()
+            outcomes = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+            # time.monotonic() is one system-wide clock, so the shards' times can be compared
+            elapsed = max(end for _, _, end, _ in outcomes) - min(start for _, start, _, _ in outcomes)
+            total = sum(count for count, _, _, _ in outcomes)
+            sizes = sorted(len(shard_channels) for shard_channels in assignments.values())
+            print(f"{shard_count:>3} shard(s): {total / elapsed:,.0f} msgs/s overall, channels per shard {sizes}, {sum(triggers for _, _, _, triggers in outcomes)} triggers")
+
+
+def _paced_logging(log, lines_per_second, seconds):
+    interval = 1.0 / lines_per_second
+    latencies = []
+    next_line = time.perf_counter()
+    for index in range(int(lines_per_second * seconds)):
+        while time.perf_counter() < next_line:
+            pass
+        start = time.perf_counter_ns()
+        log.info("chat message %d from %s: %s", index, "viewer", "PogChamp PogChamp")
+        latencies.append(time.perf_counter_ns() - start)
+        next_line += interval
+    return latencies
+
+
+def bench_logging(args):
+    import logging
+    from logger import Logger
+
+    print(f"Logging {args.rate:,} lines/s for {args.seconds}s")
+    with tempfile.TemporaryDirectory() as directory:
+        for use_queue in (False, True):
+            name = "queued" if use_queue else "direct"
+            log = Logger(f"bench-{name}", os.path.join(directory, f"{name}.log"), 10 * 1024 * 1024, 5, logging.WARNING, logging.DEBUG, use_queue=use_queue)
+            latencies = _paced_logging(log.logger, args.rate, args.seconds)
+            log.close()
+            for handler in log.logger.handlers:
+                handler.close()
+            print(f"{name:>6}: {latency_summary(latencies)}, dropped={log.dropped_messages}")
+
+
+def bench_database(args):
+    from database import Database, message_hash
+
+    rng = random.Random(0)
+    channels = [f"channel{index}" for index in range(args.channels)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "chat.db")
+        database = Database(path)
+        connection = sqlite3.connect(path)
+
+        start = time.perf_counter()
+        chunk = 100000
+        for offset in range(0, args.rows, chunk):
+            count = min(chunk, args.rows - offset)
+            connection.executemany(
+                "INSERT OR IGNORE INTO sentiments (message_hash, message, sentiment) VALUES (?, ?, ?)",
+                ((message_hash(f"message {index}"), f"message {index}", 0.0) for index in range(offset, offset + count)),
+            )
+            connection.executemany(
+                "INSERT INTO chat_messages (channel, timestamp, content, message_hash, sentiment) VALUES (?, ?, ?, ?, ?)",
+                ((channels[index % len(channels)], index * 0.01, f"message {index}", 0, 0.0) for index in range(offset, offset + count)),
+            )
+            connection.commit()
+        load_elapsed = time.perf_counter() - start
+        print(f"Loaded {args.rows:,} rows into each table in {load_elapsed:.1f}s")
+
+        for query, params in (
+            ("SELECT sentiment FROM sentiments WHERE message_hash = ?", (0,)),
+            ("SELECT timestamp, content, sentiment FROM chat_messages WHERE channel = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp", ("channel0", 0, 1)),
+        ):
+            plan = connection.execute("EXPLAIN QUERY PLAN " + query, params).fetchall()
+            print(f"Plan: {plan[0][-1]}")
+        connection.close()
+
+        keys = [f"message {rng.randrange(args.rows)}" for _ in range(args.lookups)]
+        start = time.perf_counter()
+        found = sum(database.get_sentiment_score(key) is not None for key in keys)
+        lookup_elapsed = time.perf_counter() - start
+        print(f"get_sentiment_score: {lookup_elapsed / len(keys) * 1e6:.1f} us/lookup ({found}/{len(keys)} found)")
+
+        span = args.rows * 0.01
+        start = time.perf_counter()
+        returned = 0
+        for _ in range(args.lookups // 10):
+            window_start = rng.uniform(0, span - 10)
+            returned += len(database.get_messages(rng.choice(channels), window_start, window_start + 10))
+        range_elapsed = time.perf_counter() - start
+        print(f"get_messages (10s window): {range_elapsed / (args.lookups // 10) * 1e6:.1f} us/query ({returned} rows returned)")
+        database.close()
+
+
+def bench_analytics(args):
+    import tracemalloc
+    import analytics
+    from database import Database
+
+    rng = random.Random(0)
+    channels = [f"channel{index}" for index in range(args.channels)]
+    burst_every, burst_length = 900.0, 10.0
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "chat.db")
+        Database(path).close()
+        connection = sqlite3.connect(path)
+        start = time.perf_counter()
+        trace = burst_trace(args.rows, base_rate=20.0, burst_rate=200.0, burst_length=burst_length, burst_every=burst_every)
+        chunk = 100000
+        for offset in range(0, args.rows, chunk):
+            rows = []
+            for timestamp in itertools.islice(trace, min(chunk, args.rows - offset)):
+                in_burst = timestamp % burst_every < burst_length
+                # One message in ten is spam, stored without a score
+                sentiment = None if rng.random() < 0.1 else rng.uniform(0.3, 0.9) if in_burst else rng.uniform(-0.4, 0.4)
+                rows.append((rng.choice(channels), 1700000000.0 + timestamp, "message", 0, sentiment))
+            connection.executemany("INSERT INTO chat_messages (channel, timestamp, content, message_hash, sentiment) VALUES (?, ?, ?, ?, ?)", rows)
+            connection.commit()
+        connection.close()
+        print(f"Loaded {args.rows:,} messages ({os.path.getsize(path) / 2**20:.0f} MiB) in {time.perf_counter() - start:.1f}s")
+
+        for label, channel in (("all channels", None), ("one channel", channels[0])):
+            result = analytics.analyze_chat(path, channel, top_n=args.top, chunk_size=args.chunk_size)
+            # A second, traced scan for memory, since tracing slows the scan down several times over
+            tracemalloc.start()
+            analytics.analyze_chat(path, channel, top_n=args.top, chunk_size=args.chunk_size)
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            in_bursts = sum((moment["timestamp"] - 1700000000.0) % burst_every <= burst_length + 10.0 for moment in result["moments"])
+            print(f"{label:>12}: {result['rows_per_second']:,.0f} rows/s, {result['rows']:,} rows in {result['elapsed']:.2f}s, "
+                  f"peak memory {peak_memory / 2**20:.1f} MiB, {in_bursts}/{len(result['moments'])} top moments in a burst")
+
+
+def write_replay_log(path, duration, base_rate=20.0, burst_rate=500.0, burst_length=3.0, burst_every=20.0, seed=0):
+    """
+    This function writes a synthetic JSONL chat log covering `duration` seconds, with bursts like `burst_trace`, for `replay.py` to replay. Bursts start `burst_every` seconds in, and most messages in a burst are hype from many different viewers, so the bursts shift the chat's sentiment. It returns the number of messages written.
+    """
+    rng = random.Random(seed)
+    start = 1700000000.0
+    count = 0
+    with open(path, "w", encoding="utf-8") as log_file:
+        timestamps = burst_trace(sys.maxsize, base_rate, burst_rate, burst_length, burst_every, seed)
+        for timestamp, message in zip(timestamps, synthetic_chat(sys.maxsize, seed)):
+            # Skip the trace's opening burst so the log starts with quiet chat
+            if timestamp < burst_length:
+                continue
+            if timestamp - burst_length > duration:
+                break
+            in_burst = timestamp % burst_every < burst_length
+            timestamp -= burst_length
+            if in_burst and rng.random() < 0.8:
+                message = rng.choice(HYPE_PHRASES)
+            log_file.write(json.dumps({"timestamp": start + timestamp, "channel": "bench", "user": f"viewer{rng.randrange(5000)}", "message": message}) + "\n")
+            count += 1
+    return count
+
+
+def bench_replay(args):
+    from replay import ReplayRunner
+
+    with tempfile.TemporaryDirectory() as directory:
+        log_path = args.log
+        if log_path is None:
+            log_path = os.path.join(directory, "chat.jsonl")
+            count = write_replay_log(log_path, args.duration)
+            print(f"Synthetic log: {count} messages over {args.duration:.0f}s")
+        for speed in args.speeds:
+            runner = ReplayRunner(log_path, speed, {"clip_length": args.clip_length})
+            result = asyncio.run(runner.run())
+            label = f"{speed:g}x" if speed else "max"
+            print(f"{label:>5}: {result['messages_per_second']:,.0f} msgs/s, {result['messages']} messages in {result['elapsed']:.2f}s, "
+                  f"peak memory {result['peak_memory_bytes'] / 2**20:.1f} MiB, {len(result['triggers'])} triggers, {result['clips_created']} clips")
+            for stage, latency in result["stage_latency"].items():
+                print(f"       {stage:<30} n={latency['count']:<6} p50={latency['p50_ns'] / 1000:.1f}us p99={latency['p99_ns'] / 1000:.1f}us max={latency['max_ns'] / 1000:.1f}us")
+
+
+PIPELINE_STAGE_SETTINGS = {
+    "all async": {"score": {"concurrency": "async"}, "persist": {"concurrency": "async"}},
+    "default": {},
+    "score on 4 threads": {"score": {"concurrency": "thread", "workers": 4}},
+    "score on {cpus} processes": {"score": {"concurrency": "process", "workers": "cpus"}},
+}
+
+
+def bench_pipeline(args):
+    from replay import ReplayRunner
+
+    cpus = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as directory:
+        log_path = args.log
+        if log_path is None:
+            log_path = os.path.join(directory, "chat.jsonl")
+            count = write_replay_log(log_path, args.duration)
+            print(f"Synthetic log: {count} messages over {args.duration:.0f}s")
+        for label, stages in PIPELINE_STAGE_SETTINGS.items():
+            stages = {stage: {key: cpus if value == "cpus" else value for key, value in settings.items()} for stage, settings in stages.items()}
+            result = asyncio.run(ReplayRunner(log_path, 0, {"clip_length": args.clip_length, "batch_size": args.batch_size, "stages": stages}).run())
+            # Every setting must make the same clip decisions, since stages pass batches on in order
+            print(f"{label.format(cpus=cpus):>22}: {result['messages_per_second']:,.0f} msgs/s, {len(result['triggers'])} triggers, {result['clips_created']} clips")
+            slowest = max(result["stage_latency"].items(), key=lambda item: item[1]["p50_ns"] * item[1]["count"])
+            print(f"{'':>22}  busiest stage {slowest[0]}, p50 {slowest[1]['p50_ns'] / 1000:.0f}us per batch")
+
+
+def bench_obs(args):
+    from fake_servers import FakeOBSWebSocketServer
+    from obs_client import OBSClient
+
+    server = FakeOBSWebSocketServer(latency=args.latency, password="secret")
+    client = OBSClient("127.0.0.1", server.port, "secret", request_timeout=2.0, initial_backoff=0.05)
+    client.start()
+    client.connected.wait(5)
+
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        client.call("GetStreamingStatus")
+    sequential = time.perf_counter() - start
+    start = time.perf_counter()
+    futures = [client.submit("GetStreamingStatus") for _ in range(args.requests)]
+    for future in futures:
+        future.result()
+    pipelined = time.perf_counter() - start
+    print(f"{args.requests} requests at {args.latency * 1000:.0f}ms OBS latency: one at a time {args.requests / sequential:,.0f} req/s, "
+          f"pipelined {args.requests / pipelined:,.0f} req/s ({sequential / pipelined:.1f}x)")
+
+    start = time.perf_counter()
+    try:
+        client.call("Hang", timeout=0.2)
+        print("Timeout: not raised")
+    except TimeoutError:
+        print(f"Timeout: raised after {(time.perf_counter() - start) * 1000:.0f}ms for a 200ms deadline")
+    client.close()
+    server.close()
+
+    server = FakeOBSWebSocketServer(latency=args.latency, drop_every=25)
+    client = OBSClient("127.0.0.1", server.port, request_timeout=2.0, initial_backoff=0.05)
+    succeeded = failed = 0
+    for _ in range(100):
+        try:
+            client.call("GetStreamingStatus")
+            succeeded += 1
+        except ConnectionError:
+            failed += 1
+    print(f"Reconnect: {succeeded} succeeded and {failed} failed over {server.connection_count} connections, {client.reconnects} reconnects")
+    client.close()
+    server.close()
+
+    server = FakeOBSWebSocketServer(password="secret")
+    client = OBSClient("127.0.0.1", server.port, "wrong", request_timeout=0.5)
+    try:
+        client.call("GetVersion")
+        print("Authentication: a wrong password was accepted")
+    except TimeoutError:
+        print("Authentication: a wrong password keeps the client disconnected")
+    client.close()
+    server.close()
+
+
+STARTUP_MODULES = ("metrics", "database", "logger", "sentiment_analyzer", "spam_filter", "sentiment_aggregator", "activity_monitor",
+                   "chat_connector", "obs_client", "clip_creator", "twitch_api", "pipeline", "replay", "analytics", "main")
+
+
+def _import_time(module, directory):
+    """
+    This function imports `module` in a fresh interpreter with `-X importtime`, run from an empty `directory`, and returns its cumulative import time in microseconds and its slowest dependencies.
+    """
+    source_path = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [source_path, os.environ.get("PYTHONPATH")]))}
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=directory, env=env, capture_output=True, text=True, check=True)
+    lines = [line for line in result.stderr.splitlines() if line.startswith("import time:") and "cumulative" not in line]
+    # Imports are listed as they finish, and interpreter startup ends with `site`
+    site_index = next((index for index, line in enumerate(lines) if line.endswith("| site")), -1)
+    timings = []
+    for line in lines[site_index + 1:]:
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings.append((int(self_us), int(cumulative_us), name.strip()))
+    cumulative = next(cumulative_us for _, cumulative_us, name in timings if name == module)
+    return cumulative, sorted(((self_us, name) for self_us, _, name in timings), reverse=True)[:3]
+
+
+def bench_startup(args):
+    failures = []
+    print(f"Import time per module (best of {args.repeat}), budget {args.budget_ms:.0f}ms")
+    for module in args.modules:
+        with tempfile.TemporaryDirectory() as directory:
+            runs = [_import_time(module, directory) for _ in range(args.repeat)]
+            created = sorted(os.listdir(directory))
+        cumulative, slowest = min(runs)
+        slowest = ", ".join(f"{name} {self_us / 1000:.1f}ms" for self_us, name in slowest)
+        print(f"{module:>20}: {cumulative / 1000:6.1f}ms  (slowest: {slowest})")
+        if cumulative / 1000 > args.budget_ms:
+            failures.append(f"{module} took {cumulative / 1000:.1f}ms to import")
+        if created:
+            failures.append(f"importing {module} created {created}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="StreamMatey microbenchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    activity = subparsers.add_parser("activity", help="ActivityMonitor burst trace replay")
+    activity.add_argument("--messages", type=int, default=500000)
+    activity.set_defaults(func=bench_activity)
+
+    clip = subparsers.add_parser("clip", help="Chat throughput while ClipCreator records")
+    clip.add_argument("--clip-length", type=float, default=2.0)
+    clip.add_argument("--obs-latency", type=float, default=0.05)
+    clip.set_defaults(func=bench_clip)
+
+    sentiment = subparsers.add_parser("sentiment", help="analyze_sentiment latency with and without the cache")
+    sentiment.add_argument("--log", help="chat log to replay instead of a synthetic one")
+    sentiment.add_argument("--messages", type=int, default=50000)
+    sentiment.set_defaults(func=bench_sentiment)
+
+    persistence = subparsers.add_parser("persistence", help="Commit-per-row vs write-behind rows/sec")
+    persistence.add_argument("--rows", type=int, default=200000)
+    persistence.add_argument("--per-row-limit", type=int, default=5000, help="rows to write on the slow commit-per-row path")
+    persistence.add_argument("--batch-size", type=int, default=500)
+    persistence.set_defaults(func=bench_persistence)
+
+    batch = subparsers.add_parser("batch", help="Batch sentiment scoring throughput against process count")
+    batch.add_argument("--messages", type=int, default=50000)
+    batch.add_argument("--batch-size", type=int, default=2000)
+    batch.add_argument("--max-processes", type=int, default=os.cpu_count() or 1)
+    batch.set_defaults(func=bench_batch)
+
+    ingest = subparsers.add_parser("ingest", help="ChatConnector queue throughput for each overflow policy")
+    ingest.add_argument("--messages", type=int, default=200000)
+    ingest.add_argument("--queue-size", type=int, default=10000)
+    ingest.add_argument("--batch-size", type=int, default=500)
+    ingest.add_argument("--consumer-delay", type=float, default=0.0, help="seconds the consumer pauses after each batch")
+    ingest.set_defaults(func=bench_ingest)
+
+    shards = subparsers.add_parser("shards", help="Multi-channel throughput against shard count")
+    shards.add_argument("--channels", type=int, default=24)
+    shards.add_argument("--messages-per-channel", type=int, default=2000)
+    shards.add_argument("--max-shards", type=int, default=os.cpu_count() or 1)
+    shards.set_defaults(func=bench_shards)
+
+    logging_parser = subparsers.add_parser("logging", help="Per-call logging latency, direct vs queued")
+    logging_parser.add_argument("--rate", type=int, default=10000, help="log lines per second")
+    logging_parser.add_argument("--seconds", type=float, default=3.0)
+    logging_parser.set_defaults(func=bench_logging)
+
+    database = subparsers.add_parser("database", help="Indexed lookups and range queries on a large database")
+    database.add_argument("--rows", type=int, default=10000000)
+    database.add_argument("--channels", type=int, default=20)
+    database.add_argument("--lookups", type=int, default=20000)
+    database.set_defaults(func=bench_database)
+
+    analytics = subparsers.add_parser("analytics", help="Scan rate and memory of the offline hype-moment analytics")
+    analytics.add_argument("--rows", type=int, default=5000000)
+    analytics.add_argument("--channels", type=int, default=3)
+    analytics.add_argument("--chunk-size", type=int, default=50000)
+    analytics.add_argument("--top", type=int, default=10)
+    analytics.set_defaults(func=bench_analytics)
+
+    replay = subparsers.add_parser("replay", help="End-to-end chat log replay at 1x, 10x and max speed")
+    replay.add_argument("--log", help="JSONL chat log to replay instead of a synthetic one")
+    replay.add_argument("--duration", type=float, default=30.0, help="seconds covered by the synthetic log")
+    replay.add_argument("--speeds", type=float, nargs="+", default=[1, 10, 0], help="replay speeds, 0 for as fast as possible")
+    replay.add_argument("--clip-length", type=float, default=5.0, help="clip length in seconds of log time")
+    replay.set_defaults(func=bench_replay)
+
+    pipeline = subparsers.add_parser("pipeline", help="Pipeline throughput with different stage concurrency settings")
+    pipeline.add_argument("--log", help="JSONL chat log to replay instead of a synthetic one")
+    pipeline.add_argument("--duration", type=float, default=60.0, help="seconds covered by the synthetic log")
+    pipeline.add_argument("--batch-size", type=int, default=100)
+    pipeline.add_argument("--clip-length", type=float, default=5.0, help="clip length in seconds of log time")
+    pipeline.set_defaults(func=bench_pipeline)
+
+    obs = subparsers.add_parser("obs", help="OBSClient pipelining, timeouts and reconnects against a fake OBS websocket")
+    obs.add_argument("--requests", type=int, default=500)
+    obs.add_argument("--latency", type=float, default=0.005, help="seconds the fake OBS takes to answer each request")
+    obs.set_defaults(func=bench_obs)
+
+    startup = subparsers.add_parser("startup", help="Import time of each module, failing over budget or on import side effects")
+    startup.add_argument("modules", nargs="*", default=STARTUP_MODULES)
+    startup.add_argument("--budget-ms", type=float, default=250.0, help="maximum cumulative import time of one module")
+    startup.add_argument("--repeat", type=int, default=3)
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+The `cache.py` script is part of the StreamMatey OBS Plugin software. It provides a `TTLCache` class, a small in-process cache that is bounded both in size and in age.
+
+Entries are kept in least-recently-used order. When the cache is full, adding a new entry evicts the least recently used one, and entries older than the time-to-live are treated as missing and removed when they are next looked up.
+
+The `TTLCache` class has the following methods:
+
+- `get(key, default=None)`: Returns the cached value for `key`, or `default` if it is missing or expired. Every lookup counts as a hit or a miss.
+- `set(key, value)`: Stores a value, evicting the least recently used entry if the cache is full.
+- `clear()`: Removes every entry without resetting the counters.
+- `stats()`: Returns a dictionary with the size of the cache and its hit, miss and eviction counters.
+
+The `hits`, `misses` and `evictions` counters and the `hit_rate` property can be read directly for monitoring. A cache with a `max_size` of 0 stores nothing, which is useful for measuring the uncached path.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    def __init__(self, max_size=10000, ttl=300.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate,
+        }
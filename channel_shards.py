@@ -0,0 +1,320 @@
+"""
+The `channel_shards.py` script is part of the StreamMatey OBS Plugin software. It runs clip detection for many Twitch channels from one host by splitting the channels across worker processes.
+
+Channels are assigned to shards with a `ConsistentHashRing`, so each channel always lands on the same shard, and changing the number of shards only moves the channels whose shard was added or removed. Each shard is a separate process with its own asyncio event loop, its own `ChatConnector` joined to just its channels, and its own `SentimentAnalyzer`, so chat for different channels is processed on different cores.
+
+Inside a shard, a `ShardProcessor` keeps a `ChannelState` for every channel: its own `ActivityMonitor` and `SentimentAggregator` (see `sentiment_aggregator.py`). When a channel's activity exceeds its threshold while its rolling sentiment spikes, the shard sends a clip trigger (a dictionary with the channel, timestamp, activity level, rolling sentiment and its z-score) to the parent process.
+
+Shards read the shared database directly, since SQLite in WAL mode lets any number of readers run alongside a writer, but they never write to it. SQLite allows one writer at a time, and writers in several processes would wait on each other's lock until one gave up with "database is locked" and its whole batch was lost. Instead, each shard's `Database` is given a `ShardWriter`, which sends the rows it is asked to store (chat messages and new sentiment scores) to the parent process over a queue, one list of rows per batch. The parent applies the rows of every shard through its own `Database`, the only writer of the file.
+
+In the parent process, a `ShardManager` starts the shards, applies their rows and collects their triggers, and a `ClipTriggerAggregator` handles the triggers. The aggregator drops triggers for a channel that arrive within `cooldown` seconds of its last accepted one and passes the rest to a callback, such as a coroutine that creates the clip for that channel.
+
+The script provides the following classes and functions:
+
+- `ConsistentHashRing(nodes, replicas=100)`: Maps keys to nodes. `get_node(key)` returns the node for a key, and `add_node(node)` and `remove_node(node)` change the ring.
+- `assign_channels(channels, shard_count)`: Returns a dictionary of shard index to the list of channels it handles.
+- `ChannelState`: The activity and sentiment state of one channel. `update(scores, timestamps, users=None)` records a batch of message scores, each at its own timestamp, and returns whether the channel should be clipped after the last of them.
+- `ShardWriter(write_queue, batch_size=500)`: Takes the place of a `WriteBehindQueue` in a shard's `Database`. `put(statement, params)` buffers a row and `flush()` sends the buffered rows to the parent; a full buffer is sent straight away.
+- `ShardProcessor(channels, settings, analyzer=None, write_queue=None)`: Holds the `ChannelState` of every channel in a shard. With a `write_queue`, its database sends its writes there through a `ShardWriter`. `process_batch(messages)` scores a batch of `(channel, content, timestamp)` or `(channel, content, timestamp, user)` tuples in one call and returns the clip triggers it produced, timed at the last message of each channel in the batch.
+- `run_shard(shard_index, channels, credentials, settings, trigger_queue, write_queue)`: The entry point of a shard process.
+- `ClipTriggerAggregator(on_trigger, cooldown=60)`: Deduplicates triggers and hands them to `on_trigger`.
+- `ShardManager(channels, credentials, settings=None, shard_count=None, on_trigger=None, cooldown=60)`: Starts the shard processes and the thread that writes their rows with `start()`, collects their triggers with `run()`, and stops them with `stop()`, after writing the rows they sent. Without `on_trigger`, triggers are only logged; `main.py` runs a `ShardManager` when `shard_count` is set in the configuration and passes each trigger to its `ClipCreator`.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from activity_monitor import ActivityMonitor
+from sentiment_aggregator import SentimentAggregator
+
+DEFAULT_SETTINGS = {
+    'activity_window': 60,  # seconds
+    'activity_threshold': 5.0,  # messages per second
+    'sentiment_threshold': 0.05,  # positive rolling sentiment
+    'sentiment_half_life': 5.0,  # seconds
+    'sentiment_z_threshold': 2.0,
+    'database_path': 'comments.db',
+    'batch_size': 500,
+}
+
+
+def _ring_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class ConsistentHashRing:
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self._hashes = []
+        self._nodes = {}
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node):
+        for replica in range(self.replicas):
+            point = _ring_hash(f"{node}#{replica}")
+            bisect.insort(self._hashes, point)
+            self._nodes[point] = node
+
+    def remove_node(self, node):
+        for replica in range(self.replicas):
+            point = _ring_hash(f"{node}#{replica}")
+            self._hashes.remove(point)
+            del self._nodes[point]
+
+    def get_node(self, key):
+        if not self._hashes:
+            raise LookupError("The hash ring has no nodes")
+        index = bisect.bisect(self._hashes, _ring_hash(key)) % len(self._hashes)
+        return self._nodes[self._hashes[index]]
+
+
+def assign_channels(channels, shard_count):
+    """
+    This function spreads channels over `shard_count` shards by consistent hashing and returns a dictionary of shard index to channel list. Shards with no channels are left out.
+    """
+    ring = ConsistentHashRing(range(shard_count))
+    shards = {}
+    for channel in channels:
+        shards.setdefault(ring.get_node(channel.lower()), []).append(channel)
+    return shards
+
+
+class ChannelState:
+    def __init__(self, channel, settings):
+        self.channel = channel
+        self.activity_threshold = settings['activity_threshold']
+        self.activity_monitor = ActivityMonitor(settings['activity_window'])
+        self.sentiment = SentimentAggregator(
+            settings['activity_window'],
+            half_life=settings['sentiment_half_life'],
+            z_threshold=settings['sentiment_z_threshold'],
+            sentiment_threshold=settings['sentiment_threshold'],
+        )
+        self.message_count = 0
+
+    @property
+    def last_sentiment(self):
+        return self.sentiment.get_ewma()
+
+    def update(self, scores, timestamps, users=None):
+        users = users or [None] * len(scores)
+        for score, timestamp, user in zip(scores, timestamps, users):
+            self.activity_monitor.add_message(None, timestamp)
+            self.sentiment.add_score(score, user, timestamp)
+        self.message_count += len(scores)
+        timestamp = timestamps[-1]
+        return (self.activity_monitor.get_activity_level(timestamp=timestamp) > self.activity_threshold
+                and self.sentiment.is_spike(timestamp))
+
+
+class ShardWriter:
+    def __init__(self, write_queue, batch_size=500):
+        self.write_queue = write_queue
+        self.batch_size = batch_size
+        self.queued = 0
+        self.dropped = 0
+        self._rows = []
+
+    def put(self, statement, params, timeout=None):
+        self._rows.append((statement, params))
+        self.queued += 1
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+        return True
+
+    def flush(self, timeout=None):
+        if self._rows:
+            rows, self._rows = self._rows, []
+            self.write_queue.put(rows)
+        return True
+
+    def close(self):
+        self.flush()
+
+    def stats(self):
+        return {'queued': self.queued, 'written': 0, 'dropped': 0, 'batches': 0, 'failed_batches': 0, 'queue_depth': len(self._rows)}
+
+
+class ShardProcessor:
+    def __init__(self, channels, settings, analyzer=None, write_queue=None):
+        # Imported here so the parent process, which only aggregates triggers, never loads VADER
+        from database import Database
+        from sentiment_analyzer import SentimentAnalyzer
+
+        self.settings = settings
+        self.channels = {channel.lower(): ChannelState(channel, settings) for channel in channels}
+        if analyzer is None:
+            writer = ShardWriter(write_queue, settings['batch_size']) if write_queue is not None else None
+            analyzer = SentimentAnalyzer(Database(settings['database_path'], writer=writer))
+        self.analyzer = analyzer
+
+    def process_batch(self, messages):
+        scores = self.analyzer.analyze_sentiment_batch([message[1] for message in messages])
+        by_channel = {}
+        for message, score in zip(messages, scores):
+            channel, content, timestamp = message[:3]
+            self.analyzer.database.store_comment(content, channel=channel, timestamp=timestamp, sentiment=float(score))
+            channel_scores, channel_timestamps, channel_users = by_channel.setdefault(channel.lower(), ([], [], []))
+            channel_scores.append(float(score))
+            channel_timestamps.append(timestamp)
+            channel_users.append(message[3] if len(message) > 3 else None)
+        triggers = []
+        for channel, (channel_scores, channel_timestamps, channel_users) in by_channel.items():
+            state = self.channels.get(channel)
+            if state is None:
+                continue
+            if state.update(channel_scores, channel_timestamps, channel_users):
+                timestamp = channel_timestamps[-1]
+                triggers.append({
+                    'channel': state.channel,
+                    'timestamp': timestamp,
+                    'activity': state.activity_monitor.get_activity_level(timestamp=timestamp),
+                    'sentiment': state.last_sentiment,
+                    'z_score': state.sentiment.get_z_score(timestamp),
+                })
+        return triggers
+
+
+async def _run_shard(shard_index, channels, credentials, settings, trigger_queue, write_queue):
+    from chat_connector import ChatConnector
+    from pipeline import ChatEvent
+
+    processor = ShardProcessor(channels, settings, write_queue=write_queue)
+    chat_connector = ChatConnector(
+        credentials['irc_token'],
+        credentials['client_id'],
+        credentials['nick'],
+        credentials.get('prefix', '!'),
+        channels,
+    )
+    chat_task = asyncio.create_task(chat_connector.connect_to_chat())
+    logging.info(f"Shard {shard_index} handling {len(channels)} channels")
+    while not chat_task.done():
+        messages = await chat_connector.get_messages(settings['batch_size'], timeout=1.0)
+        if not messages:
+            continue
+        events = [ChatEvent.from_message(message) for message in messages]
+        batch = [(event.channel, event.content, event.timestamp, event.user) for event in events]
+        for trigger in processor.process_batch(batch):
+            trigger_queue.put(trigger)
+        # Hand the batch's rows to the parent, which writes them
+        processor.analyzer.database.flush()
+
+
+def run_shard(shard_index, channels, credentials, settings, trigger_queue, write_queue):
+    """
+    This function is the entry point of a shard process. It runs the shard's event loop until its chat connection ends.
+    """
+    asyncio.run(_run_shard(shard_index, channels, credentials, settings, trigger_queue, write_queue))
+
+
+class ClipTriggerAggregator:
+    def __init__(self, on_trigger, cooldown=60):
+        self.on_trigger = on_trigger
+        self.cooldown = cooldown
+        self._last_trigger = {}
+        self.accepted = 0
+        self.suppressed = 0
+
+    async def handle(self, trigger):
+        last = self._last_trigger.get(trigger['channel'])
+        if last is not None and trigger['timestamp'] - last < self.cooldown:
+            self.suppressed += 1
+            return False
+        self._last_trigger[trigger['channel']] = trigger['timestamp']
+        self.accepted += 1
+        result = self.on_trigger(trigger)
+        if asyncio.iscoroutine(result):
+            await result
+        return True
+
+
+class ShardManager:
+    def __init__(self, channels, credentials, settings=None, shard_count=None, on_trigger=None, cooldown=60):
+        self.credentials = credentials
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        self.shard_count = shard_count or os.cpu_count() or 1
+        self.assignments = assign_channels(channels, self.shard_count)
+        self.aggregator = ClipTriggerAggregator(on_trigger or self._log_trigger, cooldown)
+        self._context = multiprocessing.get_context('spawn')
+        self.trigger_queue = self._context.Queue()
+        self.write_queue = self._context.Queue()
+        self.rows_written = 0
+        self.processes = []
+        self._database = None
+        self._writer_thread = None
+        self._stopping = threading.Event()
+
+    @staticmethod
+    def _log_trigger(trigger):
+        logging.info(f"Clip trigger for {trigger['channel']}: {trigger['activity']:.1f} msgs/s, sentiment {trigger['sentiment']:.2f}")
+
+    def _write_rows(self):
+        # The one writer of the database: applies the rows every shard sends, in the order they arrive
+        while True:
+            try:
+                rows = self.write_queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            for statement, params in rows:
+                self._database.writer.put(statement, params)
+            self.rows_written += len(rows)
+
+    def start(self):
+        from database import get_database
+
+        self._database = get_database(self.settings['database_path'])
+        self._writer_thread = threading.Thread(target=self._write_rows, name="shard-writer", daemon=True)
+        self._writer_thread.start()
+        for shard_index, channels in self.assignments.items():
+            process = self._context.Process(
+                target=run_shard,
+                args=(shard_index, channels, self.credentials, self.settings, self.trigger_queue, self.write_queue),
+                name=f"shard-{shard_index}",
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while any(process.is_alive() for process in self.processes):
+            try:
+                trigger = await loop.run_in_executor(None, self.trigger_queue.get, True, 1.0)
+            except queue.Empty:
+                continue
+            await self.aggregator.handle(trigger)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        self.processes.clear()
+        if self._writer_thread is not None:
+            # Rows already sent are still written
+            self._stopping.set()
+            self._writer_thread.join()
+            self._writer_thread = None
+            self._database.flush()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    manager = ShardManager(
+        ['channel1', 'channel2', 'channel3', 'channel4'],
+        {'irc_token': 'oauth:your_oauth_token', 'client_id': 'your_client_id', 'nick': 'your_bot_name'},
+    )
+    manager.start()
+    try:
+        asyncio.run(manager.run())
+    finally:
+        manager.stop()
@@ -1,26 +1,60 @@
 """
 The `chat_connector.py` script is part of the StreamMatey OBS Plugin software. It provides a `ChatConnector` class for connecting to and interacting with Twitch chat.
 
-The `ChatConnector` class is a subclass of `commands.Bot` from the `twitchio.ext` module. It extends the base class with additional methods for handling chat events and managing the chat connection.
+The `ChatConnector` class is a subclass of `commands.Bot` from the `twitchio.ext` module. It extends the base class with additional methods for handling chat events and managing the chat connection. Importing twitchio (and aiohttp under it) takes a few hundred milliseconds, so the module keeps the connector's methods in a plain base class and only builds `ChatConnector` on top of `commands.Bot`, importing twitchio, the first time `ChatConnector` is accessed. `OVERFLOW_POLICIES` and `ConnectionState` are available without it, and callers that only build a connector at run time import it where they build it.
 
 The `ChatConnector` class has the following methods:
 
-- `__init__(irc_token, client_id, nick, prefix, initial_channels)`: Initializes a new instance of the `ChatConnector` class. The parameters are used to authenticate with Twitch and configure the bot.
+- `__init__(irc_token, client_id, nick, prefix, initial_channels, max_queue_size=10000, overflow_policy='drop_oldest', sample_every=10, initial_backoff=1.0, max_backoff=60.0, max_outgoing_buffer=100, irc_host=None)`: Initializes a new instance of the `ChatConnector` class. The first parameters are used to authenticate with Twitch and configure the bot, and the rest configure the message queue and reconnection. `irc_host` replaces Twitch's IRC WebSocket address, for example with a local test server.
 
-- `event_ready()`: An event handler that is called when the bot is ready. It prints a message indicating that the bot has successfully connected to chat.
+- `event_ready()`: An event handler that is called when the bot is ready. It prints a message indicating that the bot has successfully connected to chat, records how long a reconnect took, sends any buffered outgoing messages, and starts watching the new connection. twitchio reconnects by itself when its connection closes, without raising or returning from `start()` and without an event, so the connector waits for each connection to close and marks the time it did; the next `event_ready` is then counted as a reconnect.
 
-- `event_message(message)`: An event handler that is called when a new chat message is received. It prints the content of the message and then handles any commands in the message.
+- `event_message(message)`: An event handler that is called when a new chat message is received. It publishes the message to the connector's message queue and then handles any commands in the message.
 
-- `connect_to_chat()`: A method that starts the bot and manages the chat connection. If an error occurs while starting the bot, the method waits for 5 seconds and then tries to connect again.
+- `publish(message)`: Adds a message to the bounded `messages` queue. When the queue is full, the `overflow_policy` decides what happens: `'drop_oldest'` discards the oldest queued message, `'sample'` keeps one in every `sample_every` new messages (each replacing the oldest) and discards the rest, and `'block'` waits for room, which holds up reading from chat. Discarded messages are counted in `dropped_messages`.
+
+- `get_message()`: Waits for and returns the next message.
+
+- `get_messages(max_n, timeout=None)`: Waits up to `timeout` seconds for a message, then returns it along with every other message already queued, up to `max_n` in total. It returns an empty list if nothing arrived in time.
+
+The `ChatConnector` can also be used as an async iterator (`async for message in chat_connector`) that yields messages as they arrive.
+
+- `connect_to_chat()`: A method that starts the bot and supervises the chat connection. Reconnects after a dropped connection are left to twitchio and only tracked; when `start()` itself fails or returns, as it does when the first connection attempt fails, the connector waits and tries again in a loop, until `stop()` is called. The wait is drawn at random between zero and an exponentially growing ceiling (`initial_backoff` doubling up to `max_backoff` seconds), so bots that lose their connections at the same moment do not all reconnect at the same moment. The backoff resets once a connection is ready.
+
+- `send_message(channel, content)`: Sends a message to a channel. While the bot is not connected, messages are buffered (up to `max_outgoing_buffer`, dropping the oldest and counting it as lost) and sent in order once the connection is ready again.
+
+- `stop()`: Stops the bot and the reconnect loop and closes the connection.
+
+- `health()`: Returns a dictionary describing the connection: its `state` (one of the `ConnectionState` values `disconnected`, `connecting`, `connected`, `reconnecting` and `closed`) and how long it has been in it, the number of reconnects and how long they took, an estimate of the chat messages missed while disconnected (based on the chat rate before the drop, since IRC gives no way to count them), and the incoming and outgoing messages dropped.
 
 In the main part of the script, a `ChatConnector` instance is created with the necessary Twitch credentials and a list of channels to join. The bot is then run with the `run` method. This starts the bot and begins receiving and handling chat messages.
 """
 import asyncio
-from twitchio.ext import commands
+import collections
+import enum
+import logging
+import random
+import time
+from activity_monitor import ActivityMonitor
+import metrics
 
-class ChatConnector(commands.Bot):
+OVERFLOW_POLICIES = ('drop_oldest', 'sample', 'block')
 
-    def __init__(self, irc_token, client_id, nick, prefix, initial_channels):
+messages_received = metrics.counter('chat.messages_received')
+messages_dropped = metrics.counter('chat.messages_dropped')
+
+class ConnectionState(enum.Enum):
+    DISCONNECTED = 'disconnected'
+    CONNECTING = 'connecting'
+    CONNECTED = 'connected'
+    RECONNECTING = 'reconnecting'
+    CLOSED = 'closed'
+
+class _ChatConnector:
+    # Combined with twitchio's commands.Bot by _connector_class, so super() below is the Bot
+
+    def __init__(self, irc_token, client_id, nick, prefix, initial_channels, max_queue_size=10000, overflow_policy='drop_oldest', sample_every=10,
+                 initial_backoff=1.0, max_backoff=60.0, max_outgoing_buffer=100, irc_host=None):
         super().__init__(
             irc_token=irc_token,
             client_id=client_id,
@@ -28,23 +62,196 @@ class ChatConnector(commands.Bot):
             prefix=prefix,
             initial_channels=initial_channels,
         )
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Invalid overflow policy: {overflow_policy}")
+        if irc_host is not None:
+            self._ws._host = irc_host
+        self.overflow_policy = overflow_policy
+        self.sample_every = sample_every
+        self.messages = asyncio.Queue(maxsize=max_queue_size)
+        self.received_messages = 0
+        self.dropped_messages = 0
+        self._overflowed = 0
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.state = ConnectionState.DISCONNECTED
+        self.state_changed_at = time.monotonic()
+        self.reconnects = 0
+        self.reconnect_times = collections.deque(maxlen=100)
+        self.estimated_missed_messages = 0
+        self.lost_outgoing_messages = 0
+        self._outgoing = collections.deque(maxlen=max_outgoing_buffer)
+        self._reconnect_attempt = 0
+        self._disconnected_at = None
+        self._watched_websocket = None
+        self._watch_task = None
+        self._start_task = None
+        self._chat_rate = ActivityMonitor(60, windows=(60,), clock=time.monotonic)
+        metrics.gauge('chat.queue_depth', self.messages.qsize)
+
+    def _set_state(self, state):
+        if state is not self.state:
+            logging.info(f"Chat connection {self.state.value} -> {state.value}")
+            self.state = state
+            self.state_changed_at = time.monotonic()
 
     async def event_ready(self):
         print(f"Successfully connected to chat as {self.nick}")
+        now = time.monotonic()
+        if self._disconnected_at is not None:
+            outage = now - self._disconnected_at
+            self.reconnects += 1
+            self.reconnect_times.append(outage)
+            # IRC has no sequence numbers, so estimate what was missed from the chat rate before the drop
+            self.estimated_missed_messages += round(self._chat_rate.get_activity_level(timestamp=self._disconnected_at) * outage)
+            logging.info(f"Reconnected to chat after {outage:.1f}s")
+            self._disconnected_at = None
+        self._reconnect_attempt = 0
+        self._set_state(ConnectionState.CONNECTED)
+        # Twitch's welcome has two codes twitchio treats as ready, so a connection is only watched once
+        websocket = self._ws._websocket
+        if websocket is not None and websocket is not self._watched_websocket:
+            self._watched_websocket = websocket
+            self._watch_task = asyncio.create_task(self._watch_connection(websocket))
+        await self._replay_outgoing()
+
+    async def _watch_connection(self, websocket):
+        await websocket.wait_closed()
+        if self.state is ConnectionState.CLOSED:
+            return
+        if self._disconnected_at is None:
+            self._disconnected_at = time.monotonic()
+        logging.warning("Lost the chat connection, twitchio is reconnecting")
+        self._set_state(ConnectionState.RECONNECTING)
 
+    @metrics.timed('chat.event_message')
     async def event_message(self, message):
-        print(message.content)
+        await self.publish(message)
         await self.handle_commands(message)
 
-    async def connect_to_chat(self):
+    async def publish(self, message):
+        self.received_messages += 1
+        messages_received.inc()
+        self._chat_rate.add_message(message)
+        if self.overflow_policy == 'block':
+            await self.messages.put(message)
+            return
+        if self.messages.full():
+            self._overflowed += 1
+            if self.overflow_policy == 'sample' and self._overflowed % self.sample_every:
+                # Keep one in every `sample_every` messages while chat outpaces the consumer
+                self.dropped_messages += 1
+                messages_dropped.inc()
+                return
+            self.messages.get_nowait()
+            self.dropped_messages += 1
+            messages_dropped.inc()
+        self.messages.put_nowait(message)
+
+    async def get_message(self):
+        return await self.messages.get()
+
+    async def get_messages(self, max_n, timeout=None):
         try:
-            await super().start()
-        except Exception as e:
-            print(f"Error occurred: {e}")
-            await asyncio.sleep(5)
-            await self.connect_to_chat()
+            batch = [await asyncio.wait_for(self.messages.get(), timeout)]
+        except asyncio.TimeoutError:
+            return []
+        while len(batch) < max_n and not self.messages.empty():
+            batch.append(self.messages.get_nowait())
+        return batch
+
+    async def __aiter__(self):
+        while True:
+            yield await self.messages.get()
+
+    async def send_message(self, channel, content):
+        if self.state is ConnectionState.CONNECTED:
+            try:
+                await self.get_channel(channel).send(content)
+                return True
+            except Exception as e:
+                logging.warning(f"Failed to send to {channel}, buffering until reconnected: {e}")
+        if len(self._outgoing) == self._outgoing.maxlen:
+            self.lost_outgoing_messages += 1
+        self._outgoing.append((channel, content))
+        return False
+
+    async def _replay_outgoing(self):
+        while self._outgoing and self.state is ConnectionState.CONNECTED:
+            channel, content = self._outgoing.popleft()
+            try:
+                await self.get_channel(channel).send(content)
+            except Exception as e:
+                logging.warning(f"Failed to replay message to {channel}: {e}")
+                self._outgoing.appendleft((channel, content))
+                return
+
+    def _backoff_delay(self):
+        # Full jitter spreads reconnects from many bots over the whole backoff interval
+        ceiling = min(self.max_backoff, self.initial_backoff * 2 ** self._reconnect_attempt)
+        self._reconnect_attempt += 1
+        return random.uniform(0, ceiling)
+
+    async def connect_to_chat(self):
+        while self.state is not ConnectionState.CLOSED:
+            self._set_state(ConnectionState.CONNECTING if self._disconnected_at is None else ConnectionState.RECONNECTING)
+            self._start_task = asyncio.ensure_future(super().start())
+            try:
+                await self._start_task
+            except asyncio.CancelledError:
+                if self.state is not ConnectionState.CLOSED:
+                    raise
+            except Exception as e:
+                logging.error(f"Chat connection error: {e}")
+            if self.state is ConnectionState.CLOSED:
+                break
+            if self._disconnected_at is None:
+                self._disconnected_at = time.monotonic()
+            self._set_state(ConnectionState.DISCONNECTED)
+            delay = self._backoff_delay()
+            logging.info(f"Reconnecting to chat in {delay:.1f}s (attempt {self._reconnect_attempt})")
+            await asyncio.sleep(delay)
+
+    async def stop(self):
+        self._set_state(ConnectionState.CLOSED)
+        # twitchio would reconnect a closed socket, so its listener is cancelled first
+        if self._start_task is not None:
+            self._start_task.cancel()
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+        websocket = self._ws._websocket
+        if websocket is not None:
+            await websocket.close()
+
+    def health(self):
+        return {
+            'state': self.state.value,
+            'state_age': time.monotonic() - self.state_changed_at,
+            'reconnect_attempt': self._reconnect_attempt,
+            'reconnects': self.reconnects,
+            'last_time_to_reconnect': self.reconnect_times[-1] if self.reconnect_times else None,
+            'mean_time_to_reconnect': sum(self.reconnect_times) / len(self.reconnect_times) if self.reconnect_times else None,
+            'estimated_missed_messages': self.estimated_missed_messages,
+            'dropped_messages': self.dropped_messages,
+            'buffered_outgoing_messages': len(self._outgoing),
+            'lost_outgoing_messages': self.lost_outgoing_messages,
+        }
+
+def _connector_class():
+    from twitchio.ext import commands
+
+    return type('ChatConnector', (_ChatConnector, commands.Bot), {'__module__': __name__})
+
+def __getattr__(name):
+    # Only code that builds a connector pays for importing twitchio
+    if name == 'ChatConnector':
+        global ChatConnector
+        ChatConnector = _connector_class()
+        return ChatConnector
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
+    ChatConnector = _connector_class()
     irc_token = "oauth:your_oauth_token"
     client_id = "your_client_id"
     nick = "your_bot_name"
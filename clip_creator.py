@@ -1,60 +1,179 @@
 """
 The `clip_creator.py` script is a crucial part of the StreamMatey OBS Plugin software. It interfaces with the Open Broadcaster Software (OBS) using its API to automate the process of creating video clips during a live streaming session. The script is designed to help content creators using the StreamMatey OBS Plugin by automating the clip creation process based on certain conditions.
-The conditions for clip creation are determined by chat activity and sentiment. When these conditions are met, the script sends a command to OBS to start recording, creating a video clip of the live stream. After a specified length of time (default is 60 seconds), the script sends another command to OBS to stop recording, thus ending the clip.
-The `ClipCreator` class within the script encapsulates the functionality needed to interact with OBS and manage the clip creation process. It maintains a connection to OBS through the `obswebsocket` library and provides methods to start and stop recording.
-The class also interacts with a SQLite database (`comments.db`) to store and retrieve comments from the chat. This is used in conjunction with the sentiment analysis to determine when to create a clip. The `store_comment` method stores a new comment in the database, and the `get_comment_sentiment` method retrieves the sentiment score for a given comment.
-The `ClipCreator` class is initialized with several parameters, including the host and port for the OBS connection, the password for OBS, the sensitivity for clip creation (which could be based on the volume or sentiment of chat activity), and the length of the clip to be created.
-In the `__main__` section of the script, an instance of the `ClipCreator` class is created and used to establish a connection with OBS and create a clip. This serves as an example of how to use the `ClipCreator` class.
+The conditions for clip creation are determined by chat activity and sentiment. When these conditions are met, the script sends a command to OBS to start recording, creating a video clip of the live stream. After a specified length of time (default is 60 seconds), the script sends another command to OBS to stop recording, thus ending the clip. Clip creation never blocks the asyncio event loop: `create_clip` schedules the recording as a background task and returns immediately, and the OBS requests themselves go through the shared `OBSClient` (see `obs_client.py`), which sends them from its own worker thread and reconnects to OBS if the connection drops. A trigger that arrives while a clip is already recording extends that recording instead of starting a new one, up to `max_clip_length` seconds in total.
+Recording only after the threshold trips misses the moment that caused it, so the creator also has a replay buffer mode (`mode='replay_buffer'`). In this mode OBS keeps its replay buffer running (`start_replay_buffer`, with the buffer length in OBS set to `clip_length`) and a trigger saves it `post_roll` seconds later, so the clip holds both the lead-up and the reaction, and OBS only writes a file when there is something to keep. Triggers that arrive before the save are merged into it, since the saved clip already contains them. In both modes, triggers within `min_clip_interval` seconds of the end of the last clip are dropped.
+Every clip is stored in the `clips` table of the database with its start and end timestamps, the time of the trigger that started it and the highest score among its triggers, which callers pass to `create_clip(score, channel, timestamp)`. Timestamps are in stream time; `time_scale` lets a replay of a recorded chat log (see `replay.py`) run clips faster than wall-clock time.
+The `ClipCreator` class within the script encapsulates the functionality needed to interact with OBS and manage the clip creation process. It talks to OBS through the `OBSClient` shared with the rest of the plugin (or the one passed as `obs_client`) and provides methods to start and stop recording. `is_recording` reports whether a clip is in progress, `wait_for_clip` waits for the current clip to finish, and `close` flushes the database; a clip that fails, for example because OBS refuses a request, is logged and counted in `clips_failed` rather than raised from its task, which nothing may ever await; the shared client is closed by whoever owns it.
+The class also uses the shared chat database (see `database.py`, `comments.db` by default) to store and retrieve comments from the chat. This is used in conjunction with the sentiment analysis to determine when to create a clip. The `store_comment` method queues a new comment to be stored in the database, which writes comments in batches from a background thread, and the `get_comment_sentiment` method retrieves the sentiment score for a given comment.
+The `ClipCreator` class is initialized with several parameters, including the host and port for the OBS connection, the password for OBS, the sensitivity for clip creation (which could be based on the volume or sentiment of chat activity), the length of the clip to be created, the maximum length a clip can be extended to by merged triggers, optionally the `Database` and `OBSClient` to use, and the clip mode with its post-roll and rate limit.
+In the `__main__` section of the script, an instance of the `ClipCreator` class is created and used, inside an asyncio event loop, to establish a connection with OBS and create a clip. This serves as an example of how to use the `ClipCreator` class.
 Overall, the `clip_creator.py` script plays a vital role in the StreamMatey OBS Plugin software, providing an automated and intelligent way to create clips based on chat activity and sentiment during a live stream.
 """
 
+import asyncio
 import logging
-from obswebsocket import obsws, requests
 import time
-import sqlite3
+from database import get_database
+from obs_client import get_obs_client
+import metrics
+
+CLIP_MODES = ('recording', 'replay_buffer')
+
+clips_triggered = metrics.counter('clips.triggered')
+clips_merged = metrics.counter('clips.merged')
+clips_rate_limited = metrics.counter('clips.rate_limited')
+clips_created = metrics.counter('clips.created')
+clips_failed = metrics.counter('clips.failed')
 
 class ClipCreator:
-    def __init__(self, host, port, password, clip_sensitivity, clip_length=60):
+    def __init__(self, host, port, password, clip_sensitivity, clip_length=60, max_clip_length=300, database=None,
+                 mode='recording', post_roll=10, min_clip_interval=30, time_scale=1.0, obs_client=None):
+        if mode not in CLIP_MODES:
+            raise ValueError(f"Unknown clip mode {mode!r}, expected one of {CLIP_MODES}")
         self.host = host
         self.port = port
         self.password = password
         self.clip_sensitivity = clip_sensitivity
         self.clip_length = clip_length
-        self.obs_connection = None
-        self.db_connection = sqlite3.connect('comments.db')
+        self.max_clip_length = max_clip_length
+        self.mode = mode
+        self.post_roll = post_roll
+        self.min_clip_interval = min_clip_interval
+        # Seconds of stream time per second of wall time; replays run faster than 1
+        self.time_scale = time_scale
+        self.obs_connection = obs_client
+        self.database = database if database is not None else get_database()
+        self._clip_task = None
+        # Clip times are stream timestamps; _clip_started_at is the loop time of the first trigger
+        self._clip_started_at = None
+        self._clip_first_trigger = None
+        self._clip_end = None
+        self._clip_score = None
+        self._clip_channel = None
+        self._last_clip_end = None
+        self.clips_created = 0
+        self.clips_failed = 0
+        self.triggers_merged = 0
+        self.triggers_rate_limited = 0
 
     def initialize_obs_connection(self):
+        # The client connects (and reconnects) in the background; requests queue until it is connected
+        if self.obs_connection is None:
+            self.obs_connection = get_obs_client(self.host, self.port, self.password)
+        self.obs_connection.start()
+
+    async def _call_obs(self, request):
+        # The client sends the request from its worker thread; awaiting the future never blocks the loop
+        return await asyncio.wrap_future(self.obs_connection.submit(request))
+
+    async def start_replay_buffer(self):
+        try:
+            await self._call_obs('StartReplayBuffer')
+            logging.info("Replay buffer started")
+        except Exception as e:
+            # OBS refuses to start a buffer that is already running
+            logging.warning(f"Failed to start the replay buffer: {e}")
+
+    async def stop_replay_buffer(self):
+        try:
+            await self._call_obs('StopReplayBuffer')
+        except Exception as e:
+            logging.warning(f"Failed to stop the replay buffer: {e}")
+
+    async def create_clip(self, score=None, channel=None, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        clips_triggered.inc()
+        if self.is_recording():
+            # Merge into the pending clip instead of starting an overlapping one
+            if self.mode == 'recording':
+                self._clip_end = min(max(self._clip_end, timestamp + self.clip_length), self._clip_first_trigger + self.max_clip_length)
+            # A pending replay buffer save already holds this trigger; moving it would cut the lead-up
+            if score is not None:
+                self._clip_score = score if self._clip_score is None else max(self._clip_score, score)
+            self.triggers_merged += 1
+            clips_merged.inc()
+            logging.debug(f"Clip trigger merged, clip ends {self._clip_end - timestamp:.1f}s after it")
+            return self._clip_task
+        if self._last_clip_end is not None and timestamp - self._last_clip_end < self.min_clip_interval:
+            self.triggers_rate_limited += 1
+            clips_rate_limited.inc()
+            logging.debug(f"Clip trigger dropped, last clip ended {timestamp - self._last_clip_end:.1f}s ago")
+            return None
+        self._clip_started_at = asyncio.get_running_loop().time()
+        self._clip_first_trigger = timestamp
+        self._clip_end = timestamp + (self.post_roll if self.mode == 'replay_buffer' else self.clip_length)
+        self._clip_score = score
+        self._clip_channel = channel
+        if self.mode == 'replay_buffer':
+            self._clip_task = asyncio.create_task(self._save_replay_buffer())
+        else:
+            self._clip_task = asyncio.create_task(self._record_clip())
+        return self._clip_task
+
+    async def _wait_for_clip_end(self):
+        loop = asyncio.get_running_loop()
+        while (remaining := self._clip_started_at + (self._clip_end - self._clip_first_trigger) / self.time_scale - loop.time()) > 0:
+            await asyncio.sleep(remaining)
+
+    def _finish_clip(self, start, end):
+        self._last_clip_end = end
+        self.clips_created += 1
+        clips_created.inc()
+        self.database.store_clip(start, end, self._clip_first_trigger, trigger_score=self._clip_score, channel=self._clip_channel, mode=self.mode)
+        logging.info(f"Clip created ({end - start:.1f}s, score {self._clip_score})")
+
+    def _fail_clip(self, message):
+        self.clips_failed += 1
+        clips_failed.inc()
+        logging.error(message)
+
+    async def _record_clip(self):
         try:
-            self.obs_connection = obsws(self.host, self.port, self.password)
-            self.obs_connection.connect()
-            logging.info("Connected to OBS")
+            await self._call_obs('StartRecording')
+            try:
+                await self._wait_for_clip_end()
+            finally:
+                await asyncio.shield(self._call_obs('StopRecording'))
+            self._finish_clip(self._clip_first_trigger, self._clip_end)
         except Exception as e:
-            logging.error(f"Failed to connect to OBS: {e}")
-            raise
+            # Not re-raised: nothing may ever await this task, and the failure is logged and counted here
+            self._fail_clip(f"Failed to create clip: {e}")
 
-    def create_clip(self):
+    async def _save_replay_buffer(self):
         try:
-            self.obs_connection.call(requests.StartRecording())
-            time.sleep(self.clip_length)
-            self.obs_connection.call(requests.StopRecording())
-            logging.info("Clip created")
+            await self._wait_for_clip_end()
+            await self._call_obs('SaveReplayBuffer')
+            # OBS saves the last `clip_length` seconds of the buffer
+            self._finish_clip(self._clip_end - self.clip_length, self._clip_end)
         except Exception as e:
-            logging.error(f"Failed to create clip: {e}")
-            raise
+            self._fail_clip(f"Failed to save the replay buffer: {e}")
+
+    def is_recording(self):
+        return self._clip_task is not None and not self._clip_task.done()
 
-    def store_comment(self, comment):
-        cursor = self.db_connection.cursor()
-        cursor.execute("INSERT INTO comments (content) VALUES (?)", (comment,))
-        self.db_connection.commit()
+    async def wait_for_clip(self):
+        if self._clip_task is not None:
+            await self._clip_task
+
+    def close(self):
+        self.database.flush()
+
+    def store_comment(self, comment, channel=None, sentiment=None):
+        self.database.store_comment(comment, channel=channel, sentiment=sentiment)
 
     def get_comment_sentiment(self, comment):
-        cursor = self.db_connection.cursor()
-        cursor.execute("SELECT sentiment FROM comments WHERE content = ?", (comment,))
-        result = cursor.fetchone()
-        return result[0] if result else None
+        return self.database.get_comment_sentiment(comment)
+
+async def _example():
+    clip_creator = ClipCreator(host="localhost", port=4444, password="secret", clip_sensitivity=80, clip_length=30, mode='replay_buffer')
+    clip_creator.initialize_obs_connection()
+    await clip_creator.start_replay_buffer()
+    await clip_creator.create_clip(score=0.8, channel="channel1")
+    await clip_creator.wait_for_clip()
+    await clip_creator.stop_replay_buffer()
+    clip_creator.close()
+    clip_creator.obs_connection.close()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
-    clip_creator = ClipCreator(host="localhost", port=4444, password="secret", clip_sensitivity=80)
-    clip_creator.initialize_obs_connection()
-    clip_creator.create_clip()
+    asyncio.run(_example())
\ No newline at end of file
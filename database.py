@@ -0,0 +1,257 @@
+"""
+The `database.py` script is part of the StreamMatey OBS Plugin software. It provides the `Database` class, the single place where chat messages and their sentiment scores are stored and looked up.
+
+All components share one SQLite file (`comments.db` by default) with one schema:
+
+- `sentiments`: One row per distinct normalized message, keyed on `message_hash`, a 64-bit hash of the normalized text (see `text_normalizer.py`). The hash is the table's INTEGER PRIMARY KEY, so it is unique and every lookup is an O(log n) B-tree search instead of a scan over the message text. The normalized text is stored alongside it, and a lookup only returns the score if the text matches, so two messages whose hashes collide never get each other's score; the one stored last keeps the row, and the other is scored again when it is next seen.
+- `chat_messages`: One row per chat message received, with its channel, timestamp, content, message hash and sentiment score. An index on `(channel, timestamp)` serves range queries over a channel's chat, and one on `timestamp` serves queries across all channels.
+- `clips`: One row per clip created, with its channel, start and end timestamps, the time of the trigger that started it, its triggering score and the clip mode that produced it.
+
+The schema is created and upgraded by the numbered functions in `MIGRATIONS`. The version a database is at is stored in SQLite's `user_version`, and opening a `Database` applies any migrations it has not seen yet. Migration 2 imports the sentiment scores from the `comments` table written by earlier versions of the plugin and renames that table to `comments_legacy`, and migration 3 adds the `clips` table.
+
+Reads go through a small `ConnectionPool` so any thread can query the database, and writes are batched by a `WriteBehindQueue` (see `write_behind.py`). Because writes are applied in the background, a score stored with `store_sentiment_score` may not be visible to `get_sentiment_score` for up to the writer's flush interval; callers that need it sooner keep their own cache, as `SentimentAnalyzer` does.
+
+The `Database` class has the following methods:
+
+- `get_sentiment_score(message)`: Returns the stored score for a message, or None.
+- `get_sentiment_scores(messages)`: Returns a dictionary of the stored scores for several messages, looked up a chunk at a time. Messages without a score are left out.
+- `store_sentiment_score(message, sentiment_score)`: Queues a message's score to be stored.
+- `store_sentiment_scores(scored_messages)`: Queues several `(message, sentiment_score)` pairs to be stored.
+- `store_comment(content, channel=None, timestamp=None, sentiment=None)`: Queues a chat message to be stored.
+- `get_comment_sentiment(content)`: Returns the stored score for a comment, or None.
+- `get_messages(channel, start, end)`: Returns the `(timestamp, content, sentiment)` rows for a channel between two timestamps.
+- `store_clip(start_time, end_time, trigger_time, trigger_score=None, channel=None, mode='recording')`: Queues a clip to be stored.
+- `get_clips(start, end)`: Returns the `(channel, start_time, end_time, trigger_time, trigger_score, mode)` rows of the clips starting between two timestamps.
+- `flush()`: Waits until every queued write has been applied.
+- `close()`: Flushes pending writes and closes every connection.
+
+`get_database(path)` returns the `Database` shared by every component that uses the same file, so the sentiment analyzer and the clip creator use one pool and one writer.
+"""
+
+import contextlib
+import hashlib
+import queue
+import sqlite3
+import threading
+import time
+import metrics
+from text_normalizer import normalize_message
+from write_behind import WriteBehindQueue, connect_wal
+
+DEFAULT_DATABASE_PATH = 'comments.db'
+# Keeps IN (...) lookups under SQLite's limit on bound parameters
+LOOKUP_CHUNK_SIZE = 500
+
+
+def message_hash(message):
+    """
+    This function returns the signed 64-bit hash of a message's normalized text, used as its key in the `sentiments` table.
+    """
+    digest = hashlib.blake2b(normalize_message(message).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def _create_schema(connection):
+    connection.execute('''
+        CREATE TABLE sentiments (
+            message_hash INTEGER PRIMARY KEY,
+            message TEXT NOT NULL,
+            sentiment REAL NOT NULL
+        )
+    ''')
+    connection.execute('''
+        CREATE TABLE chat_messages (
+            id INTEGER PRIMARY KEY,
+            channel TEXT,
+            timestamp REAL NOT NULL,
+            content TEXT NOT NULL,
+            message_hash INTEGER NOT NULL,
+            sentiment REAL
+        )
+    ''')
+    connection.execute('CREATE INDEX idx_chat_messages_channel_timestamp ON chat_messages (channel, timestamp)')
+    connection.execute('CREATE INDEX idx_chat_messages_timestamp ON chat_messages (timestamp)')
+
+
+def _import_legacy_comments(connection):
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(comments)")]
+    if 'comment' not in columns:
+        return
+    rows = connection.execute('SELECT comment, sentiment FROM comments WHERE comment IS NOT NULL AND sentiment IS NOT NULL')
+    connection.executemany(
+        'INSERT OR IGNORE INTO sentiments (message_hash, message, sentiment) VALUES (?, ?, ?)',
+        ((message_hash(comment), normalize_message(comment), sentiment) for comment, sentiment in rows),
+    )
+    connection.execute('ALTER TABLE comments RENAME TO comments_legacy')
+
+
+def _create_clips_table(connection):
+    connection.execute('''
+        CREATE TABLE clips (
+            id INTEGER PRIMARY KEY,
+            channel TEXT,
+            start_time REAL NOT NULL,
+            end_time REAL NOT NULL,
+            trigger_time REAL NOT NULL,
+            trigger_score REAL,
+            mode TEXT NOT NULL
+        )
+    ''')
+    connection.execute('CREATE INDEX idx_clips_start_time ON clips (start_time)')
+
+
+# Applied in order; a database at user_version N has had the first N applied
+MIGRATIONS = [
+    _create_schema,
+    _import_legacy_comments,
+    _create_clips_table,
+]
+
+
+def migrate(connection):
+    """
+    This function applies every migration the database has not seen yet, each in its own transaction, and returns the resulting schema version.
+    """
+    version = connection.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        # An explicit transaction, since sqlite3 does not open one for schema changes
+        connection.execute('BEGIN')
+        try:
+            migration(connection)
+            connection.execute(f'PRAGMA user_version = {number}')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+    return max(version, len(MIGRATIONS))
+
+
+class ConnectionPool:
+    def __init__(self, database_path, size=4):
+        self.database_path = database_path
+        self.size = size
+        self._connections = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        try:
+            connection = self._connections.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = len(self._all) < self.size
+                if can_open:
+                    connection = sqlite3.connect(self.database_path, check_same_thread=False)
+                    self._all.append(connection)
+            if not can_open:
+                connection = self._connections.get()
+        try:
+            yield connection
+        finally:
+            self._connections.put(connection)
+
+    def close(self):
+        with self._lock:
+            for connection in self._all:
+                connection.close()
+            self._all.clear()
+
+
+class Database:
+    def __init__(self, database_path=DEFAULT_DATABASE_PATH, pool_size=4, writer=None):
+        self.database_path = database_path
+        connection = connect_wal(database_path)
+        try:
+            migrate(connection)
+        finally:
+            connection.close()
+        self.pool = ConnectionPool(database_path, pool_size)
+        self.writer = writer if writer is not None else WriteBehindQueue(database_path, overflow_policy='drop_oldest')
+        metrics.gauge('database.write_queue_depth', lambda: self.writer.stats()['queue_depth'])
+        metrics.gauge('database.rows_dropped', lambda: self.writer.dropped)
+
+    def get_sentiment_score(self, message):
+        with self.pool.connection() as connection:
+            result = connection.execute('SELECT message, sentiment FROM sentiments WHERE message_hash = ?', (message_hash(message),)).fetchone()
+        # A row for another message whose hash collides with this one's is not this message's score
+        return result[1] if result and result[0] == normalize_message(message) else None
+
+    def store_sentiment_score(self, message, sentiment_score):
+        self.writer.put(
+            'INSERT OR REPLACE INTO sentiments (message_hash, message, sentiment) VALUES (?, ?, ?)',
+            (message_hash(message), normalize_message(message), sentiment_score),
+        )
+
+    def get_sentiment_scores(self, messages):
+        # Messages that normalize alike share a hash, and each of them gets the score
+        hashes = {}
+        for message in messages:
+            hashes.setdefault(message_hash(message), []).append(message)
+        keys = list(hashes)
+        scores = {}
+        with self.pool.connection() as connection:
+            for offset in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+                chunk = keys[offset:offset + LOOKUP_CHUNK_SIZE]
+                placeholders = ','.join('?' * len(chunk))
+                query = f'SELECT message_hash, message, sentiment FROM sentiments WHERE message_hash IN ({placeholders})'
+                for key, stored_message, sentiment in connection.execute(query, chunk):
+                    for message in hashes[key]:
+                        if stored_message == normalize_message(message):
+                            scores[message] = sentiment
+        return scores
+
+    def store_sentiment_scores(self, scored_messages):
+        for message, sentiment_score in scored_messages:
+            self.store_sentiment_score(message, sentiment_score)
+
+    def store_comment(self, content, channel=None, timestamp=None, sentiment=None):
+        self.writer.put(
+            'INSERT INTO chat_messages (channel, timestamp, content, message_hash, sentiment) VALUES (?, ?, ?, ?, ?)',
+            (channel, time.time() if timestamp is None else timestamp, content, message_hash(content), sentiment),
+        )
+
+    def get_comment_sentiment(self, content):
+        return self.get_sentiment_score(content)
+
+    def get_messages(self, channel, start, end):
+        with self.pool.connection() as connection:
+            return connection.execute(
+                'SELECT timestamp, content, sentiment FROM chat_messages WHERE channel = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp',
+                (channel, start, end),
+            ).fetchall()
+
+    def store_clip(self, start_time, end_time, trigger_time, trigger_score=None, channel=None, mode='recording'):
+        self.writer.put(
+            'INSERT INTO clips (channel, start_time, end_time, trigger_time, trigger_score, mode) VALUES (?, ?, ?, ?, ?, ?)',
+            (channel, start_time, end_time, trigger_time, trigger_score, mode),
+        )
+
+    def get_clips(self, start, end):
+        with self.pool.connection() as connection:
+            return connection.execute(
+                'SELECT channel, start_time, end_time, trigger_time, trigger_score, mode FROM clips WHERE start_time >= ? AND start_time < ? ORDER BY start_time',
+                (start, end),
+            ).fetchall()
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+        self.pool.close()
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(database_path=DEFAULT_DATABASE_PATH):
+    """
+    This function returns the `Database` shared by every component using `database_path`, opening it on first use.
+    """
+    with _databases_lock:
+        database = _databases.get(database_path)
+        if database is None:
+            database = _databases[database_path] = Database(database_path)
+        return database
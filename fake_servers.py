@@ -0,0 +1,313 @@
+"""
+The `fake_servers.py` script is part of the StreamMatey OBS Plugin software. It provides local stand-ins for the services the plugin talks to, so the tests (see `tests/`) and benchmarks (see `benchmarks.py`) can run the real clients against them without OBS or Twitch.
+
+Every server listens on a free port on 127.0.0.1 and serves each connection on its own thread. The WebSocket servers speak just enough of RFC 6455 for `websocket-client` and `websockets`: the opening handshake, unfragmented text frames, pings and the closing handshake.
+
+The script provides the following classes:
+
+- `WebSocketServer`: The base of the WebSocket servers. Subclasses override `on_message(connection, text)`. `broadcast(text)` sends to every open connection, `drop_connections()` cuts them off without a closing handshake, as a network failure would, and setting `accepting` to False makes the server close new connections before the handshake.
+- `FakeOBSWebSocketServer(latency=0.005, password=None, drop_every=None, clock=time.monotonic)`: An obs-websocket 4.x server. It answers every request after `latency` seconds (or after the request's own `delay` field), concurrently and with the request's other fields echoed, never answers `Hang` requests, fails `Fail` requests and those whose type is in `failing`, checks the password if one is set, and drops the connection after every `drop_every` requests. `requests` records the `(clock(), request_type)` of every request.
+- `FakeIRCServer(nick='streammatey')`: A Twitch IRC server over WebSocket, as used by twitchio. It welcomes any login, confirms joins and answers pings. `send_chat(channel, user, content)` sends a chat message to the connections that joined the channel, `wait_for_join(channel)` waits until one has, and `sent` records the `(channel, content)` of every message the client sends.
+- `FakeHelixServer()`: A Twitch Helix and OAuth HTTP server. It answers `/helix/users`, `/helix/channels` and `/oauth2/token` from canned data, and `responses` can queue `(status, headers, body)` answers to send first, such as 429s or 401s. `requests` records the `(method, path, headers)` of every request.
+"""
+
+import base64
+import hashlib
+import http.server
+import json
+import socket
+import socketserver
+import threading
+import time
+import urllib.parse
+
+_WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class _WebSocketConnection:
+    def __init__(self, sock):
+        self.socket = sock
+        self.closed = False
+        self._send_lock = threading.Lock()
+
+    def _send_frame(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = bytes([0x80 | opcode, length])
+        elif length < 1 << 16:
+            header = bytes([0x80 | opcode, 126]) + length.to_bytes(2, "big")
+        else:
+            header = bytes([0x80 | opcode, 127]) + length.to_bytes(8, "big")
+        with self._send_lock:
+            if self.closed:
+                return False
+            try:
+                self.socket.sendall(header + payload)
+                return True
+            except OSError:
+                return False
+
+    def send(self, text):
+        return self._send_frame(0x1, text.encode("utf-8"))
+
+    def drop(self):
+        self.closed = True
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class WebSocketServer:
+    def __init__(self):
+        self.accepting = True
+        self.connection_count = 0
+        self.connections = []
+        self._connections_lock = threading.Lock()
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                server._serve(self.request)
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self.url = f"ws://127.0.0.1:{self.port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def on_connect(self, connection):
+        pass
+
+    def on_message(self, connection, text):
+        raise NotImplementedError
+
+    def on_disconnect(self, connection):
+        pass
+
+    def _serve(self, sock):
+        if not self.accepting:
+            sock.close()
+            return
+        stream = sock.makefile("rb")
+        headers = {}
+        while (line := stream.readline().decode("latin-1").strip()):
+            name, _, value = line.partition(":")
+            headers[name.lower()] = value.strip()
+        if "sec-websocket-key" not in headers:
+            return
+        accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + _WEBSOCKET_GUID).encode()).digest()).decode()
+        sock.sendall(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        connection = _WebSocketConnection(sock)
+        with self._connections_lock:
+            self.connections.append(connection)
+            self.connection_count += 1
+        try:
+            self.on_connect(connection)
+            self._read_frames(connection, stream)
+        finally:
+            connection.closed = True
+            with self._connections_lock:
+                self.connections.remove(connection)
+            self.on_disconnect(connection)
+
+    def _read_frames(self, connection, stream):
+        while not connection.closed:
+            try:
+                header = stream.read(2)
+            except OSError:
+                return
+            if len(header) < 2:
+                return
+            opcode, length = header[0] & 0x0F, header[1] & 0x7F
+            if length == 126:
+                length = int.from_bytes(stream.read(2), "big")
+            elif length == 127:
+                length = int.from_bytes(stream.read(8), "big")
+            mask = stream.read(4) if header[1] & 0x80 else bytes(4)
+            payload = bytes(byte ^ mask[index % 4] for index, byte in enumerate(stream.read(length)))
+            if opcode == 0x8:
+                connection._send_frame(0x8, payload[:2])
+                connection.drop()
+                return
+            if opcode == 0x9:
+                connection._send_frame(0xA, payload)
+            elif opcode == 0x1:
+                self.on_message(connection, payload.decode("utf-8"))
+
+    def broadcast(self, text):
+        with self._connections_lock:
+            connections = list(self.connections)
+        for connection in connections:
+            connection.send(text)
+
+    def drop_connections(self):
+        with self._connections_lock:
+            connections = list(self.connections)
+        for connection in connections:
+            connection.drop()
+
+    def close(self):
+        self.accepting = False
+        self.drop_connections()
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeOBSWebSocketServer(WebSocketServer):
+    def __init__(self, latency=0.005, password=None, drop_every=None, clock=time.monotonic):
+        self.latency = latency
+        self.clock = clock
+        self.password = password
+        self.drop_every = drop_every
+        self.requests = []
+        self.failing = set()
+        self._challenge, self._salt = "challenge", "salt"
+        self._handled = 0
+        super().__init__()
+
+    def _answer(self, connection, delay, response):
+        if delay:
+            threading.Timer(delay, connection.send, (json.dumps(response),)).start()
+        else:
+            connection.send(json.dumps(response))
+
+    def on_message(self, connection, text):
+        from obs_client import auth_response
+
+        request = json.loads(text)
+        request_type, message_id = request.pop("request-type"), request.pop("message-id")
+        if request_type == "GetAuthRequired":
+            connection.send(json.dumps({"message-id": message_id, "status": "ok", "authRequired": self.password is not None,
+                                        "challenge": self._challenge, "salt": self._salt}))
+            return
+        if request_type == "Authenticate":
+            ok = request.get("auth") == auth_response(self.password, self._salt, self._challenge)
+            connection.send(json.dumps({"message-id": message_id, "status": "ok" if ok else "error",
+                                        "error": None if ok else "Authentication Failed."}))
+            return
+        self.requests.append((self.clock(), request_type))
+        if request_type == "Hang":
+            return
+        if request_type == "Fail" or request_type in self.failing:
+            response = {"message-id": message_id, "status": "error", "error": "Request failed"}
+        else:
+            response = {**request, "message-id": message_id, "status": "ok"}
+        self._answer(connection, request.get("delay", self.latency), response)
+        self._handled += 1
+        if self.drop_every and self._handled % self.drop_every == 0:
+            # Let the answers already scheduled go out first
+            time.sleep(self.latency * 2)
+            connection.drop()
+
+    def request_types(self):
+        return [request_type for _, request_type in self.requests]
+
+
+class FakeIRCServer(WebSocketServer):
+    def __init__(self, nick="streammatey"):
+        self.nick = nick
+        self.sent = []
+        self._joined = {}
+        self._join_condition = threading.Condition()
+        super().__init__()
+
+    def on_message(self, connection, text):
+        for line in text.split("\r\n"):
+            command, _, argument = line.strip().partition(" ")
+            if command == "NICK":
+                self.nick = argument.strip()
+                for code in ("001", "002", "003", "004", "375", "372", "376"):
+                    connection.send(f":tmi.twitch.tv {code} {self.nick} :Welcome, GLHF!\r\n")
+            elif command == "CAP":
+                connection.send(f":tmi.twitch.tv CAP * ACK :{argument.split(':', 1)[-1]}\r\n")
+            elif command == "JOIN":
+                channel = argument.strip().lstrip("#")
+                connection.send(f":{self.nick}!{self.nick}@{self.nick}.tmi.twitch.tv JOIN #{channel}\r\n")
+                with self._join_condition:
+                    self._joined.setdefault(channel, set()).add(connection)
+                    self._join_condition.notify_all()
+            elif command == "PING":
+                connection.send(f"PONG {argument}\r\n")
+            elif command == "PRIVMSG":
+                channel, _, content = argument.partition(" :")
+                self.sent.append((channel.lstrip("#"), content))
+
+    def on_disconnect(self, connection):
+        with self._join_condition:
+            for connections in self._joined.values():
+                connections.discard(connection)
+
+    def wait_for_join(self, channel, timeout=10.0):
+        with self._join_condition:
+            return self._join_condition.wait_for(lambda: self._joined.get(channel), timeout)
+
+    def send_chat(self, channel, user, content):
+        with self._join_condition:
+            connections = list(self._joined.get(channel, ()))
+        line = (f"@badge-info=;badges=;display-name={user};mod=0;subscriber=0;user-type= "
+                f":{user}!{user}@{user}.tmi.twitch.tv PRIVMSG #{channel} :{content}\r\n")
+        for connection in connections:
+            connection.send(line)
+        return len(connections)
+
+
+class FakeHelixServer:
+    def __init__(self):
+        self.requests = []
+        self.responses = []
+        self.users = {}
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                server.requests.append((self.command, self.path, dict(self.headers)))
+                status, headers, body = server.responses.pop(0) if server.responses else server._route(self.command, self.path)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in {"Content-Type": "application/json", **headers}.items():
+                    self.send_header(name, str(value))
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = _handle
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self.helix_url = f"http://127.0.0.1:{self.port}/helix"
+        self.oauth_url = f"http://127.0.0.1:{self.port}/oauth2"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def _route(self, method, path):
+        url = urllib.parse.urlsplit(path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path == "/oauth2/token":
+            return 200, {}, {"access_token": "refreshed", "refresh_token": "refresh", "expires_in": 3600}
+        if url.path == "/helix/users":
+            ids, logins = query.get("id", []), query.get("login", [])
+            if not ids and not logins:
+                return 200, {}, {"data": [{"id": "1", "login": "streamer", "display_name": "Streamer"}]}
+            users = [{"id": user_id, "login": f"user{user_id}"} for user_id in ids]
+            users += [{"id": f"id-{login}", "login": login} for login in logins]
+            return 200, {}, {"data": users}
+        if url.path == "/helix/channels":
+            return 200, {}, {"data": [{"broadcaster_id": broadcaster_id, "title": "Live"} for broadcaster_id in query.get("broadcaster_id", [])]}
+        return 404, {}, {"error": "Not Found"}
+
+    def paths(self, prefix=""):
+        return [path for _, path, _ in self.requests if path.startswith(prefix)]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
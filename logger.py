@@ -9,25 +9,90 @@ The `Logger` class begins by defining a dictionary of log levels for reference.
 - `max_backup_log_files`: The maximum number of backup log files to keep.
 - `console_log_level`: The log level for the console handler (default is WARNING).
 - `file_log_level`: The log level for the file handler (default is DEBUG).
+- `use_queue`: Whether to log through a queue (default is False).
+- `queue_size`: The maximum number of records waiting in the queue (default is 10000).
+- `batch_size`: The maximum number of records written between flushes of the log file (default is 256).
 
 The constructor sets up the logger with a console handler and a file handler. The console handler logs messages to the console, while the file handler logs messages to a file and rotates the file when it reaches the maximum size. The handlers are set to different log levels and are formatted differently.
 
+With `use_queue` set, logging never does I/O on the caller's thread, which keeps it cheap in the chat-processing hot path. The logger gets a single `DroppingQueueHandler` that only puts the record on a queue, holding at most `queue_size` records. Records are queued unformatted, so the `%`-style arguments of a call are only formatted on the listener thread; callers should pass values as arguments rather than pre-formatting them, and should not change objects after logging them. If the queue is full, the record is dropped and counted rather than blocking the caller. A `BatchingQueueListener` thread passes each record to the console and file handlers, and flushes them once the queue is empty or every `batch_size` records, whichever comes first; the file handler is a `BatchedRotatingFileHandler`, which leaves flushing to the listener. The listener only uses the hooks `QueueListener` provides for subclasses. `close()` stops the listener after writing everything still queued and closes the log file, and is also registered to run at exit.
+
 The `Logger` class includes several methods for logging:
 
-- `log_message(level, message)`: Logs a message at the specified level. If the level is invalid, it logs an error message.
+- `log_message(level, message, *args)`: Logs a message at the specified level, formatting `message % args` only if the message is written. If the level is invalid, it logs an error message.
 - `log_exception(exc)`: Logs an exception as an error message and its traceback as a debug message.
-- `log_function_execution_time(func)`: A decorator for logging the execution time of a function. It wraps the function and logs the time it takes to execute as a debug message.
+- `dropped_messages`: The number of records dropped because the queue was full.
+- `close()`: Stops the queue listener, if any, after it has written every queued record, then closes the handlers and removes them from the logger.
+- `log_function_execution_time(func)`: A decorator for logging the execution time of a function or coroutine function. It wraps the function, logs the time it takes to execute as a debug message, and records it in the `function.<name>` latency histogram of the shared metrics registry (see `metrics.py`), so percentiles can be read across calls.
 
-The script also creates a `Logger` instance named 'StreamMatey' that logs to 'app.log', with a maximum file size of 2000 bytes and a maximum of 5 backup files. The console handler is set to the WARNING level and the file handler is set to the DEBUG level.
+Importing the script has no side effects. `get_logger()` returns the application's shared `Logger`, which it creates on first use: a `Logger` named 'StreamMatey' that logs to 'app.log', with a maximum file size of 10 MB and a maximum of 5 backup files, logging through a queue. The console handler is set to the WARNING level and the file handler is set to the DEBUG level.
 
-Finally, the script includes some usage examples of the `Logger` class, demonstrating how to use the `log_function_execution_time` decorator, how to log an exception, and how to log a message.
+Finally, in the `__main__` section, the script includes some usage examples of the `Logger` class, demonstrating how to use the `log_function_execution_time` decorator, how to log an exception, and how to log a message.
 """
 
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import inspect
+import queue
 import time
-import traceback
 import functools
+import metrics
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    A `QueueHandler` that never blocks the caller: when `max_size` records are already queued, the record is dropped and counted.
+    Records are queued as they are, so formatting the message happens on the listener thread instead of the caller's.
+    The queue itself is unbounded, so the listener's stop sentinel always fits.
+    """
+    def __init__(self, log_queue, max_size):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+class BatchedRotatingFileHandler(RotatingFileHandler):
+    """
+    A `RotatingFileHandler` that leaves flushing to `flush_batch`, so a batch of records costs one flush instead of one per record.
+    """
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+class BatchingQueueListener(QueueListener):
+    """
+    A `QueueListener` that flushes its handlers once the records already waiting are handled, or every `batch_size` records under sustained load.
+    """
+    def __init__(self, log_queue, *handlers, batch_size=256):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+        self._unflushed = 0
+
+    def _flush_handlers(self):
+        self._unflushed = 0
+        for handler in self.handlers:
+            getattr(handler, 'flush_batch', handler.flush)()
+
+    def handle(self, record):
+        super().handle(record)
+        self._unflushed += 1
+        if self._unflushed >= self.batch_size or self.queue.empty():
+            self._flush_handlers()
+
+    def stop(self):
+        super().stop()
+        # The stop sentinel may have arrived with records still unflushed
+        self._flush_handlers()
 
 class Logger:
     LOG_LEVELS = {
@@ -38,55 +103,112 @@ class Logger:
         'CRITICAL': logging.CRITICAL
     }
 
-    def __init__(self, name, log_file, max_log_file_size, max_backup_log_files, console_log_level=logging.WARNING, file_log_level=logging.DEBUG):
+    def __init__(self, name, log_file, max_log_file_size, max_backup_log_files, console_log_level=logging.WARNING, file_log_level=logging.DEBUG,
+                 use_queue=False, queue_size=10000, batch_size=256):
         self.logger = logging.getLogger(name)
         self.logger.setLevel(logging.DEBUG)
+        self.queue_handler = None
+        self.listener = None
+        self.handlers = ()
 
         console_handler = logging.StreamHandler()
         console_handler.setLevel(console_log_level)
         console_handler.setFormatter(logging.Formatter('%(name)s - %(levelname)s - %(message)s'))
 
-        file_handler = RotatingFileHandler(log_file, maxBytes=max_log_file_size, backupCount=max_backup_log_files)
+        file_handler_class = BatchedRotatingFileHandler if use_queue else RotatingFileHandler
+        file_handler = file_handler_class(log_file, maxBytes=max_log_file_size, backupCount=max_backup_log_files)
         file_handler.setLevel(file_log_level)
         file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
 
-        self.logger.addHandler(console_handler)
-        self.logger.addHandler(file_handler)
-
-    def log_message(self, level, message):
+        if use_queue:
+            # Callers only enqueue; a listener thread formats and writes the records in batches
+            self.queue_handler = DroppingQueueHandler(queue.Queue(), queue_size)
+            self.listener = BatchingQueueListener(self.queue_handler.queue, console_handler, file_handler, batch_size=batch_size)
+            self.logger.addHandler(self.queue_handler)
+            self.listener.start()
+            atexit.register(self.close)
+        else:
+            self.logger.addHandler(console_handler)
+            self.logger.addHandler(file_handler)
+        self.handlers = (console_handler, file_handler)
+
+    @property
+    def dropped_messages(self):
+        return self.queue_handler.dropped if self.queue_handler is not None else 0
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        for handler in (self.queue_handler, *self.handlers):
+            if handler is not None:
+                self.logger.removeHandler(handler)
+                handler.close()
+        self.queue_handler = None
+        self.handlers = ()
+
+    def log_message(self, level, message, *args):
         if level not in self.LOG_LEVELS:
-            self.logger.error(f"Invalid log level: {level}")
+            self.logger.error("Invalid log level: %s", level)
             return
         log_method = getattr(self.logger, level.lower())
-        log_method(message)
+        log_method(message, *args)
 
     def log_exception(self, exc):
-        self.logger.error(f"Exception occurred: {str(exc)}")
-        self.logger.debug(traceback.format_exc())
+        self.logger.error("Exception occurred: %s", exc)
+        self.logger.debug("Traceback:", exc_info=(type(exc), exc, exc.__traceback__))
 
     def log_function_execution_time(self, func):
+        histogram = metrics.histogram(f"function.{func.__qualname__}")
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start_time = time.perf_counter_ns()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    execution_time = time.perf_counter_ns() - start_time
+                    histogram.record(execution_time)
+                    self.logger.debug("%s executed in %s seconds", func.__name__, execution_time / 1e9)
+            return async_wrapper
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            start_time = time.time()
-            result = func(*args, **kwargs)
-            end_time = time.time()
-            execution_time = end_time - start_time
-            self.logger.debug(f"{func.__name__} executed in {execution_time} seconds")
-            return result
+            start_time = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                execution_time = time.perf_counter_ns() - start_time
+                histogram.record(execution_time)
+                self.logger.debug("%s executed in %s seconds", func.__name__, execution_time / 1e9)
         return wrapper
 
-logger = Logger('StreamMatey', 'app.log', 2000, 5, logging.WARNING, logging.DEBUG)
+_default_logger = None
+
+def get_logger():
+    """
+    This function returns the application's shared `Logger`, creating it on first use so importing this module has no side effects.
+    """
+    global _default_logger
+    if _default_logger is None:
+        _default_logger = Logger('StreamMatey', 'app.log', 10 * 1024 * 1024, 5, logging.WARNING, logging.DEBUG, use_queue=True)
+    return _default_logger
+
+if __name__ == "__main__":
+    logger = get_logger()
+
+    # Usage examples
+    @logger.log_function_execution_time
+    def some_function():
+        # Some code here
+        pass
 
-# Usage examples
-@logger.log_function_execution_time
-def some_function():
-    # Some code here
-    pass
+    some_function()
 
-try:
-    # Some code here
-    pass
-except Exception as e:
-    logger.log_exception(e)
+    try:
+        # Some code here
+        pass
+    except Exception as e:
+        logger.log_exception(e)
 
-logger.log_message('INFO', 'This is an info message')
+    logger.log_message('INFO', 'This is an info message')
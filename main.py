@@ -1,121 +1,137 @@
 """
 The `main.py` script is the entry point for the StreamMatey OBS Plugin software. It integrates all the components of the software and orchestrates their interactions to automate the process of creating video clips during a live streaming session based on chat activity and sentiment.
 
-The script begins by setting up logging and defining several parameters for the OBS connection, the activity monitor, the sentiment analyzer, and the database.
+Every setting (the OBS address, the channels to watch, the thresholds, the clip mode and the concurrency of each pipeline stage) comes from a JSON configuration file, `config.json` by default or the file given with `--config`. Settings missing from the file keep their defaults; see `config.example.json` and `pipeline.py` for the full list. Secrets stay in environment variables: the OBS password in `OBS_PASSWORD`, and the Twitch credentials in `TWITCH_CLIENT_ID`, `TWITCH_CLIENT_SECRET`, `TWITCH_ACCESS_TOKEN` and `TWITCH_REFRESH_TOKEN`.
 
-In the `main` function, the script initializes a connection to OBS using the `obswebsocket` library. It then checks if authentication is required for the OBS WebSocket plugin and retrieves the OBS password from the environment variables.
+In the `main` function, the script starts the `OBSClient` shared by every component (see `obs_client.py`) and checks that authentication is enabled in the OBS WebSocket plugin. It then initializes the asynchronous Twitch API client and retrieves the user's information, which gives the username and, unless the configuration lists `channels`, the channel for the Twitch chat connection.
 
-The script also initializes the Twitch API and retrieves the user's information, including the access token, username, and channel for the Twitch chat connection.
+Next, the script initializes the components that the pipeline connects:
 
-Next, the script initializes several components of the software:
-
-- `Database`: A SQLite database for storing and retrieving chat messages and their sentiment scores.
+- `Database`: The shared SQLite database (see `database.py`) for storing and retrieving chat messages and their sentiment scores.
 - `ChatConnector`: A component for connecting to the Twitch chat and retrieving messages.
-- `SentimentAnalyzer`: A component for analyzing the sentiment of chat messages.
-- `ActivityMonitor`: A component for monitoring chat activity.
 - `ClipCreator`: A component for creating video clips in OBS.
+- `Pipeline`: The staged runtime (see `pipeline.py`) that takes chat messages from the connector, sets spam aside with a `SpamFilter`, scores the rest with a `SentimentAnalyzer`, tracks the chat rate and rolling sentiment with an `ActivityMonitor` and a `SentimentAggregator`, asks the `ClipCreator` for a clip when a channel's rolling sentiment starts to spike while its activity exceeds its threshold, and stores every message in the database.
 
-After connecting to the Twitch chat, the script enters its main loop. In each iteration of the loop, the script retrieves a chat message, checks if its sentiment score is in the database, and if not, analyzes its sentiment and stores the score in the database. It then updates the activity monitor with the new message.
+The script warms up the sentiment analyzer on a worker thread while it starts the Twitch chat connection in the background, waits for the warm-up to finish (so a failure to load VADER or open the database stops the script before any chat is processed), and then runs the pipeline until it is interrupted.
 
-If the chat activity and sentiment score exceed their respective thresholds, the script creates a clip using the `ClipCreator` component.
+With `shard_count` set in the configuration, the channels are instead split across that many shard processes by a `ShardManager` (see `channel_shards.py`), each with its own chat connection and sentiment analyzer, for watching more channels than one core can score. The shards only detect clip triggers and send them back; the script passes each trigger on to its `ClipCreator`, so the clips are created by the one process that talks to OBS. Triggers for a channel within `min_clip_interval` seconds of its last one are dropped.
 
-The script also includes error handling to log any exceptions that occur during the loop and continue with the next iteration.
+While it runs, the script serves the metrics collected by every component (see `metrics.py`), including per-stage latency percentiles, queue depths, the sentiment cache hit rate, message rates and clip triggers, as text on `http://127.0.0.1:9102/` (`metrics_port` in the configuration), and writes them to `metrics.json` every 10 seconds.
 
-In the `__main__` section of the script, the `main` function is run using `asyncio.run`, which runs the function as an asynchronous task.
+In the `__main__` section of the script, the configuration is loaded and the `main` function is run using `asyncio.run`, which runs the function as an asynchronous task.
 
 Overall, the `main.py` script serves as the central hub of the StreamMatey OBS Plugin software, coordinating the various components and managing the flow of data between them to automate the clip creation process based on chat activity and sentiment.
 """
+import argparse
 import asyncio
 import logging
 import os
-from obswebsocket import obsws, requests
-from chat_connector import ChatConnector
-from sentiment_analyzer import SentimentAnalyzer
-from activity_monitor import ActivityMonitor
 from clip_creator import ClipCreator
-from database import Database
-from twitch_api import TwitchAPI
+from obs_client import get_obs_client
+from database import get_database
+from pipeline import Pipeline, load_config
+from twitch_api import AsyncTwitchAPI
+import metrics
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# OBS connection parameters
-OBS_HOST = 'localhost'
-OBS_PORT = 4444
-
-# Activity monitor parameters
-ACTIVITY_WINDOW_SIZE = 60  # seconds
-ACTIVITY_THRESHOLD = 50  # messages per minute
-
-# Sentiment analyzer parameters
-SENTIMENT_THRESHOLD = 0.05  # positive sentiment score
+DEFAULT_CONFIG_PATH = 'config.json'
 
-# Database parameters
-DATABASE_PATH = 'chat_messages.db'
-
-async def main():
-    # Initialize OBS WebSocket connection
-    obs = obsws(OBS_HOST, OBS_PORT)
-    obs.connect()
+async def main(config):
+    # Start the OBS WebSocket client shared by every component
+    obs_client = get_obs_client(config['obs_host'], config['obs_port'], os.getenv('OBS_PASSWORD'),
+                                request_timeout=config['obs_request_timeout']).start()
 
     # Get OBS WebSocket settings
-    settings = obs.call(requests.GetAuthRequired())
-    if not settings.isAuthRequired:
+    settings = await obs_client.call_async('GetAuthRequired')
+    if not settings.get('authRequired'):
         logger.error('Please enable authentication in the OBS WebSocket plugin settings and restart the script.')
+        obs_client.close()
         return
 
-    # OBS password
-    OBS_PASSWORD = os.getenv('OBS_PASSWORD')
-
     # Initialize Twitch API
-    twitch_api = TwitchAPI()  # Assuming you have a TwitchAPI class that handles Twitch API requests
-
-    # Get Twitch user info
-    twitch_user_info = twitch_api.get_user_info()  # Assuming you have a method for retrieving the user's info
+    twitch_api = AsyncTwitchAPI(
+        os.getenv('TWITCH_CLIENT_ID'),
+        os.getenv('TWITCH_CLIENT_SECRET'),
+        access_token=os.getenv('TWITCH_ACCESS_TOKEN'),
+        refresh_token=os.getenv('TWITCH_REFRESH_TOKEN'),
+    )
 
-    # Twitch chat connection parameters
-    TWITCH_CHAT_TOKEN = twitch_user_info['access_token']
-    TWITCH_CHAT_USERNAME = twitch_user_info['username']
-    TWITCH_CHAT_CHANNEL = twitch_user_info['channel']
+    # Get Twitch user info, which names the chat user and by default the channel
+    twitch_user_info = await twitch_api.get_user_info()
+    channels = config['channels'] or [twitch_user_info['login']]
 
     # Initialize components
-    database = Database(DATABASE_PATH)
-    chat_connector = ChatConnector(TWITCH_CHAT_TOKEN, TWITCH_CHAT_USERNAME, TWITCH_CHAT_CHANNEL)
-    sentiment_analyzer = SentimentAnalyzer(database)
-    activity_monitor = ActivityMonitor(ACTIVITY_WINDOW_SIZE)
-    clip_creator = ClipCreator(OBS_HOST, OBS_PORT, OBS_PASSWORD)
-
-    # Connect to Twitch chat
-    await chat_connector.connect()
-
-    # Main loop
-    while True:
-        try:
-            # Get a chat message
-            message = await chat_connector.get_message()
-
-            # Check if the message is in the database
-            sentiment_score = database.get_sentiment_score(message)
-            if sentiment_score is None:
-                # If not, analyze the sentiment of the message
-                sentiment_score = sentiment_analyzer.analyze_sentiment(message)
-                # Store the sentiment score in the database
-                database.store_sentiment_score(message, sentiment_score)
-
-            # Update the activity monitor with the new message
-            activity_monitor.update(message)
-
-            # Check if the activity and sentiment thresholds are exceeded
-            if activity_monitor.get_activity() > ACTIVITY_THRESHOLD and sentiment_score > SENTIMENT_THRESHOLD:
-                # If so, create a clip
-                clip_creator.create_clip()
-
-            # Wait a bit before the next iteration
-            await asyncio.sleep(0.1)
-        except Exception as e:
-            logger.error(f"An error occurred: {e}")
-            continue
+    database = get_database(config['database_path'])
+    clip_creator = ClipCreator(config['obs_host'], config['obs_port'], obs_client.password, config['clip_sensitivity'],
+                               clip_length=config['clip_length'], max_clip_length=config['max_clip_length'], database=database,
+                               mode=config['clip_mode'], post_roll=config['post_roll'], min_clip_interval=config['min_clip_interval'],
+                               obs_client=obs_client)
+    if clip_creator.mode == 'replay_buffer':
+        await clip_creator.start_replay_buffer()
+
+    # Expose pipeline metrics on a local endpoint and in a periodic snapshot file
+    metrics_server = metrics.MetricsServer(metrics.registry, port=config['metrics_port'])
+    await metrics_server.start()
+    snapshot_task = asyncio.create_task(metrics.SnapshotWriter(metrics.registry, config['metrics_snapshot_path'], config['metrics_snapshot_interval']).run())
+
+    try:
+        if config['shard_count']:
+            await run_shards(config, channels, twitch_api, twitch_user_info['login'], clip_creator)
+        else:
+            await run_pipeline(config, channels, twitch_api, twitch_user_info['login'], clip_creator, database)
+    finally:
+        snapshot_task.cancel()
+        await metrics_server.close()
+        await clip_creator.wait_for_clip()
+        if clip_creator.mode == 'replay_buffer':
+            await clip_creator.stop_replay_buffer()
+        clip_creator.close()
+        await twitch_api.close()
+        # Fail any OBS requests still in flight and stop the client's worker
+        obs_client.close()
+
+async def run_pipeline(config, channels, twitch_api, nick, clip_creator, database):
+    # Importing the chat connector loads twitchio, which only the running app needs
+    from chat_connector import ChatConnector
+
+    chat_connector = ChatConnector(twitch_api.access_token, twitch_api.client_id, nick, '!', channels,
+                                   max_queue_size=config['chat_queue_size'], overflow_policy=config['chat_overflow_policy'])
+    pipeline = Pipeline(config, chat_connector, clip_creator, database)
+
+    # Load VADER, NumPy and the database on a worker thread while the chat connects
+    warm_up = asyncio.get_running_loop().run_in_executor(None, pipeline.sentiment_analyzer.warm_up)
+
+    # Connect to Twitch chat in the background; messages arrive on the connector's queue
+    chat_task = asyncio.create_task(chat_connector.connect_to_chat())
+    try:
+        await warm_up
+        await pipeline.run()
+    finally:
+        await chat_connector.stop()
+        chat_task.cancel()
+
+async def run_shards(config, channels, twitch_api, nick, clip_creator):
+    from channel_shards import DEFAULT_SETTINGS, ShardManager
+
+    async def create_clip(trigger):
+        await clip_creator.create_clip(trigger['sentiment'], trigger['channel'], trigger['timestamp'])
+
+    credentials = {'irc_token': twitch_api.access_token, 'client_id': twitch_api.client_id, 'nick': nick}
+    shard_manager = ShardManager(channels, credentials, settings={key: config[key] for key in DEFAULT_SETTINGS},
+                                 shard_count=config['shard_count'], on_trigger=create_clip, cooldown=config['min_clip_interval'])
+    shard_manager.start()
+    try:
+        await shard_manager.run()
+    finally:
+        # Stops the shards and writes the rows they already sent
+        shard_manager.stop()
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Create clips in OBS when Twitch chat gets excited")
+    parser.add_argument('--config', help=f"JSON configuration file, {DEFAULT_CONFIG_PATH} if it exists")
+    args = parser.parse_args()
+    config_path = args.config or (DEFAULT_CONFIG_PATH if os.path.exists(DEFAULT_CONFIG_PATH) else None)
+    asyncio.run(main(load_config(config_path)))
@@ -0,0 +1,294 @@
+"""
+The `metrics.py` script is part of the StreamMatey OBS Plugin software. It provides lightweight in-process metrics for the chat-processing pipeline: latency histograms, counters and gauges, and two ways to read them while the plugin is running.
+
+The script provides the following classes:
+
+- `LatencyHistogram`: Records durations in nanoseconds into log-linear buckets in the style of HDR histograms. Each power of two is split into 16 buckets, so any percentile is reported within about 6% of the true value, recording is O(1), and memory is fixed no matter how many values are recorded. `record(value_ns)` adds a value and `percentile(fraction)` reads one back.
+- `Counter`: A count that only goes up, such as messages received or clips triggered. Snapshots also report its rate per second since the previous snapshot taken for the same reader.
+- `Gauge`: A value that goes up and down, such as a queue depth or a cache hit rate. It is either set with `set(value)` or read from a callback each time a snapshot is taken, so the hot path pays nothing for it.
+- `MetricsRegistry`: Holds named metrics. `counter(name)`, `gauge(name, callback=None)` and `histogram(name)` create a metric or return the existing one with that name. `timed(name)` is a decorator that records the duration of every call of a function or coroutine function into the named histogram, and `time_block(name)` is a context manager that does the same for a block of code. `snapshot(previous=None)` returns every metric as a dictionary, with counter rates since `previous`, an earlier snapshot, or since the registry was created. `render_text(snapshot=None)` renders a snapshot, or a new one, in the Prometheus text format. The registry keeps no rate state of its own, so each reader (the server, the snapshot file) passes in its own previous snapshot and the readers do not reset each other's rates.
+- `MetricsServer`: Serves `render_text()` over HTTP on a local port, so `curl http://127.0.0.1:9102/` shows p50/p99 per pipeline stage.
+- `SnapshotWriter`: Writes `snapshot()` as JSON to a file every few seconds, replacing the file atomically.
+
+The module-level `registry` is shared by every component of the plugin, and `counter`, `gauge`, `histogram`, `timed` and `time_block` are shortcuts for its methods.
+
+Metrics are not locked. Updates from several threads at once may very occasionally lose a count, which is an acceptable trade for keeping them cheap.
+"""
+
+import asyncio
+import contextlib
+import functools
+import inspect
+import json
+import logging
+import os
+import time
+
+SUB_BUCKET_BITS = 5
+_HALF_SUB_BUCKETS = 1 << (SUB_BUCKET_BITS - 1)
+# Enough buckets for any duration up to 2**64 ns
+_BUCKET_COUNT = (64 - SUB_BUCKET_BITS + 2) * _HALF_SUB_BUCKETS
+
+
+def _bucket_index(value):
+    if value < (1 << SUB_BUCKET_BITS):
+        return value
+    exponent = value.bit_length() - SUB_BUCKET_BITS
+    return exponent * _HALF_SUB_BUCKETS + (value >> exponent)
+
+
+def _bucket_value(index):
+    # The midpoint of the values that fall into a bucket
+    if index < (1 << SUB_BUCKET_BITS):
+        return index
+    exponent, mantissa = divmod(index, _HALF_SUB_BUCKETS)
+    exponent -= 1
+    mantissa += _HALF_SUB_BUCKETS
+    return (mantissa << exponent) + ((1 << exponent) >> 1)
+
+
+class LatencyHistogram:
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * _BUCKET_COUNT
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value_ns):
+        value_ns = max(0, int(value_ns))
+        self.counts[_bucket_index(value_ns)] += 1
+        self.count += 1
+        self.total += value_ns
+        if self.min is None or value_ns < self.min:
+            self.min = value_ns
+        if self.max is None or value_ns > self.max:
+            self.max = value_ns
+
+    def percentile(self, fraction):
+        if not self.count:
+            return 0
+        target = max(1, round(fraction * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(max(_bucket_value(index), self.min), self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum_ns': self.total,
+            'mean_ns': self.total / self.count if self.count else 0,
+            'min_ns': self.min or 0,
+            'p50_ns': self.percentile(0.5),
+            'p90_ns': self.percentile(0.9),
+            'p99_ns': self.percentile(0.99),
+            'p999_ns': self.percentile(0.999),
+            'max_ns': self.max or 0,
+        }
+
+
+class Counter:
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    def __init__(self, name, callback=None):
+        self.name = name
+        self.callback = callback
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        if self.callback is None:
+            return self._value
+        try:
+            return self.callback()
+        except Exception as e:
+            logging.debug(f"Gauge {self.name} failed: {e}")
+            return None
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._created = time.monotonic()
+
+    def counter(self, name):
+        counter = self.counters.get(name)
+        if counter is None:
+            counter = self.counters[name] = Counter(name)
+        return counter
+
+    def gauge(self, name, callback=None):
+        gauge = self.gauges.get(name)
+        if gauge is None:
+            gauge = self.gauges[name] = Gauge(name, callback)
+        elif callback is not None:
+            gauge.callback = callback
+        return gauge
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram(name)
+        return histogram
+
+    def timed(self, name):
+        histogram = self.histogram(name)
+
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    start = time.perf_counter_ns()
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        histogram.record(time.perf_counter_ns() - start)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter_ns()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    histogram.record(time.perf_counter_ns() - start)
+            return wrapper
+        return decorator
+
+    @contextlib.contextmanager
+    def time_block(self, name):
+        histogram = self.histogram(name)
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            histogram.record(time.perf_counter_ns() - start)
+
+    def snapshot(self, previous=None):
+        now = time.monotonic()
+        last_time = previous['monotonic_time'] if previous else self._created
+        last_counters = previous['counters'] if previous else {}
+        elapsed = now - last_time
+        counters = {}
+        for name, counter in self.counters.items():
+            value = counter.value
+            last_value = last_counters[name]['value'] if name in last_counters else 0
+            counters[name] = {'value': value, 'rate_per_second': (value - last_value) / elapsed if elapsed > 0 else 0.0}
+        return {
+            'timestamp': time.time(),
+            'monotonic_time': now,
+            'counters': counters,
+            'gauges': {name: gauge.value for name, gauge in self.gauges.items()},
+            'histograms': {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+        }
+
+    def render_text(self, snapshot=None):
+        if snapshot is None:
+            snapshot = self.snapshot()
+        lines = []
+        for name, entry in sorted(snapshot['counters'].items()):
+            metric = _metric_name(name)
+            lines.append(f"# TYPE {metric}_total counter")
+            lines.append(f"{metric}_total {entry['value']}")
+            lines.append(f"{metric}_per_second {entry['rate_per_second']:.3f}")
+        for name, value in sorted(snapshot['gauges'].items()):
+            if value is None:
+                continue
+            metric = _metric_name(name)
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+        for name, entry in sorted(snapshot['histograms'].items()):
+            metric = _metric_name(name) + '_seconds'
+            lines.append(f"# TYPE {metric} summary")
+            for quantile, key in (('0.5', 'p50_ns'), ('0.9', 'p90_ns'), ('0.99', 'p99_ns'), ('0.999', 'p999_ns')):
+                lines.append(f'{metric}{{quantile="{quantile}"}} {entry[key] / 1e9:.9f}')
+            lines.append(f"{metric}_sum {entry['sum_ns'] / 1e9:.9f}")
+            lines.append(f"{metric}_count {entry['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+def _metric_name(name):
+    return 'streammatey_' + ''.join(character if character.isalnum() else '_' for character in name)
+
+
+class MetricsServer:
+    def __init__(self, registry, host='127.0.0.1', port=9102):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+        self._previous = None
+
+    async def _handle(self, reader, writer):
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+            self._previous = self.registry.snapshot(self._previous)
+            body = self.registry.render_text(self._previous).encode('utf-8')
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                         + f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('ascii') + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f"Serving metrics on http://{self.host}:{self.port}/")
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+class SnapshotWriter:
+    def __init__(self, registry, path, interval=10.0):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._previous = None
+
+    def write(self):
+        temporary_path = f"{self.path}.tmp"
+        self._previous = self.registry.snapshot(self._previous)
+        with open(temporary_path, 'w', encoding='utf-8') as snapshot_file:
+            json.dump(self._previous, snapshot_file, indent=2)
+        os.replace(temporary_path, self.path)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.write()
+            except OSError as e:
+                logging.error(f"Failed to write metrics snapshot: {e}")
+
+
+registry = MetricsRegistry()
+counter = registry.counter
+gauge = registry.gauge
+histogram = registry.histogram
+timed = registry.timed
+time_block = registry.time_block
@@ -0,0 +1,374 @@
+"""
+The `obs_client.py` script is part of the StreamMatey OBS Plugin software. It provides `OBSClient`, the one connection to the OBS WebSocket plugin (protocol 4.x) that every component shares, so clip requests, scene markers and status polls never wait on each other or block chat processing.
+
+The client runs on its own worker thread. Callers never touch the socket: `submit(request)` puts the request on a bounded queue and returns a `concurrent.futures.Future` straight away, and the worker sends queued requests as soon as they arrive without waiting for earlier ones to be answered. Each request carries a `message-id`, and a receiver thread matches every response to its future by that id, so many requests can be in flight at once. Coroutines await requests with `call_async`, which wraps the future for asyncio, and plain threads can block on one with `call`.
+
+Every request has a deadline (`request_timeout` seconds by default, or the `timeout` passed with it). A request that is not answered in time fails with `TimeoutError` at its deadline, whether it was sent, is still queued or is waiting out a reconnect: a third thread keeps the deadlines in a heap and sleeps until the earliest one. A request that OBS rejects fails with `OBSError`.
+
+If the connection drops, the requests already sent fail with `ConnectionError`, since resending them could, for example, save the replay buffer twice. The worker reconnects with exponential backoff and full jitter (like `ChatConnector`) and then sends the requests that were still queued, if their deadlines have not passed. When OBS asks for a password, the client authenticates with the challenge and salt it sends (see `auth_response`). If the `websocket-client` package is not installed, the client does not retry: it logs the error, closes itself and fails every request with `ConnectionError`.
+
+Requests are either the name of an OBS request with its fields as keyword arguments, such as `submit('SetCurrentScene', **{'scene-name': 'Game'})`, or request objects from the `obswebsocket` library, such as `requests.StartRecording()`. For a request object the result is the object itself with its response filled in, as with `obsws.call`; otherwise it is the response dictionary.
+
+The script provides the following:
+
+- `OBSClient(host='localhost', port=4444, password=None, request_timeout=5.0, ...)`: The client. `start()` starts its worker (`submit` also does), `submit(request, timeout=None, **fields)`, `call(...)` and `call_async(...)` issue requests, `on(update_type, callback)` registers a callback for OBS events, which runs on the receiver thread and should return quickly, `health()` reports the connection state and counters, and `close()` stops the worker and fails whatever is still pending.
+- `get_obs_client(host, port, password, **options)`: Returns the `OBSClient` shared by every component connecting to the same OBS instance. `options`, such as `request_timeout`, are passed to `OBSClient` when the client is created. Once the shared client is closed, the next call creates a new one.
+- `auth_response(password, salt, challenge)`: Returns the authentication string OBS expects for a password.
+"""
+
+import asyncio
+import base64
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import queue
+import random
+import socket
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+import metrics
+
+obs_requests = metrics.counter('obs.requests')
+obs_timeouts = metrics.counter('obs.timeouts')
+obs_reconnects = metrics.counter('obs.reconnects')
+obs_request_latency = metrics.histogram('obs.request')
+
+
+class OBSError(Exception):
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+
+
+def auth_response(password, salt, challenge):
+    """
+    This function returns the `auth` field of an `Authenticate` request: base64(sha256(base64(sha256(password + salt)) + challenge)).
+    """
+    secret = base64.b64encode(hashlib.sha256((password + salt).encode('utf-8')).digest()).decode('ascii')
+    return base64.b64encode(hashlib.sha256((secret + challenge).encode('utf-8')).digest()).decode('ascii')
+
+
+class _PendingRequest:
+    __slots__ = ('future', 'request', 'deadline', 'sent_at')
+
+    def __init__(self, future, request, deadline):
+        self.future = future
+        self.request = request
+        self.deadline = deadline
+        self.sent_at = None
+
+
+class OBSClient:
+    def __init__(self, host='localhost', port=4444, password=None, request_timeout=5.0, connect_timeout=5.0,
+                 initial_backoff=1.0, max_backoff=30.0, max_queued_requests=1000):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.request_timeout = request_timeout
+        self.connect_timeout = connect_timeout
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.connected = threading.Event()
+        self.reconnects = 0
+        self.timeouts = 0
+        self._queue = queue.Queue(maxsize=max_queued_requests)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._deadlines = []
+        self._deadline_changed = threading.Condition(self._lock)
+        self._message_ids = itertools.count(1)
+        self._handlers = {}
+        self._closed = threading.Event()
+        self._thread = None
+        self._expiry_thread = None
+        self._socket = None
+        self._unsent = None
+        self._reconnect_attempt = 0
+        metrics.gauge('obs.pending_requests', lambda: len(self._pending))
+
+    def start(self):
+        with self._lock:
+            if self._thread is None and not self._closed.is_set():
+                self._thread = threading.Thread(target=self._run, name="obs-client", daemon=True)
+                self._expiry_thread = threading.Thread(target=self._expire_requests, name="obs-client-deadlines", daemon=True)
+                self._thread.start()
+                self._expiry_thread.start()
+        return self
+
+    def submit(self, request, timeout=None, **fields):
+        if isinstance(request, str):
+            payload = {'request-type': request, **fields}
+        elif callable(getattr(request, 'data', None)):
+            payload = dict(request.data())
+        else:
+            payload = {'request-type': request.name, **fields}
+        message_id = str(next(self._message_ids))
+        payload['message-id'] = message_id
+        future = Future()
+        if self._closed.is_set():
+            future.set_exception(ConnectionError("The OBS client is closed"))
+            return future
+        pending = _PendingRequest(future, request, time.monotonic() + (self.request_timeout if timeout is None else timeout))
+        with self._deadline_changed:
+            self._pending[message_id] = pending
+            heapq.heappush(self._deadlines, (pending.deadline, message_id))
+            if self._deadlines[0][1] == message_id:
+                self._deadline_changed.notify()
+        try:
+            self._queue.put_nowait((message_id, payload))
+        except queue.Full:
+            with self._lock:
+                self._pending.pop(message_id, None)
+            future.set_exception(OBSError(f"Too many OBS requests queued, dropping {payload['request-type']}"))
+            return future
+        obs_requests.inc()
+        self.start()
+        return future
+
+    def call(self, request, timeout=None, **fields):
+        # The deadline thread fails the future at its deadline, even while OBS is unreachable
+        return self.submit(request, timeout, **fields).result()
+
+    async def call_async(self, request, timeout=None, **fields):
+        return await asyncio.wrap_future(self.submit(request, timeout, **fields))
+
+    def on(self, update_type, callback):
+        self._handlers.setdefault(update_type, []).append(callback)
+
+    def _backoff_delay(self):
+        ceiling = min(self.max_backoff, self.initial_backoff * 2 ** self._reconnect_attempt)
+        self._reconnect_attempt += 1
+        return random.uniform(0, ceiling)
+
+    def _connect(self):
+        import websocket
+
+        connection = websocket.create_connection(f"ws://{self.host}:{self.port}", timeout=self.connect_timeout)
+        try:
+            # Authentication happens before the receiver starts, so its responses are read here
+            status = self._handshake_request(connection, {'request-type': 'GetAuthRequired', 'message-id': 'auth-required'})
+            if status.get('authRequired'):
+                if not self.password:
+                    raise OBSError("OBS requires a password and none was given")
+                self._handshake_request(connection, {
+                    'request-type': 'Authenticate',
+                    'message-id': 'authenticate',
+                    'auth': auth_response(self.password, status['salt'], status['challenge']),
+                })
+            connection.settimeout(None)
+        except BaseException:
+            self._shutdown(connection)
+            raise
+        return connection
+
+    @staticmethod
+    def _shutdown(connection):
+        # Closing the socket alone does not wake a thread blocked reading it
+        try:
+            connection.sock.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            pass
+        connection.shutdown()
+
+    @staticmethod
+    def _handshake_request(connection, payload):
+        connection.send(json.dumps(payload))
+        while True:
+            response = json.loads(connection.recv())
+            if response.get('message-id') == payload['message-id']:
+                if response.get('status') == 'error':
+                    raise OBSError(f"{payload['request-type']} failed: {response.get('error')}", response)
+                return response
+
+    def _run(self):
+        while not self._closed.is_set():
+            try:
+                connection = self._connect()
+            except ImportError as e:
+                # Retrying will not install websocket-client, so the client stops and fails every request now
+                logging.error(f"Cannot connect to OBS without the websocket-client package: {e}")
+                self._closed.set()
+                with self._deadline_changed:
+                    self._deadline_changed.notify_all()
+                self._fail_all_requests(ConnectionError(f"Cannot connect to OBS without the websocket-client package: {e}"))
+                return
+            except Exception as e:
+                delay = self._backoff_delay()
+                logging.warning(f"Failed to connect to OBS at {self.host}:{self.port}, retrying in {delay:.1f}s: {e}")
+                self._closed.wait(delay)
+                continue
+            self._socket = connection
+            self._reconnect_attempt = 0
+            receiver = threading.Thread(target=self._receive, args=(connection,), name="obs-client-receiver", daemon=True)
+            receiver.start()
+            self.connected.set()
+            logging.info(f"Connected to OBS at {self.host}:{self.port}")
+            try:
+                self._send_requests(connection, receiver)
+            except Exception as e:
+                logging.warning(f"Lost the connection to OBS: {e}")
+            finally:
+                self.connected.clear()
+                self._socket = None
+                # Shut down rather than close: the receiver is still reading, so no closing handshake
+                self._shutdown(connection)
+                receiver.join()
+                self._fail_sent_requests(ConnectionError("The connection to OBS was lost"))
+            if not self._closed.is_set():
+                self.reconnects += 1
+                obs_reconnects.inc()
+        self._fail_all_requests(ConnectionError("The OBS client is closed"))
+
+    def _send_requests(self, connection, receiver):
+        while not self._closed.is_set() and receiver.is_alive():
+            if self._unsent is not None:
+                item, self._unsent = self._unsent, None
+            else:
+                try:
+                    item = self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            message_id, payload = item
+            with self._lock:
+                pending = self._pending.get(message_id)
+            if pending is None:
+                continue  # Timed out or cancelled while queued
+            pending.sent_at = time.monotonic()
+            try:
+                connection.send(json.dumps(payload))
+            except Exception:
+                pending.sent_at = None
+                self._unsent = item
+                raise
+
+    def _receive(self, connection):
+        while True:
+            try:
+                raw = connection.recv()
+            except Exception:
+                return
+            if not raw:
+                return  # Closed by OBS
+            try:
+                message = json.loads(raw)
+            except ValueError:
+                logging.warning(f"Ignoring a malformed message from OBS: {raw[:200]!r}")
+                continue
+            if 'message-id' in message:
+                self._resolve(message)
+            elif 'update-type' in message:
+                for callback in self._handlers.get(message['update-type'], ()):
+                    try:
+                        callback(message)
+                    except Exception as e:
+                        logging.error(f"OBS event handler for {message['update-type']} failed: {e}")
+
+    def _resolve(self, response):
+        with self._lock:
+            pending = self._pending.pop(response['message-id'], None)
+        if pending is None:
+            return  # Already timed out
+        if pending.sent_at is not None:
+            obs_request_latency.record((time.monotonic() - pending.sent_at) * 1e9)
+        try:
+            if response.get('status') == 'error':
+                pending.future.set_exception(OBSError(response.get('error', 'OBS request failed'), response))
+            elif callable(getattr(pending.request, 'input', None)):
+                pending.request.input(response)
+                pending.future.set_result(pending.request)
+            else:
+                pending.future.set_result(response)
+        except InvalidStateError:
+            pass  # Cancelled by the caller
+
+    @staticmethod
+    def _set_exception(failed, exception):
+        # Outside the lock: done callbacks may submit further requests
+        for pending in failed:
+            try:
+                pending.future.set_exception(exception)
+            except InvalidStateError:
+                pass
+
+    def _fail(self, condition, exception):
+        with self._lock:
+            failed = [message_id for message_id, pending in self._pending.items() if condition(pending)]
+            failed = [self._pending.pop(message_id) for message_id in failed]
+        self._set_exception(failed, exception)
+        return len(failed)
+
+    def _expire_requests(self):
+        while True:
+            with self._deadline_changed:
+                if self._closed.is_set():
+                    return
+                now = time.monotonic()
+                expired = []
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    _, message_id = heapq.heappop(self._deadlines)
+                    pending = self._pending.pop(message_id, None)
+                    if pending is not None:  # Otherwise answered or failed already
+                        expired.append(pending)
+                if not expired:
+                    self._deadline_changed.wait(self._deadlines[0][0] - now if self._deadlines else None)
+                    continue
+            self.timeouts += len(expired)
+            obs_timeouts.inc(len(expired))
+            self._set_exception(expired, TimeoutError("OBS did not answer in time"))
+
+    def _fail_sent_requests(self, exception):
+        self._fail(lambda pending: pending.sent_at is not None, exception)
+
+    def _fail_all_requests(self, exception):
+        self._fail(lambda pending: True, exception)
+
+    def health(self):
+        return {
+            'connected': self.connected.is_set(),
+            'reconnect_attempt': self._reconnect_attempt,
+            'reconnects': self.reconnects,
+            'pending_requests': len(self._pending),
+            'queued_requests': self._queue.qsize(),
+            'timeouts': self.timeouts,
+        }
+
+    def close(self, timeout=5.0):
+        self._closed.set()
+        with self._deadline_changed:
+            self._deadline_changed.notify_all()
+        connection = self._socket
+        if connection is not None:
+            self._shutdown(connection)
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._expiry_thread.join(timeout)
+        self._fail_all_requests(ConnectionError("The OBS client is closed"))
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_obs_client(host='localhost', port=4444, password=None, **options):
+    """
+    This function returns the `OBSClient` shared by every component connecting to OBS at `host` and `port`, creating it on first use and again after it is closed.
+    """
+    with _clients_lock:
+        client = _clients.get((host, port))
+        # A closed client cannot be restarted, so it is replaced
+        if client is None or client._closed.is_set():
+            client = _clients[(host, port)] = OBSClient(host, port, password, **options)
+        return client
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    client = get_obs_client('localhost', 4444, 'secret').start()
+    # Pipelined: both requests are sent before either answer arrives
+    version, status = client.submit('GetVersion'), client.submit('GetStreamingStatus')
+    print(version.result())
+    print(status.result())
+    client.close()
@@ -0,0 +1,349 @@
+"""
+The `pipeline.py` script is part of the StreamMatey OBS Plugin software. It provides the runtime that carries chat messages from the Twitch chat connection to clips in OBS, configured from a JSON file rather than constants in code.
+
+Messages go through six stages, each running on its own and connected to the next by a bounded queue:
+
+- `ingest`: Takes batches of up to `batch_size` messages from the `ChatConnector` queue and turns each message into a `ChatEvent`.
+- `filter`: Marks messages a viewer repeats, and copypasta, with the `SpamFilter` (see `spam_filter.py`). An emote flood from many viewers is not spam.
+- `score`: Scores the messages that are not spam with the `SentimentAnalyzer` in one call per batch.
+- `aggregate`: Updates the `ActivityMonitor` and `SentimentAggregator` of the message's channel with each message, and marks the message with which a spike starts: the first one after which the channel's activity is above `activity_threshold` (in messages per second) and its rolling sentiment spikes. Every channel has its own monitor and aggregator, so a busy channel does not raise the baseline of a quiet one. The messages that follow while the spike lasts are not marked, so one spike asks for one clip; the next clip can only come from a new spike, once the last one has ended.
+- `trigger`: Asks the `ClipCreator` for a clip for every marked message.
+- `persist`: Stores every message, with its score unless it was spam, in the database.
+
+Each stage has a `concurrency` and a number of `workers` in the `stages` section of the configuration. `async` stages run on the event loop, `thread` stages run their batches on a pool of `workers` threads, and a `process` score stage looks up cached scores on a thread and scores the rest across a pool of `workers` processes (see `SentimentAnalyzer`). The filter, aggregate and trigger stages keep state that depends on message order, so they run with one worker. A stage with several workers works on several batches at once but passes them on in the order they arrived. Each queue holds at most `queue_size` batches, so when a stage falls behind, the stages before it wait instead of piling up messages, and eventually the chat connector applies its own overflow policy.
+
+Throughput is tuned by changing the stage settings in the configuration file, for example scoring on a thread pool or a process pool when VADER is the bottleneck; `python benchmarks.py pipeline` compares settings on a recorded log. Every stage records its batch latency in the `pipeline.<stage>` histogram and the depth of its input queue in the `pipeline.<stage>.queue_depth` gauge (see `metrics.py`).
+
+The script provides the following:
+
+- `DEFAULT_CONFIG`: Every configuration setting with its default. `config.example.json` lists the same settings.
+- `load_config(path=None, overrides=None)`: Returns the defaults updated with the settings in a JSON file and then with `overrides`. Settings in `stages` are merged per stage. Unknown settings, stages and concurrency modes raise `ValueError`.
+- `ChatEvent`: One chat message as it moves through the pipeline: its content, channel, user and timestamp, whether it is spam, its sentiment score and, when it triggers a clip, the trigger.
+- `Pipeline(config, chat_connector, clip_creator, database, sentiment_analyzer=None, on_trigger=None)`: The runtime. `run()` runs the stages until the chat connector's queue yields `None` or `stop()` is called, and then lets the messages already taken finish every stage. `on_trigger` is called with each trigger, a dictionary with the timestamp, channel, activity level, rolling sentiment and z-score. `channels` holds the `ChannelActivity` of every channel seen so far.
+- `ChannelActivity(config)`: The `ActivityMonitor` and `SentimentAggregator` of one channel, and whether it is in a spike.
+"""
+
+import asyncio
+import copy
+import json
+import logging
+import time
+from activity_monitor import ActivityMonitor
+from sentiment_aggregator import SentimentAggregator
+from sentiment_analyzer import SentimentAnalyzer
+from spam_filter import SpamFilter
+import metrics
+
+STAGE_NAMES = ('ingest', 'filter', 'score', 'aggregate', 'trigger', 'persist')
+
+# The concurrency modes each stage supports
+STAGE_MODES = {
+    'ingest': ('async',),
+    'filter': ('async', 'thread'),
+    'score': ('async', 'thread', 'process'),
+    'aggregate': ('async', 'thread'),
+    'trigger': ('async',),
+    'persist': ('async', 'thread'),
+}
+# Stages whose state depends on message order, which run with one worker
+SERIAL_STAGES = ('ingest', 'filter', 'aggregate', 'trigger')
+
+DEFAULT_CONFIG = {
+    'obs_host': 'localhost',
+    'obs_port': 4444,
+    'obs_request_timeout': 5.0,  # seconds
+    'channels': [],  # the authenticated user's own channel when empty
+    'chat_queue_size': 10000,  # messages
+    'chat_overflow_policy': 'drop_oldest',
+    'database_path': 'comments.db',
+    'metrics_port': 9102,  # local text endpoint, http://127.0.0.1:9102/
+    'metrics_snapshot_path': 'metrics.json',
+    'metrics_snapshot_interval': 10,  # seconds
+    'batch_size': 500,  # messages per batch
+    'batch_timeout': 1.0,  # seconds to wait for a message before checking for stop()
+    'spam_window': 30,  # seconds
+    'spam_max_repeats': 3,  # copies of a message scored per viewer, or per chat for copypasta, per spam window
+    'spam_copypasta_length': 40,  # characters from which a message is also counted across viewers
+    'activity_window': 60,  # seconds
+    'activity_threshold': 50 / 60,  # messages per second, 50 a minute
+    'sentiment_threshold': 0.05,  # positive rolling sentiment
+    'sentiment_half_life': 5.0,  # seconds
+    'sentiment_z_threshold': 2.0,  # rolling sentiment against the activity window
+    'clip_mode': 'recording',
+    'clip_sensitivity': 0,
+    'clip_length': 60,  # seconds
+    'max_clip_length': 300,  # seconds
+    'post_roll': 10,  # seconds
+    'min_clip_interval': 30,  # seconds
+    'shard_count': 0,  # shard processes splitting the channels between them, see channel_shards.py; 0 runs the pipeline in one process
+    'stages': {
+        'ingest': {'concurrency': 'async', 'workers': 1, 'queue_size': 8},
+        'filter': {'concurrency': 'async', 'workers': 1, 'queue_size': 8},
+        'score': {'concurrency': 'thread', 'workers': 1, 'queue_size': 8},
+        'aggregate': {'concurrency': 'async', 'workers': 1, 'queue_size': 8},
+        'trigger': {'concurrency': 'async', 'workers': 1, 'queue_size': 8},
+        'persist': {'concurrency': 'thread', 'workers': 1, 'queue_size': 8},
+    },
+}
+
+pipeline_messages = metrics.counter('pipeline.messages')
+
+
+def load_config(path=None, overrides=None):
+    """
+    This function returns the pipeline configuration: the defaults, updated with the settings in the JSON file at `path` and then with `overrides`.
+    """
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    layers = []
+    if path is not None:
+        with open(path, encoding='utf-8') as config_file:
+            layers.append(json.load(config_file))
+    if overrides:
+        layers.append(overrides)
+    for layer in layers:
+        for key, value in layer.items():
+            if key not in DEFAULT_CONFIG:
+                raise ValueError(f"Unknown pipeline setting {key!r}")
+            if key != 'stages':
+                config[key] = value
+                continue
+            for stage, settings in value.items():
+                if stage not in STAGE_NAMES:
+                    raise ValueError(f"Unknown pipeline stage {stage!r}, expected one of {STAGE_NAMES}")
+                unknown = set(settings) - set(DEFAULT_CONFIG['stages'][stage])
+                if unknown:
+                    raise ValueError(f"Unknown settings {sorted(unknown)} for the {stage} stage")
+                config['stages'][stage].update(settings)
+    for stage, settings in config['stages'].items():
+        if settings['concurrency'] not in STAGE_MODES[stage]:
+            raise ValueError(f"The {stage} stage cannot run as {settings['concurrency']!r}, expected one of {STAGE_MODES[stage]}")
+        if settings['workers'] < 1 or settings['queue_size'] < 1:
+            raise ValueError(f"The {stage} stage needs at least one worker and a queue of at least one batch")
+        if settings['workers'] > 1 and stage in SERIAL_STAGES:
+            raise ValueError(f"The {stage} stage depends on message order and runs with one worker")
+    return config
+
+
+def _message_timestamp(message):
+    timestamp = getattr(message, 'timestamp', None)
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    if hasattr(timestamp, 'timestamp'):
+        return timestamp.timestamp()  # twitchio gives a datetime
+    return time.time()
+
+
+class ChatEvent:
+    __slots__ = ('content', 'channel', 'user', 'timestamp', 'spam', 'sentiment', 'trigger')
+
+    def __init__(self, content, channel=None, user=None, timestamp=None):
+        self.content = content
+        self.channel = channel
+        self.user = user
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.spam = False
+        self.sentiment = None
+        self.trigger = None
+
+    @classmethod
+    def from_message(cls, message):
+        return cls(message.content, getattr(message.channel, 'name', None), getattr(message.author, 'name', None), _message_timestamp(message))
+
+
+class ChannelActivity:
+    __slots__ = ('activity_monitor', 'sentiment_aggregator', 'spiking')
+
+    def __init__(self, config):
+        self.activity_monitor = ActivityMonitor(config['activity_window'])
+        self.sentiment_aggregator = SentimentAggregator(config['activity_window'], half_life=config['sentiment_half_life'],
+                                                        z_threshold=config['sentiment_z_threshold'], sentiment_threshold=config['sentiment_threshold'])
+        self.spiking = False
+
+
+class _Stage:
+    def __init__(self, name, handler, concurrency, workers, queue_size):
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.workers = workers
+        self.input = asyncio.Queue(maxsize=queue_size)
+        self.executor = None
+        if concurrency != 'async':
+            from concurrent.futures import ThreadPoolExecutor
+            # Process stages dispatch to their process pool from these threads
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"pipeline-{name}")
+        self.latency = metrics.histogram(f'pipeline.{name}')
+        metrics.gauge(f'pipeline.{name}.queue_depth', self.input.qsize)
+        # Batches finished out of order, held until the ones before them are passed on
+        self._finished = {}
+        self._next_sequence = 0
+        self._emit_lock = asyncio.Lock()
+
+    async def apply(self, batch):
+        start = time.perf_counter_ns()
+        if self.executor is None:
+            result = self.handler(batch)
+            if asyncio.iscoroutine(result):
+                result = await result
+        else:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, self.handler, batch)
+        self.latency.record(time.perf_counter_ns() - start)
+        return result
+
+    async def emit(self, output, sequence, batch):
+        if output is None:
+            return
+        if self.workers == 1:
+            await output.put((sequence, batch))
+            return
+        self._finished[sequence] = batch
+        async with self._emit_lock:
+            while self._next_sequence in self._finished:
+                await output.put((self._next_sequence, self._finished.pop(self._next_sequence)))
+                self._next_sequence += 1
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+
+class Pipeline:
+    def __init__(self, config, chat_connector, clip_creator, database, sentiment_analyzer=None, on_trigger=None):
+        self.config = config
+        self.chat_connector = chat_connector
+        self.clip_creator = clip_creator
+        self.database = database
+        score_settings = config['stages']['score']
+        self._owns_analyzer = sentiment_analyzer is None
+        if sentiment_analyzer is None:
+            processes = score_settings['workers'] if score_settings['concurrency'] == 'process' else 1
+            sentiment_analyzer = SentimentAnalyzer(database, processes=processes)
+        self.sentiment_analyzer = sentiment_analyzer
+        self.spam_filter = SpamFilter(config['spam_window'], config['spam_max_repeats'], config['spam_copypasta_length'])
+        self.channels = {}
+        self.on_trigger = on_trigger
+        self.processed = 0
+        self._stopping = False
+
+    def _filter(self, batch):
+        for event in batch:
+            event.spam = self.spam_filter.is_spam(event.content, event.timestamp, event.user)
+        return batch
+
+    def _score(self, batch):
+        events = [event for event in batch if not event.spam]
+        if events:
+            scores = self.sentiment_analyzer.analyze_sentiment_batch([event.content for event in events])
+            for event, score in zip(events, scores):
+                event.sentiment = float(score)
+        return batch
+
+    def _aggregate(self, batch):
+        threshold = self.config['activity_threshold']
+        for event in batch:
+            state = self.channels.get(event.channel)
+            if state is None:
+                state = self.channels[event.channel] = ChannelActivity(self.config)
+            # Repeats still count towards activity, but not towards the sentiment
+            state.activity_monitor.add_message(event, event.timestamp)
+            if event.spam:
+                continue
+            aggregator = state.sentiment_aggregator
+            aggregator.add_score(event.sentiment, event.user, event.timestamp)
+            activity = state.activity_monitor.get_activity_level(timestamp=event.timestamp)
+            spiking = activity > threshold and aggregator.is_spike(event.timestamp)
+            if spiking and not state.spiking:
+                event.trigger = {'timestamp': event.timestamp, 'channel': event.channel, 'activity': activity,
+                                 'sentiment': aggregator.get_ewma(), 'z_score': aggregator.get_z_score(event.timestamp)}
+            state.spiking = spiking
+        return batch
+
+    async def _trigger(self, batch):
+        for event in batch:
+            if event.trigger is None:
+                continue
+            if self.on_trigger is not None:
+                self.on_trigger(event.trigger)
+            await self.clip_creator.create_clip(event.trigger['sentiment'], event.channel, event.timestamp)
+        return batch
+
+    def _persist(self, batch):
+        for event in batch:
+            self.database.store_comment(event.content, channel=event.channel, timestamp=event.timestamp, sentiment=event.sentiment)
+        self.processed += len(batch)
+        pipeline_messages.inc(len(batch))
+
+    async def _ingest(self, stage, output):
+        sequence = 0
+        finished = False
+        while not finished and not self._stopping:
+            messages = await self.chat_connector.get_messages(self.config['batch_size'], timeout=self.config['batch_timeout'])
+            if None in messages:
+                # The end of the chat, as in a replayed log
+                finished = True
+                messages = messages[:messages.index(None)]
+            if not messages:
+                continue
+            batch = await stage.apply(messages)
+            await stage.emit(output, sequence, batch)
+            sequence += 1
+
+    def _ingest_batch(self, messages):
+        return [ChatEvent.from_message(message) for message in messages]
+
+    async def _work(self, stage, output):
+        while True:
+            item = await stage.input.get()
+            if item is None:
+                # Leave the end marker for this stage's other workers
+                await stage.input.put(None)
+                return
+            sequence, batch = item
+            try:
+                batch = await stage.apply(batch)
+            except Exception as e:
+                # A failed batch is logged and dropped; passing it on empty keeps the batches after it in order
+                logging.error(f"The {stage.name} stage failed on a batch of {len(batch)} messages: {e}")
+                batch = []
+            await stage.emit(output, sequence, batch)
+
+    async def _run_stage(self, stage, output):
+        try:
+            if stage.name == 'ingest':
+                await self._ingest(stage, output)
+            else:
+                await asyncio.gather(*(self._work(stage, output) for _ in range(stage.workers)))
+        finally:
+            if output is not None:
+                await output.put(None)
+
+    async def run(self):
+        handlers = {
+            'ingest': self._ingest_batch,
+            'filter': self._filter,
+            'score': self._score,
+            'aggregate': self._aggregate,
+            'trigger': self._trigger,
+            'persist': self._persist,
+        }
+        stages = [_Stage(name, handlers[name], **self.config['stages'][name]) for name in STAGE_NAMES]
+        outputs = [stage.input for stage in stages[1:]] + [None]
+        tasks = [asyncio.create_task(self._run_stage(stage, output), name=f"pipeline-{stage.name}") for stage, output in zip(stages, outputs)]
+        try:
+            # A stage that fails stops the pipeline instead of leaving the others waiting on it
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for stage in stages:
+                stage.close()
+            if self._owns_analyzer:
+                self.sentiment_analyzer.close()
+        logging.info(f"Pipeline stopped after {self.processed} messages")
+
+    def stop(self):
+        self._stopping = True
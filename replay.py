@@ -0,0 +1,274 @@
+"""
+The `replay.py` script is part of the StreamMatey OBS Plugin software. It replays a recorded chat log through the clip-detection pipeline without connecting to Twitch or OBS, so thresholds can be tuned and throughput measured offline.
+
+A chat log is a JSONL file with one message per line:
+
+    {"timestamp": 1686855600.25, "channel": "channel1", "user": "viewer42", "message": "PogChamp"}
+
+The messages are published into a real `ChatConnector` queue and then go through the same `Pipeline` as live chat (see `pipeline.py`): `SpamFilter` sets repeats aside, `SentimentAnalyzer` scores the rest in batches, `ActivityMonitor` and `SentimentAggregator` track the chat rate and rolling sentiment using the timestamps from the log, and `ClipCreator` is asked for a clip (by default in replay buffer mode) whenever a channel's rolling sentiment starts to spike while its activity exceeds its threshold; the clips it stores are read back from the database. The settings are those of the pipeline configuration, including the concurrency of each stage, so a replay can compare stage settings on the same log. OBS is replaced by a `FakeOBSWebSocketServer` (see `fake_servers.py`) on a local port, which the clip creator reaches through a real `OBSClient` (see `obs_client.py`), so clip requests take the same path as live, including authentication, and the server records each request with its log time. Twitch is replaced by a `FakeTwitchAPI` that answers user and channel lookups with canned data and records them.
+
+Time is controlled by a `ReplayClock`. With a speed of 1 the log is replayed in wall-clock time, with a speed of 10 ten times faster, and with a speed of 0 as fast as the pipeline can go. The clip creator runs on the same time scale, so at a fixed speed merged and rate-limited triggers behave as they would live; at maximum speed clips only finish when the pipeline yields, so use a fixed speed to check clip decisions.
+
+The script provides the following:
+
+- `load_chat_log(path)`: Yields the messages of a JSONL chat log as `ReplayMessage` objects, which have the `content`, `channel.name` and `author.name` attributes of a twitchio message plus the `timestamp` from the log.
+- `ReplayClock(speed)`: Maps log time to wall time. `wait_until(timestamp)` sleeps until a log timestamp is due.
+- `FakeTwitchAPI`: A stand-in for `AsyncTwitchAPI` that records its calls.
+- `FakeOBSConnection`: An in-process stand-in for `OBSClient` that records its calls, for benchmarks that time the clip creator without a socket.
+- `ReplayRunner(log_path, speed=0, settings=None)`: Runs a replay with `run()` and returns a dictionary with the number of messages, throughput, clip triggers, stored clips, OBS requests, per-stage latency percentiles and peak memory.
+
+Example:
+
+    python replay.py chat_log.jsonl --speed 10
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+import types
+from concurrent.futures import ThreadPoolExecutor
+from sentiment_analyzer import get_vader
+from clip_creator import ClipCreator
+from fake_servers import FakeOBSWebSocketServer
+from obs_client import OBSClient
+from pipeline import DEFAULT_CONFIG, STAGE_NAMES, Pipeline, load_config
+from database import Database
+import metrics
+
+# Pipeline settings (see `pipeline.DEFAULT_CONFIG`) that differ for a replay
+DEFAULT_SETTINGS = {
+    'activity_threshold': 5.0,  # messages per second
+    'clip_mode': 'replay_buffer',
+    'clip_length': 60,  # seconds of log time
+    'post_roll': 10,  # seconds of log time
+    'min_clip_interval': 30,  # seconds of log time
+    'batch_timeout': None,  # the end of the log is marked, so never wait on a timeout
+    'database_path': None,  # a temporary database when not set
+}
+
+# Histograms timing each stage of the pipeline
+STAGES = tuple(f'pipeline.{name}' for name in STAGE_NAMES)
+
+
+class ReplayMessage:
+    def __init__(self, timestamp, channel, user, content):
+        self.timestamp = timestamp
+        self.channel = types.SimpleNamespace(name=channel)
+        self.author = types.SimpleNamespace(name=user)
+        self.content = content
+
+
+def load_chat_log(path):
+    """
+    This function yields the messages of a JSONL chat log as `ReplayMessage` objects, in file order.
+    """
+    with open(path, encoding='utf-8') as log_file:
+        for line in log_file:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            yield ReplayMessage(float(entry['timestamp']), entry.get('channel', ''), entry.get('user', ''), entry['message'])
+
+
+class ReplayClock:
+    def __init__(self, speed=0):
+        self.speed = speed
+        self._log_start = None
+        self._log_latest = None
+        self._wall_start = None
+
+    def start(self, log_timestamp):
+        self._log_start = self._log_latest = log_timestamp
+        self._wall_start = time.monotonic()
+
+    def now(self):
+        """
+        Returns the log time that corresponds to the current wall time, or at maximum speed the timestamp of the latest message.
+        """
+        if not self.speed:
+            return self._log_latest
+        return self._log_start + (time.monotonic() - self._wall_start) * self.speed
+
+    async def wait_until(self, log_timestamp):
+        if self._log_start is None:
+            self.start(log_timestamp)
+        self._log_latest = max(self._log_latest, log_timestamp)
+        if not self.speed:
+            return
+        delay = self._wall_start + (log_timestamp - self._log_start) / self.speed - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class FakeOBSConnection:
+    def __init__(self, clock=None, latency=0.0):
+        self.clock = clock
+        self.latency = latency
+        self.calls = []
+        # Answers requests in order off the event loop, like the OBSClient worker
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fake-obs")
+
+    def start(self):
+        return self
+
+    def call(self, request, timeout=None, **fields):
+        if self.latency:
+            time.sleep(self.latency)
+        name = request if isinstance(request, str) else getattr(request, 'name', None) or type(request).__name__
+        self.calls.append((self.clock.now() if self.clock else time.time(), name))
+        return {'request-type': name, 'status': 'ok'} if isinstance(request, str) else request
+
+    def submit(self, request, timeout=None, **fields):
+        return self._executor.submit(self.call, request)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class FakeTwitchAPI:
+    def __init__(self, login='replay_user', user_id='0'):
+        self.access_token = 'replay'
+        self.user = {'id': user_id, 'login': login, 'display_name': login}
+        self.calls = []
+
+    async def get_user_info(self):
+        self.calls.append(('get_user_info',))
+        return self.user
+
+    async def get_users(self, ids=(), logins=()):
+        self.calls.append(('get_users', tuple(ids), tuple(logins)))
+        return {**{user_id: {'id': user_id, 'login': f'user{user_id}'} for user_id in ids},
+                **{login: {'id': login, 'login': login.lower()} for login in logins}}
+
+    async def get_channel_info(self, broadcaster_id):
+        self.calls.append(('get_channel_info', broadcaster_id))
+        return {'broadcaster_id': broadcaster_id, 'broadcaster_login': self.user['login'], 'title': 'Replay'}
+
+    async def close(self):
+        pass
+
+
+class ReplayRunner:
+    def __init__(self, log_path, speed=0, settings=None):
+        self.log_path = log_path
+        self.speed = speed
+        self.settings = load_config(overrides={**DEFAULT_SETTINGS, **(settings or {})})
+        self.clock = ReplayClock(speed)
+        self.twitch_api = FakeTwitchAPI()
+        self.obs_server = None
+        self.triggers = []
+        self.clips = []
+
+    async def _produce(self, chat_connector):
+        for message in load_chat_log(self.log_path):
+            await self.clock.wait_until(message.timestamp)
+            await chat_connector.publish(message)
+        # Marks the end of the log; put on the queue directly so it is not counted as chat
+        await chat_connector.messages.put(None)
+
+    async def _run(self, database):
+        from chat_connector import ChatConnector
+
+        settings = self.settings
+        speed_factor = self.speed or float('inf')
+        user_info = await self.twitch_api.get_user_info()
+        chat_connector = ChatConnector(self.twitch_api.access_token, '', user_info['login'], '!', [user_info['login']], overflow_policy='block')
+        obs_client = OBSClient('127.0.0.1', self.obs_server.port, self.obs_server.password).start()
+        clip_creator = ClipCreator('127.0.0.1', self.obs_server.port, self.obs_server.password, clip_sensitivity=settings['clip_sensitivity'], clip_length=settings['clip_length'],
+                                   max_clip_length=settings['max_clip_length'], database=database, mode=settings['clip_mode'],
+                                   post_roll=settings['post_roll'], min_clip_interval=settings['min_clip_interval'], time_scale=speed_factor,
+                                   obs_client=obs_client)
+        pipeline = Pipeline(settings, chat_connector, clip_creator, database, on_trigger=self.triggers.append)
+        first_message = next(load_chat_log(self.log_path), None)
+        if first_message is not None:
+            self.clock.start(first_message.timestamp)
+        if clip_creator.mode == 'replay_buffer':
+            await clip_creator.start_replay_buffer()
+
+        # Keep opening the database out of the measured throughput
+        pipeline.sentiment_analyzer.warm_up()
+
+        producer = asyncio.create_task(self._produce(chat_connector))
+        start = time.perf_counter()
+        await pipeline.run()
+        await producer
+        elapsed = time.perf_counter() - start
+        await clip_creator.wait_for_clip()
+        if clip_creator.mode == 'replay_buffer':
+            await clip_creator.stop_replay_buffer()
+        database.flush()
+        clip_creator.close()
+        obs_client.close()
+        self.clips = database.get_clips(float('-inf'), float('inf'))
+        return pipeline.processed, elapsed, clip_creator
+
+    async def run(self):
+        for name in STAGES:
+            metrics.histogram(name).reset()
+        self.triggers = []
+        # Load the VADER lexicon and NumPy before tracing so they do not count towards peak memory
+        import numpy  # noqa: F401
+        get_vader()
+        tracemalloc.start()
+        with tempfile.TemporaryDirectory() as directory:
+            database = Database(self.settings['database_path'] or os.path.join(directory, 'replay.db'))
+            self.obs_server = FakeOBSWebSocketServer(latency=0, password='replay', clock=self.clock.now)
+            try:
+                processed, elapsed, clip_creator = await self._run(database)
+            finally:
+                self.obs_server.close()
+                database.close()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {
+            'messages': processed,
+            'elapsed': elapsed,
+            'messages_per_second': processed / elapsed if elapsed else 0.0,
+            'triggers': self.triggers,
+            'clips_created': clip_creator.clips_created,
+            'triggers_merged': clip_creator.triggers_merged,
+            'triggers_rate_limited': clip_creator.triggers_rate_limited,
+            'clips': self.clips,
+            'obs_calls': list(self.obs_server.requests),
+            'twitch_calls': self.twitch_api.calls,
+            'stage_latency': {name: metrics.histogram(name).snapshot() for name in STAGES},
+            'peak_memory_bytes': peak_memory,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded chat log through the StreamMatey pipeline")
+    parser.add_argument('log', help="JSONL chat log with timestamp, channel, user and message fields")
+    parser.add_argument('--speed', type=float, default=0, help="replay speed, 1 for wall-clock time and 0 for as fast as possible")
+    parser.add_argument('--activity-threshold', type=float, default=DEFAULT_SETTINGS['activity_threshold'])
+    parser.add_argument('--sentiment-threshold', type=float, default=DEFAULT_CONFIG['sentiment_threshold'])
+    parser.add_argument('--z-threshold', type=float, default=DEFAULT_CONFIG['sentiment_z_threshold'])
+    parser.add_argument('--clip-mode', choices=('recording', 'replay_buffer'), default=DEFAULT_SETTINGS['clip_mode'])
+    parser.add_argument('--clip-length', type=float, default=DEFAULT_SETTINGS['clip_length'], help="clip length in seconds of log time")
+    args = parser.parse_args(argv)
+
+    runner = ReplayRunner(args.log, args.speed, {
+        'activity_threshold': args.activity_threshold,
+        'sentiment_threshold': args.sentiment_threshold,
+        'sentiment_z_threshold': args.z_threshold,
+        'clip_mode': args.clip_mode,
+        'clip_length': args.clip_length,
+    })
+    result = asyncio.run(runner.run())
+    print(f"Replayed {result['messages']} messages in {result['elapsed']:.2f}s ({result['messages_per_second']:,.0f} msgs/s)")
+    print(f"Clip triggers: {len(result['triggers'])}, clips created: {result['clips_created']}, "
+          f"merged: {result['triggers_merged']}, rate limited: {result['triggers_rate_limited']}")
+    for channel, start_time, end_time, trigger_time, trigger_score, mode in result['clips']:
+        print(f"  {channel}: {start_time:.2f} to {end_time:.2f}, triggered at {trigger_time:.2f} with score {trigger_score}")
+    for timestamp, request in result['obs_calls']:
+        print(f"  {timestamp:.2f} {request}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,201 @@
+"""
+The `sentiment_aggregator.py` script is part of the StreamMatey OBS Plugin software. It provides the `SentimentAggregator` class, which turns the sentiment scores of individual chat messages into rolling statistics for the whole chat, so a clip is triggered by a shift in the mood of the chat rather than by one upbeat message during a burst.
+
+The aggregator works alongside `ActivityMonitor` and uses the same design: scores are summed into fixed-width time buckets (1 second by default) held in a ring, and running totals are kept for the window, so every update is O(1) and memory is bounded by the window size. It keeps:
+
+- The windowed mean and variance of the sentiment over the last `window_size` seconds, the baseline mood of the chat.
+- An exponentially weighted moving average (EWMA) and variance whose weights halve every `half_life` seconds, the current mood of the chat.
+- A z-score that compares the two. The EWMA is a weighted mean of a few recent messages, so the z-score divides its distance from the windowed mean by the standard error of a mean over that many messages. A spike is a z-score above `z_threshold` while the EWMA itself is above `sentiment_threshold`.
+
+Messages are weighted per user. Each user's weight is divided by the number of messages they sent recently (a count that halves every `user_half_life` seconds), so one viewer spamming a happy emote counts roughly once, while many viewers reacting at the same moment count fully. `user_weights` can give some users (moderators, for example) a different base weight. The number of users remembered is capped at `max_users`, forgetting the least recently seen first.
+
+The `SentimentAggregator` class has the following methods:
+
+- `add_score(score, user=None, timestamp=None)`: Adds one message's score and returns the weight it was given.
+- `get_mean(timestamp=None)` and `get_variance(timestamp=None)`: Return the windowed mean and variance.
+- `get_ewma()` and `get_ewm_variance()`: Return the exponentially weighted mean and variance.
+- `get_z_score(timestamp=None)`: Returns the z-score of the EWMA against the window.
+- `is_spike(timestamp=None)`: Returns whether the sentiment is spiking, the check used to trigger clips.
+- `get_stats(timestamp=None)`: Returns all of the above as a dictionary.
+"""
+
+import collections
+import math
+import time
+
+class SentimentAggregator:
+    def __init__(self, window_size=60, bucket_width=1.0, half_life=5.0, z_threshold=2.0, sentiment_threshold=0.05,
+                 min_messages=20, user_half_life=30.0, user_weights=None, max_users=50000, clock=time.time):
+        self.window_size = window_size
+        self.bucket_width = bucket_width
+        self.half_life = half_life
+        self.z_threshold = z_threshold
+        self.sentiment_threshold = sentiment_threshold
+        self.min_messages = min_messages
+        self.user_half_life = user_half_life
+        self.user_weights = user_weights or {}
+        self.max_users = max_users
+        self.clock = clock
+        self._window_buckets = max(1, math.ceil(window_size / bucket_width))
+        # One extra slot so the bucket leaving the window is still intact when it is subtracted
+        self._ring_size = self._window_buckets + 1
+        self._reset_window()
+        self._current_bucket = None
+        # Exponentially decayed sums of weight, squared weight, weighted score and weighted squared score
+        self._ew_weight = 0.0
+        self._ew_weight_squared = 0.0
+        self._ew_sum = 0.0
+        self._ew_sum_squares = 0.0
+        self._ew_timestamp = None
+        self._users = collections.OrderedDict()
+        self.total_messages = 0
+
+    def _reset_window(self):
+        self._counts = [0] * self._ring_size
+        self._weights = [0.0] * self._ring_size
+        self._sums = [0.0] * self._ring_size
+        self._sums_squares = [0.0] * self._ring_size
+        self._window_count = 0
+        self._window_weight = 0.0
+        self._window_sum = 0.0
+        self._window_sum_squares = 0.0
+
+    def _advance(self, bucket):
+        if self._current_bucket is None:
+            self._current_bucket = bucket
+            return
+        gap = bucket - self._current_bucket
+        if gap <= 0:
+            return
+        if gap >= self._ring_size:
+            self._reset_window()
+        else:
+            for new_bucket in range(self._current_bucket + 1, bucket + 1):
+                leaving = (new_bucket - self._window_buckets) % self._ring_size
+                self._window_count -= self._counts[leaving]
+                self._window_weight -= self._weights[leaving]
+                self._window_sum -= self._sums[leaving]
+                self._window_sum_squares -= self._sums_squares[leaving]
+                slot = new_bucket % self._ring_size
+                self._counts[slot] = 0
+                self._weights[slot] = 0.0
+                self._sums[slot] = 0.0
+                self._sums_squares[slot] = 0.0
+            if not self._window_count:
+                # Clear the rounding error left by subtracting floats
+                self._window_weight = self._window_sum = self._window_sum_squares = 0.0
+        self._current_bucket = bucket
+
+    def _user_weight(self, user, timestamp):
+        base_weight = self.user_weights.get(user, 1.0)
+        if user is None or not self.user_half_life:
+            return base_weight
+        recent, last_seen = self._users.pop(user, (0.0, timestamp))
+        if timestamp > last_seen:
+            recent *= 2.0 ** (-(timestamp - last_seen) / self.user_half_life)
+        recent += 1.0
+        self._users[user] = (recent, max(timestamp, last_seen))
+        if len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        return base_weight / recent
+
+    def add_score(self, score, user=None, timestamp=None):
+        if timestamp is None:
+            timestamp = self.clock()
+        weight = self._user_weight(user, timestamp)
+        bucket = int(timestamp // self.bucket_width)
+        self._advance(bucket)
+        age = self._current_bucket - bucket
+        if age < self._window_buckets:
+            slot = bucket % self._ring_size
+            weighted = weight * score
+            self._counts[slot] += 1
+            self._weights[slot] += weight
+            self._sums[slot] += weighted
+            self._sums_squares[slot] += weighted * score
+            self._window_count += 1
+            self._window_weight += weight
+            self._window_sum += weighted
+            self._window_sum_squares += weighted * score
+
+        if self._ew_timestamp is not None and timestamp > self._ew_timestamp:
+            decay = 2.0 ** (-(timestamp - self._ew_timestamp) / self.half_life)
+            self._ew_weight *= decay
+            self._ew_weight_squared *= decay * decay
+            self._ew_sum *= decay
+            self._ew_sum_squares *= decay
+        if self._ew_timestamp is None or timestamp > self._ew_timestamp:
+            self._ew_timestamp = timestamp
+        self._ew_weight += weight
+        self._ew_weight_squared += weight * weight
+        self._ew_sum += weight * score
+        self._ew_sum_squares += weight * score * score
+        self.total_messages += 1
+        return weight
+
+    def get_message_count(self, timestamp=None):
+        if timestamp is None:
+            timestamp = self.clock()
+        self._advance(int(timestamp // self.bucket_width))
+        return self._window_count
+
+    def get_mean(self, timestamp=None):
+        if not self.get_message_count(timestamp) or self._window_weight <= 0:
+            return 0.0
+        return self._window_sum / self._window_weight
+
+    def get_variance(self, timestamp=None):
+        mean = self.get_mean(timestamp)
+        if self._window_weight <= 0:
+            return 0.0
+        return max(0.0, self._window_sum_squares / self._window_weight - mean * mean)
+
+    def get_ewma(self):
+        return self._ew_sum / self._ew_weight if self._ew_weight > 0 else 0.0
+
+    def get_ewm_variance(self):
+        if self._ew_weight <= 0:
+            return 0.0
+        ewma = self.get_ewma()
+        return max(0.0, self._ew_sum_squares / self._ew_weight - ewma * ewma)
+
+    def get_z_score(self, timestamp=None):
+        variance = self.get_variance(timestamp)
+        if variance <= 0 or self._ew_weight_squared <= 0:
+            return 0.0
+        # The EWMA averages about this many messages, so it varies less than a single score
+        effective_messages = self._ew_weight * self._ew_weight / self._ew_weight_squared
+        return (self.get_ewma() - self.get_mean(timestamp)) / math.sqrt(variance / effective_messages)
+
+    def is_spike(self, timestamp=None):
+        if self.get_message_count(timestamp) < self.min_messages:
+            return False
+        return self.get_ewma() > self.sentiment_threshold and self.get_z_score(timestamp) >= self.z_threshold
+
+    def get_stats(self, timestamp=None):
+        if timestamp is None:
+            timestamp = self.clock()
+        return {
+            'messages': self.get_message_count(timestamp),
+            'mean': self.get_mean(timestamp),
+            'variance': self.get_variance(timestamp),
+            'ewma': self.get_ewma(),
+            'ewm_variance': self.get_ewm_variance(),
+            'z_score': self.get_z_score(timestamp),
+            'spike': self.is_spike(timestamp),
+        }
+
+if __name__ == "__main__":
+    import random
+
+    rng = random.Random(0)
+    aggregator = SentimentAggregator(window_size=60)
+    # A minute of mixed chat, then ten seconds of excitement
+    for second in range(70):
+        excited = second >= 60
+        for index in range(20):
+            score = rng.uniform(0.3, 0.9) if excited else rng.uniform(-0.4, 0.4)
+            aggregator.add_score(score, user=f"viewer{rng.randrange(200)}", timestamp=second + index / 20)
+        stats = aggregator.get_stats(second + 1)
+        if second % 10 == 9 or excited:
+            print(f"{second + 1:>3}s mean={stats['mean']:+.3f} ewma={stats['ewma']:+.3f} z={stats['z_score']:+.1f} spike={stats['spike']}")
@@ -1,58 +1,202 @@
 """
-The `sentiment_analyzer.py` script is part of the StreamMatey OBS Plugin software. It provides functions for analyzing the sentiment of chat messages using the VADER Sentiment Analysis tool.
+The `sentiment_analyzer.py` script is part of the StreamMatey OBS Plugin software. It provides a `SentimentAnalyzer` class and functions for analyzing the sentiment of chat messages using the VADER Sentiment Analysis tool.
 
-The script begins by importing the necessary libraries and initializing the SentimentIntensityAnalyzer from the `vaderSentiment` module. It also connects to an SQLite database where comments and their sentiment scores are stored.
+Importing the script has no side effects and does no network or disk work, so the plugin restarts quickly. The SentimentIntensityAnalyzer from the `vaderSentiment` module (which ships its own lexicon), NumPy and the database are all loaded on first use. Scores are stored in the shared chat database (see `database.py`).
 
-The script provides the following functions:
+The `SentimentAnalyzer` class scores messages against a `Database`. It is initialized with the database to use (the shared `comments.db` database by default, opened on first use) and the size and time-to-live of its in-memory cache. Its `analyze_sentiment(chat_message)` method normalizes the message (see `text_normalizer.py`) so that messages differing only in whitespace share a score, then checks its `cache` (a size- and age-bounded `TTLCache` with hit and miss counters) and then the database. If neither has a score, it calculates the sentiment score using the SentimentIntensityAnalyzer, caches it, queues it to be written to the database in the background, and then returns the score. Its `analyze_sentiment_batch(chat_messages)` method scores a whole batch at once and returns a NumPy array of scores in input order: duplicates within the batch are looked up once, cache misses are fetched from the database in one batched query, and only messages that have never been scored are passed to VADER. With `processes` greater than 1, batches of at least `min_parallel_batch` such messages are split across a process pool so scoring uses every core. Its `warm_up()` method loads VADER, NumPy and the database ahead of time, for callers that would rather pay for them at startup than on the first chat message. Its `flush()` method waits for pending database writes, and `close()` also shuts down the process pool.
 
-- `analyze_sentiment(chat_message)`: This function takes a chat message as input and returns its sentiment score. It first checks if the comment exists in the database. If it does, it retrieves the sentiment score from the database. If it doesn't, it calculates the sentiment score using the SentimentIntensityAnalyzer, stores the comment and its score in the database, and then returns the score.
+The `sentiment.cache_hit_rate` and `sentiment.cache_size` gauges (see `metrics.py`) cover the caches of every analyzer that is still in use. They only hold weak references to the caches, so an analyzer that is no longer used is not kept alive by them.
 
-- `handle_api_error(e)`: This function handles any API errors that occur during sentiment analysis. It logs the error message for debugging purposes.
+The script also provides the following functions:
+
+- `analyze_sentiment(chat_message)`: This function returns a chat message's sentiment score using a default `SentimentAnalyzer`, which is created on first use.
+
+- `analyze_sentiment_batch(chat_messages)`: This function returns the sentiment scores of a list of chat messages as a NumPy array, using the default `SentimentAnalyzer`.
+
+- `warm_up()`: This function warms up the default `SentimentAnalyzer`.
+
+- `get_vader()`: This function returns the SentimentIntensityAnalyzer, loading its lexicon on first use.
 
-- `bypass_repetitive_comments(chat_messages)`: This function takes a list of chat messages and returns a list of unique messages and messages that appear more than 3 times. This is used to filter out repetitive comments and focus on the unique and frequently occurring comments for sentiment analysis.
+- `score_texts(texts)`: This function returns the VADER compound score of each text. It is the function that process pool workers run.
 
-In the main part of the script, the `nltk` library's `vader_lexicon` is downloaded for use by the SentimentIntensityAnalyzer. A table for storing comments and their sentiment scores is also created in the SQLite database if it doesn't already exist.
+- `flush_pending_scores()`: This function waits until every score queued by the default analyzer has been written to the database. It should be called on shutdown.
+
+- `handle_api_error(e)`: This function handles any API errors that occur during sentiment analysis. It logs the error message for debugging purposes.
+
+- `bypass_repetitive_comments(chat_messages, max_repeats=3)`: This function takes a list of chat messages and returns each distinct message once, in the order they first appear, leaving out the messages that appear more than `max_repeats` times. It counts exact copies over the whole list, so it suits a finished list of messages. Live chat should keep one `SpamFilter` (see `spam_filter.py`) and check each message as it arrives, as the pipeline does: it also counts near-duplicates such as "LUL LUL" and "lul" as the same message, forgets repeats after its time window and keeps memory bounded.
 """
 
 # Libraries
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-import nltk
-import sqlite3
+import weakref
 from collections import Counter
+from cache import TTLCache
+from database import DEFAULT_DATABASE_PATH, get_database
+import metrics
+from text_normalizer import normalize_message
+
+# Created on first use, since loading the VADER lexicon is the slowest part of starting up
+_vader = None
+
+def get_vader():
+    """
+    This function returns the SentimentIntensityAnalyzer, loading it on first use.
+    """
+    global _vader
+    if _vader is None:
+        from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+        _vader = SentimentIntensityAnalyzer()
+    return _vader
+
+def score_texts(texts):
+    """
+    This function returns the VADER compound score of each text. It is what process pool workers run for batch scoring.
+    """
+    vader = get_vader()
+    return [vader.polarity_scores(text)['compound'] for text in texts]
+
+# The caches of every live analyzer. The cache gauges read them all without keeping any analyzer alive
+_caches = weakref.WeakSet()
+
+def _cache_hit_rate():
+    caches = list(_caches)
+    hits = sum(cache.hits for cache in caches)
+    lookups = hits + sum(cache.misses for cache in caches)
+    return hits / lookups if lookups else 0.0
+
+metrics.gauge('sentiment.cache_hit_rate', _cache_hit_rate)
+metrics.gauge('sentiment.cache_size', lambda: sum(len(cache) for cache in list(_caches)))
+
+class SentimentAnalyzer:
+    def __init__(self, database=None, cache_size=50000, cache_ttl=600.0, processes=1, min_parallel_batch=256):
+        self._database = database
+        # Recently scored messages, keyed on their normalized text
+        self.cache = TTLCache(max_size=cache_size, ttl=cache_ttl)
+        self.processes = processes
+        self.min_parallel_batch = min_parallel_batch
+        self._pool = None
+        _caches.add(self.cache)
 
-# Download the vader_lexicon
-nltk.download('vader_lexicon')
+    @property
+    def database(self):
+        # The shared database is only opened when a score is first looked up
+        if self._database is None:
+            self._database = get_database(DEFAULT_DATABASE_PATH)
+        return self._database
 
-# Initialize the SentimentIntensityAnalyzer
-sid = SentimentIntensityAnalyzer()
+    def warm_up(self):
+        """
+        This method loads VADER, NumPy and the database ahead of the first chat message, so that message is not delayed by them.
+        It is optional; everything it loads is otherwise loaded on first use.
+        """
+        import numpy  # noqa: F401
+        score_texts(['warm up'])
+        self.database.get_sentiment_score('warm up')
 
-# Connect to SQLite database
-conn = sqlite3.connect('comments.db')
-c = conn.cursor()
+    @metrics.timed('sentiment.analyze')
+    def analyze_sentiment(self, chat_message):
+        """
+        This method takes in a chat message as input and returns the sentiment score.
+        It first checks the in-memory cache, then the database, using the normalized message as the key.
+        If neither has a score, it calculates the sentiment score, caches it and queues it to be stored in the database.
+        """
+        comment = normalize_message(chat_message)
+        sentiment_score = self.cache.get(comment)
+        if sentiment_score is not None:
+            return sentiment_score
+        sentiment_score = self.database.get_sentiment_score(comment)
+        if sentiment_score is None:
+            sentiment_score = get_vader().polarity_scores(comment)['compound']
+            self.database.store_sentiment_score(comment, sentiment_score)
+        self.cache.set(comment, sentiment_score)
+        return sentiment_score
+
+    @metrics.timed('sentiment.analyze_batch')
+    def analyze_sentiment_batch(self, chat_messages):
+        """
+        This method takes in a list of chat messages and returns their sentiment scores as a NumPy array, in the same order.
+        Each distinct normalized message is looked up once, first in the cache and then in the database with a single batched query.
+        Only the messages found in neither are scored, across the process pool when there are enough of them.
+        """
+        import numpy as np
+        comments = [normalize_message(chat_message) for chat_message in chat_messages]
+        scores = {}
+        missing = []
+        for comment in dict.fromkeys(comments):
+            sentiment_score = self.cache.get(comment)
+            if sentiment_score is None:
+                missing.append(comment)
+            else:
+                scores[comment] = sentiment_score
+        if missing:
+            stored = self.database.get_sentiment_scores(missing)
+            unscored = [comment for comment in missing if comment not in stored]
+            new_scores = {}
+            # Skipped when the database had every score, so a batch of known messages never loads VADER
+            if unscored:
+                new_scores = dict(zip(unscored, self._score(unscored)))
+                self.database.store_sentiment_scores(new_scores.items())
+            for comment in missing:
+                sentiment_score = stored[comment] if comment in stored else new_scores[comment]
+                self.cache.set(comment, sentiment_score)
+                scores[comment] = sentiment_score
+        return np.fromiter((scores[comment] for comment in comments), dtype=np.float64, count=len(comments))
+
+    def _score(self, texts):
+        if self.processes <= 1 or len(texts) < self.min_parallel_batch:
+            return score_texts(texts)
+        if self._pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(max_workers=self.processes)
+        # A few chunks per worker keeps them evenly loaded without paying IPC per message
+        chunk_size = -(-len(texts) // (self.processes * 4))
+        chunks = [texts[offset:offset + chunk_size] for offset in range(0, len(texts), chunk_size)]
+        return [score for chunk_scores in self._pool.map(score_texts, chunks) for score in chunk_scores]
+
+    def flush(self):
+        self.database.flush()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        self.flush()
 
-# Create table for storing comments
-c.execute('''
-    CREATE TABLE IF NOT EXISTS comments (
-        comment TEXT,
-        sentiment REAL
-    )
-''')
+_default_analyzer = None
+
+def get_default_analyzer():
+    """
+    This function returns the `SentimentAnalyzer` used by the module-level functions, creating it on first use.
+    """
+    global _default_analyzer
+    if _default_analyzer is None:
+        _default_analyzer = SentimentAnalyzer()
+    return _default_analyzer
+
+def warm_up():
+    """
+    This function warms up the default `SentimentAnalyzer` (see `SentimentAnalyzer.warm_up`).
+    """
+    get_default_analyzer().warm_up()
+
+def flush_pending_scores():
+    """
+    This function waits until every score queued so far has been written to the database.
+    It should be called before the application exits.
+    """
+    if _default_analyzer is not None:
+        _default_analyzer.flush()
 
 def analyze_sentiment(chat_message):
     """
-    This function takes in a chat message as input and returns the sentiment score.
-    It first checks if the comment exists in the database. If it does, it retrieves the sentiment score from the database.
-    If it doesn't, it calculates the sentiment score and stores the comment and its score in the database.
-    """
-    c.execute('SELECT sentiment FROM comments WHERE comment = ?', (chat_message,))
-    result = c.fetchone()
-    if result is not None:
-        return result[0]
-    else:
-        sentiment_score = sid.polarity_scores(chat_message)['compound']
-        c.execute('INSERT INTO comments VALUES (?, ?)', (chat_message, sentiment_score))
-        conn.commit()
-        return sentiment_score
+    This function takes in a chat message as input and returns the sentiment score, using the default `SentimentAnalyzer`.
+    """
+    return get_default_analyzer().analyze_sentiment(chat_message)
+
+def analyze_sentiment_batch(chat_messages):
+    """
+    This function takes in a list of chat messages and returns their sentiment scores as a NumPy array, using the default `SentimentAnalyzer`.
+    """
+    return get_default_analyzer().analyze_sentiment_batch(chat_messages)
 
 def handle_api_error(e):
     """
@@ -61,9 +205,9 @@ def handle_api_error(e):
     """
     print(f"API Error: {e}")
 
-def bypass_repetitive_comments(chat_messages):
+def bypass_repetitive_comments(chat_messages, max_repeats=3):
     """
-    This function takes in a list of chat messages and returns a list of unique messages and messages that appear more than 3 times.
+    This function takes in a list of chat messages and returns each distinct message once, leaving out the messages that appear more than `max_repeats` times.
     """
     counter = Counter(chat_messages)
-    return [message for message, count in counter.items() if count <= 3]
+    return [message for message, count in counter.items() if count <= max_repeats]
@@ -0,0 +1,118 @@
+"""
+The `spam_filter.py` script is part of the StreamMatey OBS Plugin software. It provides a streaming filter that spots repeated messages (one viewer pasting the same line, copypasta) so they neither skew the chat's sentiment nor cost a scoring call.
+
+Messages are compared by their canonical form (see `canonical_message` in `text_normalizer.py`), so "LUL LUL LUL", "lul" and "LUL!!!" count as the same message. Repeats are counted per viewer: a message is spam once the same viewer has sent it more than `max_repeats` times in the window. A short message sent by many viewers at once, such as an emote flood after a great play, is not spam: it is exactly the chat reaction the plugin looks for. Only messages whose canonical form is at least `copypasta_length` characters long are also counted across viewers, and are spam once more than `max_repeats` viewers' copies have been seen, which catches copypasta. Without a user, messages are only counted across viewers, whatever their length.
+
+Each key, the canonical form with or without the viewer, is hashed, and the hash is counted in a count-min sketch that only covers the last `window` seconds. The sketch is split into `slices` time slices held in a ring, and the oldest slice is cleared as time moves on, so counts fade out without anything being stored per message. A message is spam once it has been seen more than `max_repeats` times in the window.
+
+A count-min sketch can overcount when two messages share a counter in every row, but never undercounts. With the default 4 rows of 4096 counters, a window has to hold tens of thousands of distinct messages before false positives become likely. Memory is fixed at `slices * depth * width` counters, and each message costs `depth * slices` counter reads, whatever the chat rate.
+
+The script provides the following classes:
+
+- `SlidingCountMinSketch(window=30, slices=3, width=4096, depth=4)`: Approximate counts of 64-bit keys over a sliding time window. `add(key, timestamp)` counts a key and returns its estimated count, and `estimate(key, timestamp)` returns the count without adding to it.
+- `SpamFilter(window=30, max_repeats=3, copypasta_length=40, ...)`: `is_spam(message, timestamp=None, user=None)` counts a message and returns whether it is spam, and `filter(messages)` returns the messages that are not, counting them across viewers. `passed` and `filtered` count the messages seen so far.
+"""
+
+import hashlib
+import time
+from array import array
+import metrics
+from text_normalizer import canonical_message
+
+messages_filtered = metrics.counter('spam.filtered')
+
+
+def _hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def canonical_hash(message):
+    """
+    This function returns the 64-bit hash of a message's canonical form, the key used to count its near-duplicates across viewers.
+    """
+    return _hash(canonical_message(message))
+
+
+class SlidingCountMinSketch:
+    def __init__(self, window=30.0, slices=3, width=4096, depth=4):
+        if depth * 16 > 64 or width > 1 << 16:
+            raise ValueError("The sketch takes a 16-bit index per row from a 64-bit key, so depth must be at most 4 and width at most 65536")
+        self.window = window
+        self.slices = slices
+        self.width = width
+        self.depth = depth
+        self.slice_width = window / slices
+        self._zeros = array('I', bytes(4 * width))
+        self._tables = [[array('I', self._zeros) for _ in range(depth)] for _ in range(slices)]
+        self._current_slice = None
+
+    def _advance(self, timestamp):
+        current = int(timestamp // self.slice_width)
+        if self._current_slice is None:
+            self._current_slice = current
+        elif current > self._current_slice:
+            for new_slice in range(self._current_slice + 1, min(current, self._current_slice + self.slices) + 1):
+                for row in self._tables[new_slice % self.slices]:
+                    row[:] = self._zeros
+            self._current_slice = current
+        return self._tables[self._current_slice % self.slices]
+
+    def _indexes(self, key):
+        return [(key >> (16 * row)) % self.width for row in range(self.depth)]
+
+    def _count(self, indexes):
+        return min(sum(table[row][index] for table in self._tables) for row, index in enumerate(indexes))
+
+    def add(self, key, timestamp):
+        table = self._advance(timestamp)
+        indexes = self._indexes(key)
+        for row, index in enumerate(indexes):
+            table[row][index] += 1
+        return self._count(indexes)
+
+    def estimate(self, key, timestamp):
+        self._advance(timestamp)
+        return self._count(self._indexes(key))
+
+
+class SpamFilter:
+    def __init__(self, window=30.0, max_repeats=3, copypasta_length=40, slices=3, width=4096, depth=4, clock=time.time):
+        self.max_repeats = max_repeats
+        self.copypasta_length = copypasta_length
+        self.clock = clock
+        self.sketch = SlidingCountMinSketch(window, slices, width, depth)
+        self.passed = 0
+        self.filtered = 0
+
+    def is_spam(self, message, timestamp=None, user=None):
+        if timestamp is None:
+            timestamp = self.clock()
+        canonical = canonical_message(message)
+        if user is None:
+            count = self.sketch.add(_hash(canonical), timestamp)
+        else:
+            # The NUL separator keeps per-viewer keys apart from the shared ones
+            count = self.sketch.add(_hash(f'{user}\0{canonical}'), timestamp)
+            if len(canonical) >= self.copypasta_length:
+                count = max(count, self.sketch.add(_hash(canonical), timestamp))
+        if count > self.max_repeats:
+            self.filtered += 1
+            messages_filtered.inc()
+            return True
+        self.passed += 1
+        return False
+
+    def filter(self, messages, timestamp=None):
+        if timestamp is None:
+            timestamp = self.clock()
+        return [message for message in messages if not self.is_spam(message, timestamp)]
+
+
+if __name__ == "__main__":
+    spam_filter = SpamFilter(window=30, max_repeats=3)
+    chat = [("ana", "LUL"), ("ana", "lul"), ("ana", "LUL LUL LUL"), ("ana", "LUL!!!"), ("ana", "LUL"),
+            ("ben", "LUL"), ("cai", "LUL"), ("dee", "LUL"), ("eli", "LUL"), ("ben", "gg"), ("cai", "GG")]
+    for second, (user, message) in enumerate(chat):
+        print(f"{user:>4} {message!r:>16}: {'spam' if spam_filter.is_spam(message, timestamp=second, user=user) else 'ok'}")
+    # Half a minute later the repeats have aged out of the window
+    print(f"{'ana':>4} {'LUL':>16} after 40s: {'spam' if spam_filter.is_spam('LUL', timestamp=40, user='ana') else 'ok'}")
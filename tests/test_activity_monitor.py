@@ -0,0 +1,86 @@
+import random
+
+import pytest
+
+from activity_monitor import ActivityMonitor
+
+
+def naive_count(timestamps, window, timestamp, bucket_width=1.0):
+    """
+    Counts the messages in the `window` seconds of whole buckets up to and including the bucket of `timestamp`.
+    """
+    current = int(timestamp // bucket_width)
+    size = int(window // bucket_width)
+    return sum(current - size < int(ts // bucket_width) <= current for ts in timestamps)
+
+
+def test_counts_match_a_naive_count_across_gaps_of_every_length():
+    rng = random.Random(0)
+    monitor = ActivityMonitor(60, windows=(5, 30))
+    timestamps = []
+    timestamp = 1000.0
+    for _ in range(3000):
+        # Mostly busy chat, with some gaps shorter than, as long as and longer than the ring
+        timestamp += rng.choice([0.05, 0.3, 2.0, 29.5, 60.0, 61.0, 65.0, 200.0]) if rng.random() < 0.05 else rng.uniform(0, 0.5)
+        monitor.add_message(None, timestamp)
+        timestamps.append(timestamp)
+        for window in (5, 30, 60):
+            assert monitor.get_message_count(window, timestamp) == naive_count(timestamps, window, timestamp)
+
+
+def test_a_gap_longer_than_the_ring_clears_every_bucket():
+    monitor = ActivityMonitor(60, windows=(5,))
+    for index in range(600):
+        monitor.add_message(None, 100.0 + index / 10)
+    assert monitor.get_message_count(60, timestamp=159.9) == 600
+    # The ring holds 61 buckets; a 10 minute silence wraps it many times over
+    assert monitor.get_message_count(60, timestamp=760.0) == 0
+    assert monitor.get_message_count(5, timestamp=760.0) == 0
+    monitor.add_message(None, 760.5)
+    assert monitor.get_message_count(5, timestamp=761.0) == 1
+    assert monitor.get_message_count(60, timestamp=761.0) == 1
+    # The old counts did not come back as the new message ages out
+    assert monitor.get_message_count(5, timestamp=766.0) == 0
+    assert monitor.get_message_count(60, timestamp=821.0) == 0
+
+
+def test_messages_older_than_the_widest_window_are_ignored():
+    monitor = ActivityMonitor(60, windows=(5,))
+    monitor.add_message(None, 1000.0)
+    monitor.add_message(None, 900.0)
+    assert monitor.get_message_count(60, timestamp=1000.0) == 1
+    assert monitor.total_messages == 1
+
+
+def test_the_rate_right_after_startup_is_over_the_time_covered():
+    monitor = ActivityMonitor(60)
+    for index in range(20):
+        monitor.add_message(None, 100.0 + index / 10)
+    # Two seconds of chat at 10 messages a second, not 20 messages over a whole minute
+    assert monitor.get_activity_level(timestamp=102.0) == pytest.approx(10.0)
+    assert monitor.get_activity_level(window=5, timestamp=102.0) == pytest.approx(10.0)
+    # Once the window is covered, the rate is over the whole window
+    assert monitor.get_activity_level(timestamp=200.0) == 0
+    for index in range(600):
+        monitor.add_message(None, 200.0 + index / 10)
+    assert monitor.get_activity_level(timestamp=260.0) == pytest.approx(10.0)
+    # At 290.5 the window is the 59 whole buckets from 231 s and half of the current one
+    assert monitor.get_activity_level(timestamp=290.5) == pytest.approx(290 / 59.5)
+
+
+def test_no_rate_before_any_time_has_passed():
+    monitor = ActivityMonitor(60)
+    assert monitor.get_activity_level(timestamp=100.0) == 0
+    monitor.add_message(None, 100.0)
+    assert monitor.get_activity_level(timestamp=100.0) == 0
+    assert monitor.get_activity_level(timestamp=100.5) == pytest.approx(2.0)
+
+
+def test_the_clock_is_used_without_a_timestamp():
+    now = [500.0]
+    monitor = ActivityMonitor(30, clock=lambda: now[0])
+    for _ in range(30):
+        monitor.add_message("hello")
+        now[0] += 0.5
+    assert monitor.get_message_count() == 30
+    assert monitor.get_activity_levels()[30] == pytest.approx(2.0)
@@ -0,0 +1,58 @@
+import sqlite3
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import analytics
+from database import Database
+
+DAY = 86400.0
+FIRST_STREAM = 1700000000.0
+SECOND_STREAM = FIRST_STREAM + DAY
+
+
+def add_stream(rows, start, duration, rate, burst_at, burst_rate, channel="channel1"):
+    """
+    Adds `duration` seconds of chat at `rate` messages per second, with a happier 10 second burst at `burst_rate` starting `burst_at` seconds in.
+    """
+    for second in range(int(duration)):
+        in_burst = burst_at <= second < burst_at + 10
+        for index in range(burst_rate if in_burst else rate):
+            rows.append((channel, start + second + index / 100, "message", 0, 0.8 if in_burst else 0.0))
+
+
+@pytest.fixture
+def database_path(tmp_path):
+    path = str(tmp_path / "chat.db")
+    Database(path).close()
+    rows = []
+    # A quiet stream, then a busy one a day later whose usual chat is busier than the first one's burst
+    add_stream(rows, FIRST_STREAM, 3600, 1, 1200, 5)
+    add_stream(rows, SECOND_STREAM, 3600, 20, 2400, 40)
+    connection = sqlite3.connect(path)
+    connection.executemany("INSERT INTO chat_messages (channel, timestamp, content, message_hash, sentiment) VALUES (?, ?, ?, ?, ?)", rows)
+    connection.commit()
+    connection.close()
+    return path
+
+
+def test_get_streams_splits_at_long_silences(database_path):
+    assert analytics.get_streams(database_path) == [(FIRST_STREAM, FIRST_STREAM + 3599.0), (SECOND_STREAM, SECOND_STREAM + 3599.19)]
+    assert analytics.get_streams(database_path, stream_gap=2 * DAY) == [(FIRST_STREAM, SECOND_STREAM + 3599.19)]
+    assert analytics.get_streams(database_path, channel="channel2") == []
+
+
+def test_each_stream_is_scored_against_itself(database_path):
+    result = analytics.analyze_chat(database_path, top_n=2, window=10.0, min_gap=600.0)
+    assert [(stream["start"], stream["rows"]) for stream in result["streams"]] == [(FIRST_STREAM, 3640), (SECOND_STREAM, 72200)]
+    assert result["rows"] == 3640 + 72200
+    # The quiet stream's burst ranks even though the busy stream's usual chat is busier
+    bursts = sorted((moment["stream"], moment["timestamp"]) for moment in result["moments"])
+    assert bursts == [(0, FIRST_STREAM + 1210.0), (1, SECOND_STREAM + 2410.0)]
+
+
+def test_series_only_cover_the_streams(database_path):
+    streams = analytics.get_streams(database_path)
+    series = [analytics.ChatSeries(first, last) for first, last in streams]
+    assert sum(stream.size for stream in series) == 2 * 3600
@@ -0,0 +1,68 @@
+from cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_the_ttl():
+    clock = FakeClock()
+    cache = TTLCache(max_size=10, ttl=5.0, clock=clock)
+    cache.set("a", 1)
+    clock.now = 4.9
+    assert cache.get("a") == 1
+    clock.now = 5.0
+    assert cache.get("a") is None
+    assert cache.get("a", "missing") == "missing"
+    # The expired entry was removed when it was looked up
+    assert len(cache) == 0
+
+
+def test_setting_an_entry_again_restarts_its_ttl():
+    clock = FakeClock()
+    cache = TTLCache(max_size=10, ttl=5.0, clock=clock)
+    cache.set("a", 1)
+    clock.now = 4.0
+    cache.set("a", 2)
+    clock.now = 8.0
+    assert cache.get("a") == 2
+
+
+def test_the_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_size=3, ttl=60.0)
+    for key in "abc":
+        cache.set(key, key.upper())
+    # Looking "a" up makes "b" the least recently used
+    assert cache.get("a") == "A"
+    cache.set("d", "D")
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in "acd"] == ["A", "C", "D"]
+    assert len(cache) == 3
+    assert cache.evictions == 1
+
+
+def test_hit_rate_counts_every_lookup():
+    clock = FakeClock()
+    cache = TTLCache(max_size=10, ttl=5.0, clock=clock)
+    assert cache.hit_rate == 0.0
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("a")
+    cache.get("b")
+    clock.now = 10.0
+    # An expired entry counts as a miss
+    cache.get("a")
+    assert cache.stats() == {"size": 0, "hits": 2, "misses": 2, "evictions": 0, "hit_rate": 0.5}
+    cache.clear()
+    assert cache.hits == 2
+
+
+def test_a_cache_without_room_stores_nothing():
+    cache = TTLCache(max_size=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
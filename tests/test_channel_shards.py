@@ -0,0 +1,69 @@
+import multiprocessing
+import sqlite3
+
+import pytest
+
+pytest.importorskip("twitchio")
+
+from channel_shards import DEFAULT_SETTINGS, ShardManager, ShardProcessor, assign_channels
+
+MESSAGES_PER_SHARD = 2000
+
+
+def _shard(channels, settings, write_queue):
+    processor = ShardProcessor(channels, settings, write_queue=write_queue)
+    for offset in range(0, MESSAGES_PER_SHARD, 100):
+        batch = [(channels[index % len(channels)], f"{channels[0]} message {index} PogChamp", 1000.0 + index * 0.01, f"viewer{index}")
+                 for index in range(offset, offset + 100)]
+        processor.process_batch(batch)
+        processor.analyzer.database.flush()
+
+
+def test_assign_channels_is_stable_and_complete():
+    channels = [f"channel{index}" for index in range(50)]
+    assignments = assign_channels(channels, 4)
+    assert sorted(channel for shard in assignments.values() for channel in shard) == sorted(channels)
+    assert assign_channels(channels, 4) == assignments
+
+
+def test_rows_from_every_shard_reach_the_database(tmp_path):
+    database_path = str(tmp_path / "comments.db")
+    manager = ShardManager([], {}, settings={"database_path": database_path}, shard_count=1)
+    manager.start()
+    settings = {**DEFAULT_SETTINGS, "database_path": database_path}
+    context = multiprocessing.get_context("spawn")
+    shards = [context.Process(target=_shard, args=([f"channel{shard}a", f"channel{shard}b"], settings, manager.write_queue))
+              for shard in range(4)]
+    for process in shards:
+        process.start()
+    for process in shards:
+        process.join(120)
+        assert process.exitcode == 0
+    manager.stop()
+
+    connection = sqlite3.connect(database_path)
+    try:
+        assert connection.execute("SELECT COUNT(*) FROM chat_messages").fetchone()[0] == 4 * MESSAGES_PER_SHARD
+        assert connection.execute("SELECT COUNT(*) FROM sentiments").fetchone()[0] == 4 * MESSAGES_PER_SHARD
+    finally:
+        connection.close()
+    assert manager._database.writer.stats()["failed_batches"] == 0
+
+
+def test_each_message_counts_at_its_own_timestamp(tmp_path):
+    from database import Database
+    from sentiment_analyzer import SentimentAnalyzer
+
+    database = Database(str(tmp_path / "comments.db"))
+    processor = ShardProcessor(["channel1"], {**DEFAULT_SETTINGS, "activity_window": 30, "database_path": database.database_path},
+                               analyzer=SentimentAnalyzer(database))
+    try:
+        # A minute of happy chat at 2 messages a second, delivered as one batch
+        batch = [("channel1", f"what a play {index}", 1000.0 + index / 2, f"viewer{index}") for index in range(120)]
+        assert processor.process_batch(batch) == []
+        state = processor.channels["channel1"]
+        assert state.activity_monitor.get_activity_level(timestamp=1059.5) == pytest.approx(2.0, rel=0.05)
+        # Only the last half of the minute is still in the 30 second window
+        assert state.sentiment.get_message_count(1059.5) == pytest.approx(60, abs=2)
+    finally:
+        database.close()
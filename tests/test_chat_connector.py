@@ -0,0 +1,137 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("twitchio")
+
+from chat_connector import ChatConnector, ConnectionState
+from fake_servers import FakeIRCServer
+
+
+async def wait_until(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for the chat connector")
+        await asyncio.sleep(0.02)
+
+
+@pytest.fixture
+def server():
+    server = FakeIRCServer()
+    yield server
+    server.close()
+
+
+def connector_for(server, **options):
+    return ChatConnector("oauth:token", "client-id", "streammatey", "!", ["streamer"], irc_host=server.url, **options)
+
+
+def test_messages_arrive_on_the_queue(server):
+    async def scenario():
+        connector = connector_for(server)
+        task = asyncio.create_task(connector.connect_to_chat())
+        await wait_until(lambda: connector.state is ConnectionState.CONNECTED and server.wait_for_join("streamer", 0))
+        server.send_chat("streamer", "viewer1", "PogChamp")
+        messages = await connector.get_messages(10, timeout=5)
+        await connector.stop()
+        await asyncio.wait_for(task, 5)
+        return messages, connector
+
+    messages, connector = asyncio.run(scenario())
+    assert [(message.author.name, message.content) for message in messages] == [("viewer1", "PogChamp")]
+    assert connector.state is ConnectionState.CLOSED
+
+
+def test_reconnects_done_by_twitchio_are_tracked(server):
+    async def scenario():
+        connector = connector_for(server)
+        task = asyncio.create_task(connector.connect_to_chat())
+        await wait_until(lambda: connector.state is ConnectionState.CONNECTED)
+        server.drop_connections()
+        await wait_until(lambda: connector.state is ConnectionState.RECONNECTING)
+        await wait_until(lambda: connector.state is ConnectionState.CONNECTED)
+        await wait_until(lambda: server.wait_for_join("streamer", 0))
+        server.send_chat("streamer", "viewer2", "back again")
+        messages = await connector.get_messages(10, timeout=5)
+        health = connector.health()
+        await connector.stop()
+        await asyncio.wait_for(task, 5)
+        return messages, health
+
+    messages, health = asyncio.run(scenario())
+    assert [message.content for message in messages] == ["back again"]
+    assert health["reconnects"] == 1
+    assert health["last_time_to_reconnect"] > 0
+    assert server.connection_count == 2
+
+
+def test_supervisor_retries_when_the_first_connection_fails(server):
+    server.accepting = False
+
+    async def scenario():
+        connector = connector_for(server, initial_backoff=0.05, max_backoff=0.2)
+        task = asyncio.create_task(connector.connect_to_chat())
+        await wait_until(lambda: connector._reconnect_attempt >= 2)
+        server.accepting = True
+        await wait_until(lambda: connector.state is ConnectionState.CONNECTED)
+        health = connector.health()
+        await connector.stop()
+        await asyncio.wait_for(task, 5)
+        return health
+
+    health = asyncio.run(scenario())
+    assert health["state"] == "connected"
+    assert health["reconnect_attempt"] == 0
+
+
+async def receive_burst(server, count, **options):
+    """
+    Sends `count` numbered messages before reading any, then returns the contents read back from the queue and the connector.
+    """
+    connector = connector_for(server, **options)
+    task = asyncio.create_task(connector.connect_to_chat())
+    await wait_until(lambda: connector.state is ConnectionState.CONNECTED and server.wait_for_join("streamer", 0))
+    for index in range(count):
+        server.send_chat("streamer", f"viewer{index % 3}", str(index))
+    await wait_until(lambda: connector.received_messages == count)
+    contents = []
+    while batch := await connector.get_messages(count, timeout=0.5):
+        contents += [message.content for message in batch]
+    await connector.stop()
+    await asyncio.wait_for(task, 5)
+    return contents, connector
+
+
+def test_messages_keep_their_order(server):
+    contents, connector = asyncio.run(receive_burst(server, 200))
+    assert contents == [str(index) for index in range(200)]
+    assert connector.dropped_messages == 0
+
+
+def test_drop_oldest_keeps_the_newest_messages(server):
+    contents, connector = asyncio.run(receive_burst(server, 20, max_queue_size=5, overflow_policy="drop_oldest"))
+    assert contents == [str(index) for index in range(15, 20)]
+    assert connector.dropped_messages == 15
+
+
+def test_sample_keeps_one_in_every_sample_every_messages(server):
+    contents, connector = asyncio.run(receive_burst(server, 20, max_queue_size=5, overflow_policy="sample", sample_every=4))
+    # Messages 8, 12 and 16 are sampled, each replacing the oldest one queued
+    assert contents == ["3", "4", "8", "12", "16"]
+    assert connector.dropped_messages == 15
+
+
+def test_block_waits_for_room_without_dropping(server):
+    contents, connector = asyncio.run(receive_burst(server, 20, max_queue_size=5, overflow_policy="block"))
+    assert contents == [str(index) for index in range(20)]
+    assert connector.dropped_messages == 0
+
+
+def test_invalid_overflow_policy_is_rejected(server):
+    async def scenario():
+        connector_for(server, overflow_policy="drop_newest")
+
+    with pytest.raises(ValueError):
+        asyncio.run(scenario())
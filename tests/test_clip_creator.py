@@ -0,0 +1,123 @@
+import asyncio
+import gc
+
+import pytest
+
+from clip_creator import ClipCreator
+from database import Database
+from fake_servers import FakeOBSWebSocketServer
+from obs_client import OBSClient
+
+
+@pytest.fixture
+def server():
+    server = FakeOBSWebSocketServer(latency=0.001)
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def obs_client(server):
+    client = OBSClient("127.0.0.1", server.port, request_timeout=2.0).start()
+    assert client.connected.wait(5)
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / "comments.db"))
+    yield database
+    database.close()
+
+
+def clip_creator_for(obs_client, database, **options):
+    # 100 seconds of stream time per second, so a 60 second clip takes 0.6 seconds
+    return ClipCreator("127.0.0.1", 0, None, 0, database=database, obs_client=obs_client, time_scale=100, **options)
+
+
+@pytest.mark.parametrize("mode, failing", [("recording", "StartRecording"), ("replay_buffer", "SaveReplayBuffer")])
+def test_a_failed_clip_is_counted_and_its_task_never_raises(server, obs_client, database, mode, failing):
+    server.failing.add(failing)
+    unhandled = []
+
+    async def scenario():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unhandled.append(context))
+        clip_creator = clip_creator_for(obs_client, database, mode=mode)
+        await clip_creator.create_clip(0.9, "streamer", timestamp=1000.0)
+        await clip_creator.wait_for_clip()
+        failed, created = clip_creator.clips_failed, clip_creator.clips_created
+        # A task whose exception nobody retrieved is reported when it is collected
+        del clip_creator
+        gc.collect()
+        await asyncio.sleep(0)
+        return failed, created
+
+    assert asyncio.run(scenario()) == (1, 0)
+    assert unhandled == []
+    database.flush()
+    assert database.get_clips(0, 10000) == []
+
+
+def test_triggers_during_a_recording_extend_it(server, obs_client, database):
+    async def scenario():
+        clip_creator = clip_creator_for(obs_client, database, clip_length=60, max_clip_length=300)
+        first = await clip_creator.create_clip(0.5, "streamer", timestamp=1000.0)
+        merged = await clip_creator.create_clip(0.9, "streamer", timestamp=1030.0)
+        assert merged is first
+        await clip_creator.wait_for_clip()
+        return clip_creator
+
+    clip_creator = asyncio.run(scenario())
+    assert (clip_creator.clips_created, clip_creator.triggers_merged) == (1, 1)
+    assert server.request_types() == ["StartRecording", "StopRecording"]
+    database.flush()
+    assert database.get_clips(0, 10000) == [("streamer", 1000.0, 1090.0, 1000.0, 0.9, "recording")]
+
+
+def test_merged_triggers_stop_at_the_maximum_clip_length(server, obs_client, database):
+    async def scenario():
+        clip_creator = clip_creator_for(obs_client, database, clip_length=60, max_clip_length=100)
+        for timestamp in (1000.0, 1050.0, 1080.0):
+            await clip_creator.create_clip(0.5, "streamer", timestamp=timestamp)
+        await clip_creator.wait_for_clip()
+        return clip_creator
+
+    clip_creator = asyncio.run(scenario())
+    assert (clip_creator.clips_created, clip_creator.triggers_merged) == (1, 2)
+    database.flush()
+    assert [clip[1:3] for clip in database.get_clips(0, 10000)] == [(1000.0, 1100.0)]
+
+
+def test_triggers_before_a_replay_buffer_save_are_merged_into_it(server, obs_client, database):
+    async def scenario():
+        clip_creator = clip_creator_for(obs_client, database, mode="replay_buffer", clip_length=60, post_roll=10)
+        await clip_creator.create_clip(0.5, "streamer", timestamp=1000.0)
+        await clip_creator.create_clip(0.7, "streamer", timestamp=1005.0)
+        await clip_creator.wait_for_clip()
+        return clip_creator
+
+    clip_creator = asyncio.run(scenario())
+    assert (clip_creator.clips_created, clip_creator.triggers_merged) == (1, 1)
+    assert server.request_types() == ["SaveReplayBuffer"]
+    database.flush()
+    # The save is not moved by later triggers: it holds the 60 seconds up to 10 seconds after the first one
+    assert database.get_clips(0, 10000) == [("streamer", 950.0, 1010.0, 1000.0, 0.7, "replay_buffer")]
+
+
+@pytest.mark.parametrize("mode, clip_end", [("recording", 1060.0), ("replay_buffer", 1010.0)])
+def test_triggers_soon_after_a_clip_are_rate_limited(server, obs_client, database, mode, clip_end):
+    async def scenario():
+        clip_creator = clip_creator_for(obs_client, database, mode=mode, clip_length=60, post_roll=10, min_clip_interval=30)
+        await clip_creator.create_clip(0.5, "streamer", timestamp=1000.0)
+        await clip_creator.wait_for_clip()
+        dropped = await clip_creator.create_clip(0.9, "streamer", timestamp=clip_end + 29.0)
+        second = await clip_creator.create_clip(0.9, "streamer", timestamp=clip_end + 30.0)
+        await clip_creator.wait_for_clip()
+        return clip_creator, dropped, second
+
+    clip_creator, dropped, second = asyncio.run(scenario())
+    assert dropped is None and second is not None
+    assert (clip_creator.clips_created, clip_creator.triggers_rate_limited) == (2, 1)
+    expected = ["StartRecording", "StopRecording"] if mode == "recording" else ["SaveReplayBuffer"]
+    assert server.request_types() == expected * 2
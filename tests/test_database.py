@@ -0,0 +1,149 @@
+import sqlite3
+
+import pytest
+
+import database
+from database import MIGRATIONS, Database, message_hash, migrate
+
+
+@pytest.fixture
+def database_path(tmp_path):
+    return str(tmp_path / "comments.db")
+
+
+def schema(database_path):
+    connection = sqlite3.connect(database_path)
+    try:
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        names = {name for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'index')")}
+        return version, names
+    finally:
+        connection.close()
+
+
+def test_a_new_database_gets_every_migration(database_path):
+    Database(database_path).close()
+    version, names = schema(database_path)
+    assert version == len(MIGRATIONS)
+    assert {"sentiments", "chat_messages", "clips", "idx_chat_messages_channel_timestamp", "idx_chat_messages_timestamp",
+            "idx_clips_start_time"} <= names
+
+
+def test_legacy_comment_scores_are_imported(database_path):
+    connection = sqlite3.connect(database_path)
+    connection.execute("CREATE TABLE comments (comment TEXT, sentiment REAL)")
+    connection.executemany("INSERT INTO comments VALUES (?, ?)", [("What a play!", 0.8), ("  what a PLAY!  ", 0.8), ("boo", -0.5), ("unscored", None)])
+    connection.commit()
+    connection.close()
+
+    db = Database(database_path)
+    try:
+        assert db.get_sentiment_score("What a play!") == 0.8
+        assert db.get_sentiment_score("boo") == -0.5
+        assert db.get_sentiment_score("unscored") is None
+    finally:
+        db.close()
+    version, names = schema(database_path)
+    assert version == len(MIGRATIONS)
+    assert "comments_legacy" in names and "comments" not in names
+
+
+def test_an_older_version_is_upgraded_without_losing_rows(database_path):
+    connection = sqlite3.connect(database_path)
+    # A database written before the clips table existed
+    for migration in MIGRATIONS[:2]:
+        migration(connection)
+    connection.execute("PRAGMA user_version = 2")
+    connection.execute("INSERT INTO chat_messages (channel, timestamp, content, message_hash, sentiment) VALUES ('channel1', 1.0, 'hello', ?, 0.1)",
+                       (message_hash("hello"),))
+    connection.commit()
+    connection.close()
+
+    db = Database(database_path)
+    try:
+        db.store_clip(1.0, 31.0, 21.0, 0.9, channel="channel1")
+        db.flush()
+        assert db.get_messages("channel1", 0.0, 2.0) == [(1.0, "hello", 0.1)]
+        assert db.get_clips(0.0, 2.0) == [("channel1", 1.0, 31.0, 21.0, 0.9, "recording")]
+    finally:
+        db.close()
+    assert schema(database_path)[0] == len(MIGRATIONS)
+
+
+def test_reopening_applies_nothing(database_path):
+    Database(database_path).close()
+    connection = sqlite3.connect(database_path)
+    try:
+        assert migrate(connection) == len(MIGRATIONS)
+    finally:
+        connection.close()
+    Database(database_path).close()
+    assert schema(database_path)[0] == len(MIGRATIONS)
+
+
+def test_a_failing_migration_is_rolled_back(database_path, monkeypatch):
+    Database(database_path).close()
+
+    def broken_migration(connection):
+        connection.execute("CREATE TABLE half_done (id INTEGER)")
+        raise RuntimeError("migration failed")
+
+    monkeypatch.setattr(database, "MIGRATIONS", MIGRATIONS + [broken_migration])
+    connection = sqlite3.connect(database_path)
+    try:
+        with pytest.raises(RuntimeError):
+            migrate(connection)
+    finally:
+        connection.close()
+    version, names = schema(database_path)
+    assert version == len(MIGRATIONS)
+    assert "half_done" not in names
+
+
+def query_plan(database_path, query, params=()):
+    connection = sqlite3.connect(database_path)
+    try:
+        return " ".join(row[-1] for row in connection.execute(f"EXPLAIN QUERY PLAN {query}", params))
+    finally:
+        connection.close()
+
+
+def test_lookups_use_the_indexes(database_path):
+    Database(database_path).close()
+    assert "USING INTEGER PRIMARY KEY" in query_plan(database_path, "SELECT message, sentiment FROM sentiments WHERE message_hash = ?", (1,))
+    assert "idx_chat_messages_channel_timestamp" in query_plan(
+        database_path, "SELECT timestamp, content, sentiment FROM chat_messages WHERE channel = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp",
+        ("channel1", 0.0, 1.0))
+    assert "idx_chat_messages_timestamp" in query_plan(database_path, "SELECT content FROM chat_messages WHERE timestamp >= ? AND timestamp < ?", (0.0, 1.0))
+    assert "idx_clips_start_time" in query_plan(database_path, "SELECT channel FROM clips WHERE start_time >= ? AND start_time < ?", (0.0, 1.0))
+
+
+def test_get_comment_sentiment_finds_the_score_of_the_normalized_comment(database_path):
+    db = Database(database_path)
+    try:
+        db.store_sentiment_score("What a play!", 0.8)
+        db.store_comment("What a play!", channel="channel1", timestamp=1.0, sentiment=0.8)
+        db.flush()
+        assert db.get_comment_sentiment("What a play!") == 0.8
+        assert db.get_comment_sentiment("  What a   play! ") == 0.8
+        assert db.get_comment_sentiment("what a play!") is None
+        assert db.get_sentiment_scores(["What a play!", "boo", " What a play!"]) == {"What a play!": 0.8, " What a play!": 0.8}
+    finally:
+        db.close()
+
+
+def test_a_hash_collision_never_returns_another_messages_score(database_path, monkeypatch):
+    monkeypatch.setattr(database, "message_hash", lambda message: 42)
+    db = Database(database_path)
+    try:
+        db.store_sentiment_score("great play", 0.9)
+        db.flush()
+        assert db.get_sentiment_score("great play") == 0.9
+        assert db.get_sentiment_score("terrible play") is None
+        assert db.get_sentiment_scores(["terrible play"]) == {}
+        # The message stored last keeps the row
+        db.store_sentiment_score("terrible play", -0.7)
+        db.flush()
+        assert db.get_sentiment_scores(["great play", "terrible play"]) == {"terrible play": -0.7}
+    finally:
+        db.close()
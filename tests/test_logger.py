@@ -0,0 +1,52 @@
+import itertools
+import logging
+
+import pytest
+
+from logger import BatchingQueueListener, Logger
+
+_names = itertools.count()
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / "test.log")
+
+
+def make_logger(log_path, **options):
+    return Logger(f"test-logger-{next(_names)}", log_path, 10 * 1024 * 1024, 1, console_log_level=logging.CRITICAL, **options)
+
+
+def test_queued_records_are_written_in_order_by_close(log_path):
+    log = make_logger(log_path, use_queue=True, batch_size=7)
+    for index in range(500):
+        log.log_message('INFO', "message %d", index)
+    log.close()
+    with open(log_path) as log_file:
+        lines = log_file.read().splitlines()
+    assert [line.rsplit(" ", 1)[-1] for line in lines] == [str(index) for index in range(500)]
+
+
+@pytest.mark.parametrize("use_queue", [True, False])
+def test_close_closes_the_log_file_and_can_be_repeated(log_path, use_queue):
+    log = make_logger(log_path, use_queue=use_queue)
+    file_handler = log.handlers[1]
+    log.log_message('INFO', "before close")
+    log.close()
+    log.close()
+    assert file_handler.stream is None
+    assert log.logger.handlers == []
+
+
+def test_records_beyond_the_queue_size_are_dropped(log_path):
+    log = make_logger(log_path, use_queue=True, queue_size=5)
+    # Hold the listener back so the queue fills up
+    log.listener.stop()
+    for index in range(8):
+        log.log_message('INFO', "message %d", index)
+    assert log.dropped_messages == 3
+    log.listener = BatchingQueueListener(log.queue_handler.queue, *log.handlers)
+    log.listener.start()
+    log.close()
+    with open(log_path) as log_file:
+        assert len(log_file.read().splitlines()) == 5
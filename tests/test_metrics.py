@@ -0,0 +1,53 @@
+import asyncio
+import json
+import time
+
+from metrics import MetricsRegistry, MetricsServer, SnapshotWriter
+
+
+def test_counter_rates_are_measured_since_the_previous_snapshot_of_the_same_reader():
+    registry = MetricsRegistry()
+    messages = registry.counter("chat.messages")
+    first = registry.snapshot()
+    messages.inc(100)
+    time.sleep(0.1)
+    # Another reader's snapshot does not move this reader's baseline
+    registry.snapshot()
+    registry.snapshot(first)
+    second = registry.snapshot(first)
+    elapsed = second["monotonic_time"] - first["monotonic_time"]
+    assert second["counters"]["chat.messages"]["value"] == 100
+    assert abs(second["counters"]["chat.messages"]["rate_per_second"] - 100 / elapsed) < 1e-6
+
+
+def test_server_and_snapshot_file_keep_separate_rate_baselines(tmp_path):
+    registry = MetricsRegistry()
+    messages = registry.counter("chat.messages")
+    writer = SnapshotWriter(registry, str(tmp_path / "metrics.json"))
+
+    async def scrape(server):
+        reader, connection = await asyncio.open_connection("127.0.0.1", server.port)
+        connection.write(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = await reader.read()
+        connection.close()
+        return response.decode()
+
+    async def scenario():
+        server = MetricsServer(registry, port=0)
+        await server.start()
+        writer.write()
+        messages.inc(50)
+        await asyncio.sleep(0.2)
+        # Scraping right before the file is written must not reset the file's rate to zero
+        await scrape(server)
+        writer.write()
+        body = await scrape(server)
+        await server.close()
+        return body
+
+    body = asyncio.run(scenario())
+    with open(tmp_path / "metrics.json", encoding="utf-8") as snapshot_file:
+        snapshot = json.load(snapshot_file)
+    assert snapshot["counters"]["chat.messages"]["rate_per_second"] > 100
+    assert "streammatey_chat_messages_total 50" in body
+    assert "streammatey_chat_messages_per_second 0.000" in body
@@ -0,0 +1,147 @@
+import socket
+import sys
+import time
+
+import pytest
+
+from fake_servers import FakeOBSWebSocketServer
+from obs_client import OBSClient, OBSError
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def server():
+    server = FakeOBSWebSocketServer(latency=0.01, password="secret")
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def client(server):
+    client = OBSClient("127.0.0.1", server.port, "secret", request_timeout=2.0, initial_backoff=0.05).start()
+    assert client.connected.wait(5)
+    yield client
+    client.close()
+
+
+def test_responses_are_matched_to_their_requests_out_of_order(client, server):
+    slow = client.submit("GetVersion", delay=0.3, tag="slow")
+    fast = client.submit("GetVersion", delay=0.0, tag="fast")
+    assert fast.result(2)["tag"] == "fast"
+    assert not slow.done()
+    assert slow.result(2)["tag"] == "slow"
+
+
+def test_pipelined_requests_are_all_in_flight_at_once(client, server):
+    start = time.monotonic()
+    futures = [client.submit("GetStreamingStatus", delay=0.2) for _ in range(20)]
+    for future in futures:
+        future.result(5)
+    # One at a time this would take 4 seconds
+    assert time.monotonic() - start < 2.0
+
+
+def test_rejected_request_raises_obs_error(client):
+    with pytest.raises(OBSError):
+        client.call("Fail")
+
+
+def test_unanswered_request_times_out_at_its_deadline(client):
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        client.call("Hang", timeout=0.3)
+    assert time.monotonic() - start < 0.6
+    assert client.health()["timeouts"] == 1
+
+
+def test_requests_time_out_on_their_own_deadlines_while_obs_is_unreachable():
+    client = OBSClient("127.0.0.1", closed_port(), request_timeout=0.5, initial_backoff=10.0, max_backoff=30.0)
+    try:
+        for _ in range(3):
+            # The worker sleeps out a long backoff between attempts, which must not delay the deadline
+            start = time.monotonic()
+            with pytest.raises(TimeoutError):
+                client.call("GetVersion")
+            assert time.monotonic() - start < 0.8
+    finally:
+        client.close()
+
+
+def test_reconnects_after_the_connection_drops():
+    server = FakeOBSWebSocketServer(latency=0.005, drop_every=5)
+    client = OBSClient("127.0.0.1", server.port, request_timeout=2.0, initial_backoff=0.05)
+    try:
+        succeeded = 0
+        for _ in range(20):
+            try:
+                client.call("GetStreamingStatus")
+                succeeded += 1
+            except ConnectionError:
+                pass
+        assert succeeded >= 15
+        assert client.reconnects >= 1
+        assert server.connection_count >= 2
+    finally:
+        client.close()
+        server.close()
+
+
+def test_wrong_password_keeps_the_client_disconnected(server):
+    client = OBSClient("127.0.0.1", server.port, "wrong", request_timeout=0.3, initial_backoff=0.05)
+    try:
+        with pytest.raises(TimeoutError):
+            client.call("GetVersion")
+        assert not client.connected.is_set()
+        assert server.request_types() == []
+    finally:
+        client.close()
+
+
+def test_events_reach_registered_callbacks(client, server):
+    events = []
+    client.on("RecordingStarted", events.append)
+    server.broadcast('{"update-type": "RecordingStarted"}')
+    deadline = time.monotonic() + 2
+    while not events and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert events == [{"update-type": "RecordingStarted"}]
+
+
+def test_close_fails_pending_requests(client):
+    future = client.submit("Hang", timeout=10)
+    client.close()
+    with pytest.raises(ConnectionError):
+        future.result(1)
+
+
+def test_a_closed_shared_client_is_replaced(server):
+    from obs_client import get_obs_client
+
+    client = get_obs_client("127.0.0.1", server.port, "secret")
+    assert get_obs_client("127.0.0.1", server.port, "secret") is client
+    client.close()
+    replacement = get_obs_client("127.0.0.1", server.port, "secret").start()
+    try:
+        assert replacement is not client
+        assert replacement.call("GetVersion", timeout=2)["status"] == "ok"
+    finally:
+        replacement.close()
+
+
+def test_a_missing_websocket_package_fails_requests_without_retrying(monkeypatch):
+    # A None entry in sys.modules makes the import raise ImportError
+    monkeypatch.setitem(sys.modules, "websocket", None)
+    client = OBSClient("127.0.0.1", closed_port(), request_timeout=5.0, initial_backoff=0.05)
+    start = time.monotonic()
+    with pytest.raises(ConnectionError, match="websocket-client"):
+        client.call("GetVersion")
+    assert time.monotonic() - start < 1.0
+    client._thread.join(1)
+    assert not client._thread.is_alive()
+    assert client.reconnects == 0
+    client.close()
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import random
+import sqlite3
+import threading
+import time
+import types
+
+import pytest
+
+from database import Database
+from pipeline import DEFAULT_CONFIG, Pipeline, load_config
+
+HAPPY = "what a play"
+
+
+class FakeChatConnector:
+    def __init__(self, messages):
+        self._messages = list(messages)
+
+    async def get_messages(self, max_n, timeout=None):
+        if not self._messages:
+            return [None]
+        batch, self._messages = self._messages[:max_n], self._messages[max_n:]
+        return batch
+
+
+class FakeAnalyzer:
+    """
+    Scores HAPPY at 0.8 and anything else at random from -0.1 to 0.1, taking a random moment per batch so thread workers finish out of order.
+    """
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batches = 0
+        self._lock = threading.Lock()
+
+    def analyze_sentiment_batch(self, texts):
+        with self._lock:
+            self.batches += 1
+        if self.delay:
+            time.sleep(random.uniform(0, self.delay))
+        return [0.8 if text == HAPPY else random.Random(text).uniform(-0.1, 0.1) for text in texts]
+
+    def close(self):
+        pass
+
+
+class FakeClipCreator:
+    def __init__(self):
+        self.clips = []
+
+    async def create_clip(self, score=None, channel=None, timestamp=None):
+        self.clips.append((channel, timestamp))
+
+
+def chat_message(content, channel="streamer", user="viewer", timestamp=0.0):
+    return types.SimpleNamespace(content=content, channel=types.SimpleNamespace(name=channel),
+                                 author=types.SimpleNamespace(name=user), timestamp=timestamp)
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / "comments.db"))
+    yield database
+    database.close()
+
+
+def stored(database):
+    database.flush()
+    connection = sqlite3.connect(database.database_path)
+    try:
+        return connection.execute("SELECT channel, content, sentiment FROM chat_messages ORDER BY id").fetchall()
+    finally:
+        connection.close()
+
+
+def run_pipeline(database, messages, analyzer=None, overrides=None):
+    config = load_config(overrides={"batch_size": 50, **(overrides or {})})
+    clip_creator = FakeClipCreator()
+    triggers = []
+    pipeline = Pipeline(config, FakeChatConnector(messages), clip_creator, database,
+                        sentiment_analyzer=analyzer or FakeAnalyzer(), on_trigger=triggers.append)
+    asyncio.run(pipeline.run())
+    return pipeline, clip_creator, triggers
+
+
+def test_load_config_merges_files_and_overrides(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"clip_length": 30, "stages": {"score": {"concurrency": "process", "workers": 4}}}))
+    config = load_config(str(path), {"clip_length": 45})
+    assert config["clip_length"] == 45
+    assert config["stages"]["score"] == {"concurrency": "process", "workers": 4, "queue_size": 8}
+    assert config["stages"]["persist"] == DEFAULT_CONFIG["stages"]["persist"]
+    # The defaults are copied, not changed
+    assert DEFAULT_CONFIG["stages"]["score"]["workers"] == 1
+
+
+@pytest.mark.parametrize("overrides", [
+    {"clip_lenght": 30},
+    {"stages": {"publish": {"workers": 1}}},
+    {"stages": {"score": {"threads": 4}}},
+    {"stages": {"trigger": {"concurrency": "thread"}}},
+    {"stages": {"persist": {"workers": 0}}},
+    {"stages": {"persist": {"queue_size": 0}}},
+    {"stages": {"aggregate": {"workers": 2}}},
+])
+def test_load_config_rejects_invalid_settings(overrides):
+    with pytest.raises(ValueError):
+        load_config(overrides=overrides)
+
+
+@pytest.mark.parametrize("score, persist", [("async", "async"), ("thread", "thread"), ("thread", "async")])
+def test_batches_leave_every_stage_in_order(database, score, persist):
+    messages = [chat_message(f"message {index}", user=f"viewer{index}", timestamp=1000.0 + index / 10) for index in range(1000)]
+    stages = {"score": {"concurrency": score, "workers": 4 if score == "thread" else 1},
+              "persist": {"concurrency": persist, "workers": 3 if persist == "thread" else 1}}
+    analyzer = FakeAnalyzer(delay=0.01)
+    pipeline, _, _ = run_pipeline(database, messages, analyzer, {"stages": stages})
+    assert pipeline.processed == 1000
+    assert analyzer.batches == 20
+    if persist == "async":
+        assert [content for _, content, _ in stored(database)] == [f"message {index}" for index in range(1000)]
+    else:
+        # Persist workers write their batches concurrently; each batch is still written in order
+        assert sorted(content for _, content, _ in stored(database)) == sorted(f"message {index}" for index in range(1000))
+
+
+def test_scoring_on_a_process_pool(database):
+    from sentiment_analyzer import SentimentAnalyzer
+
+    analyzer = SentimentAnalyzer(database, processes=2, min_parallel_batch=10)
+    messages = [chat_message(f"great play number {index}", user=f"viewer{index}", timestamp=1000.0 + index) for index in range(100)]
+    try:
+        pipeline, _, _ = run_pipeline(database, messages, analyzer, {"stages": {"score": {"concurrency": "process", "workers": 2}}})
+    finally:
+        analyzer.close()
+    rows = stored(database)
+    assert pipeline.processed == 100
+    assert [content for _, content, _ in rows] == [message.content for message in messages]
+    assert all(sentiment > 0 for _, _, sentiment in rows)
+
+
+def test_repeats_are_stored_without_a_score(database):
+    messages = [chat_message("buy followers at example dot com", user="bot", timestamp=1000.0 + index) for index in range(5)]
+    run_pipeline(database, messages, overrides={"spam_max_repeats": 2})
+    assert [sentiment is None for _, _, sentiment in stored(database)] == [False, False, True, True, True]
+
+
+def busy_and_quiet_chat():
+    """
+    Two minutes of neutral chat in two channels, busy at 10 messages a second and quiet at 2, then a 10 second happy burst in the quiet one only.
+    """
+    messages = []
+    for tenth in range(1300):
+        timestamp = 1000.0 + tenth / 10
+        messages.append(chat_message(f"busy chat {tenth}", "busy", f"busy{tenth % 50}", timestamp))
+        if tenth % 5 == 0:
+            messages.append(chat_message(f"quiet chat {tenth}", "quiet", f"quiet{tenth % 7}", timestamp))
+        if tenth >= 1200 and tenth % 5 != 0:
+            messages.append(chat_message(HAPPY, "quiet", f"fan{tenth}", timestamp))
+    return messages
+
+
+def test_a_spike_triggers_one_clip_in_its_own_channel(database):
+    pipeline, clip_creator, triggers = run_pipeline(database, busy_and_quiet_chat(),
+                                                    overrides={"activity_window": 60, "activity_threshold": 1.0, "sentiment_z_threshold": 2.0})
+    # The burst lasts ten seconds, but only its first moments start a spike
+    assert [trigger["channel"] for trigger in triggers] == ["quiet"]
+    assert clip_creator.clips == [("quiet", triggers[0]["timestamp"])]
+    assert 1120.0 <= triggers[0]["timestamp"] < 1125.0
+    # Each channel has its own activity: the quiet one's last minute is 50 seconds at 2 messages a second and the burst at 10
+    assert pipeline.channels["busy"].activity_monitor.get_activity_level(timestamp=1130.0) == pytest.approx(10.0, rel=0.05)
+    assert pipeline.channels["quiet"].activity_monitor.get_activity_level(timestamp=1130.0) == pytest.approx(200 / 60, rel=0.05)
+
+
+def test_a_new_spike_after_the_last_one_ends_triggers_again(database):
+    messages = busy_and_quiet_chat()
+    # A minute of quiet neutral chat, then a second burst
+    for tenth in range(1300, 2500):
+        timestamp = 1000.0 + tenth / 10
+        if tenth % 5 == 0:
+            messages.append(chat_message(f"quiet chat {tenth}", "quiet", f"quiet{tenth % 7}", timestamp))
+        if tenth >= 2400 and tenth % 5 != 0:
+            messages.append(chat_message(HAPPY, "quiet", f"fan{tenth}", timestamp))
+    _, _, triggers = run_pipeline(database, messages, overrides={"activity_threshold": 1.0})
+    assert [(trigger["channel"], int(trigger["timestamp"] // 100)) for trigger in triggers] == [("quiet", 11), ("quiet", 12)]
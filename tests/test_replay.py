@@ -0,0 +1,39 @@
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip("twitchio")
+pytest.importorskip("websocket")
+
+from replay import ReplayRunner, load_chat_log
+
+CHAT_LOG = os.path.join(os.path.dirname(__file__), "fixtures", "chat_log.jsonl")
+# A minute of ordinary chat in channel1, six seconds of hype from 60 s on, then two more seconds of ordinary chat
+START = 1700000000.0
+
+
+def test_the_fixture_log_loads_in_order():
+    messages = list(load_chat_log(CHAT_LOG))
+    assert len(messages) == 422
+    assert [message.timestamp for message in messages] == sorted(message.timestamp for message in messages)
+    assert {message.channel.name for message in messages} == {"channel1"}
+
+
+def test_a_replay_clips_the_hype_once_through_obs():
+    runner = ReplayRunner(CHAT_LOG, speed=50, settings={"clip_length": 20, "post_roll": 5})
+    result = asyncio.run(runner.run())
+    assert result["messages"] == 422
+    # The spike starts with the hype and triggers once, however long it lasts
+    assert [trigger["channel"] for trigger in result["triggers"]] == ["channel1"]
+    trigger_time = result["triggers"][0]["timestamp"]
+    assert START + 60.0 <= trigger_time < START + 61.0
+    # The replay buffer is saved post_roll seconds after the trigger and holds the clip_length seconds before that
+    assert result["clips_created"] == 1
+    [(channel, start_time, end_time, clip_trigger_time, trigger_score, mode)] = result["clips"]
+    assert (channel, clip_trigger_time, mode) == ("channel1", trigger_time, "replay_buffer")
+    assert (start_time, end_time) == (pytest.approx(trigger_time - 15.0), pytest.approx(trigger_time + 5.0))
+    assert trigger_score > 0
+    # The requests reached the OBS WebSocket server through the client, at the log times they were due
+    assert [request for _, request in result["obs_calls"]] == ["StartReplayBuffer", "SaveReplayBuffer", "StopReplayBuffer"]
+    assert result["obs_calls"][1][0] == pytest.approx(trigger_time + 5.0, abs=0.5)
@@ -0,0 +1,110 @@
+import random
+
+import pytest
+
+from sentiment_aggregator import SentimentAggregator
+
+
+def feed(aggregator, scores, start=0.0, rate=10, users=None):
+    """
+    Adds `scores` at `rate` messages a second from `start`, each from its own viewer unless `users` is given, and returns the last timestamp.
+    """
+    timestamp = start
+    for index, score in enumerate(scores):
+        timestamp = start + index / rate
+        aggregator.add_score(score, users[index] if users else f"viewer{index}", timestamp)
+    return timestamp
+
+
+def test_window_mean_and_variance_match_the_scores_in_the_window():
+    aggregator = SentimentAggregator(window_size=10, user_half_life=0)
+    scores = [random.Random(index).uniform(-1, 1) for index in range(100)]
+    last = feed(aggregator, scores)
+    assert aggregator.get_message_count(last) == 100
+    assert aggregator.get_mean(last) == pytest.approx(sum(scores) / 100)
+    mean = sum(scores) / 100
+    assert aggregator.get_variance(last) == pytest.approx(sum((score - mean) ** 2 for score in scores) / 100)
+
+
+def test_scores_leave_the_window_as_it_moves():
+    aggregator = SentimentAggregator(window_size=10, user_half_life=0)
+    feed(aggregator, [1.0] * 50, start=0.0)
+    feed(aggregator, [-1.0] * 50, start=5.0)
+    # At 12 s the window holds the buckets from 3 s on: 20 scores of 1.0 and 50 of -1.0
+    assert aggregator.get_message_count(12.0) == 70
+    assert aggregator.get_mean(12.0) == pytest.approx(-30 / 70)
+    # After a gap longer than the window, nothing is left
+    assert aggregator.get_message_count(100.0) == 0
+    assert aggregator.get_mean(100.0) == 0.0
+
+
+def test_ewma_halves_the_weight_of_old_scores_every_half_life():
+    aggregator = SentimentAggregator(half_life=5.0, user_half_life=0)
+    aggregator.add_score(1.0, timestamp=0.0)
+    aggregator.add_score(0.0, timestamp=5.0)
+    # The first score has half the weight of the second
+    assert aggregator.get_ewma() == pytest.approx(1 / 3)
+    assert aggregator.get_ewm_variance() == pytest.approx(2 / 9)
+
+
+def test_a_user_repeating_themselves_counts_roughly_once():
+    aggregator = SentimentAggregator(user_half_life=30.0)
+    weights = [aggregator.add_score(0.9, "spammer", second) for second in range(5)]
+    assert weights[0] == 1.0
+    assert weights == sorted(weights, reverse=True)
+    assert weights[-1] < 0.3
+    assert aggregator.add_score(0.9, "someone else", 5.0) == 1.0
+
+
+def test_user_weights_and_max_users():
+    aggregator = SentimentAggregator(user_weights={"moderator": 2.0}, max_users=2)
+    assert aggregator.add_score(0.5, "moderator", 0.0) == 2.0
+    aggregator.add_score(0.5, "viewer1", 1.0)
+    aggregator.add_score(0.5, "viewer2", 2.0)
+    # The least recently seen user was forgotten, so their next message counts fully again
+    assert aggregator.add_score(0.5, "moderator", 3.0) == 2.0
+
+
+def neutral_chat(seconds, rate=10, seed=0):
+    rng = random.Random(seed)
+    return [rng.uniform(-0.3, 0.3) for _ in range(seconds * rate)]
+
+
+def test_flat_chat_never_spikes():
+    aggregator = SentimentAggregator(window_size=60, half_life=5.0, z_threshold=3.0)
+    spikes = 0
+    for index, score in enumerate(neutral_chat(300)):
+        aggregator.add_score(score, f"viewer{index % 200}", index / 10)
+        spikes += aggregator.is_spike(index / 10)
+    assert spikes == 0
+    assert abs(aggregator.get_z_score(299.9)) < 3.0
+
+
+def test_a_step_in_sentiment_crosses_the_z_score_threshold():
+    aggregator = SentimentAggregator(window_size=60, half_life=5.0, z_threshold=3.0)
+    last = feed(aggregator, neutral_chat(60))
+    assert not aggregator.is_spike(last)
+    crossed_at = None
+    for index in range(100):
+        timestamp = 60.0 + index / 10
+        aggregator.add_score(0.7, f"fan{index}", timestamp)
+        if crossed_at is None and aggregator.is_spike(timestamp):
+            crossed_at = timestamp
+    # Within a couple of seconds of the step, well before the window catches up
+    assert crossed_at is not None and crossed_at < 62.0
+    stats = aggregator.get_stats(crossed_at)
+    assert stats["ewma"] > 0.05 and stats["z_score"] >= 3.0 and stats["spike"]
+
+
+def test_no_spike_below_min_messages_or_sentiment_threshold():
+    aggregator = SentimentAggregator(min_messages=20)
+    last = feed(aggregator, [0.0, 0.1] * 5 + [0.9] * 5)
+    assert aggregator.get_message_count(last) == 15
+    assert not aggregator.is_spike(last)
+
+    # A step up that stays negative is not a happy spike
+    aggregator = SentimentAggregator(window_size=60, sentiment_threshold=0.05)
+    last = feed(aggregator, [score - 0.6 for score in neutral_chat(60)])
+    last = feed(aggregator, [-0.1] * 50, start=last + 0.1)
+    assert aggregator.get_z_score(last) > 2.0
+    assert not aggregator.is_spike(last)
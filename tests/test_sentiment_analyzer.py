@@ -0,0 +1,104 @@
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("vaderSentiment")
+
+import sentiment_analyzer
+from database import Database
+from sentiment_analyzer import SentimentAnalyzer
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / "comments.db"))
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def scored(monkeypatch):
+    """
+    Records every list of texts passed to VADER.
+    """
+    calls = []
+    score_texts = sentiment_analyzer.score_texts
+
+    def recording_score_texts(texts):
+        calls.append(list(texts))
+        return score_texts(texts)
+
+    monkeypatch.setattr(sentiment_analyzer, "score_texts", recording_score_texts)
+    return calls
+
+
+def test_batch_scores_come_back_in_order_and_match_single_scores(database, scored):
+    analyzer = SentimentAnalyzer(database)
+    messages = ["What a play!", "this is boring", "What a   play! ", "gg", "this is boring"]
+    scores = SentimentAnalyzer(database).analyze_sentiment_batch(messages)
+    assert list(scores) == [analyzer.analyze_sentiment(message) for message in messages]
+    assert scores[0] > 0 > scores[1]
+    assert scores[0] == scores[2] and scores[1] == scores[4]
+
+
+def test_duplicates_in_a_batch_are_scored_once(database, scored):
+    SentimentAnalyzer(database).analyze_sentiment_batch(["PogChamp", "PogChamp  PogChamp", "  PogChamp ", "LUL", "PogChamp"])
+    assert scored == [["PogChamp", "PogChamp PogChamp", "LUL"]]
+
+
+def test_cached_scores_skip_the_database_and_vader(database, scored, monkeypatch):
+    analyzer = SentimentAnalyzer(database)
+    first = analyzer.analyze_sentiment_batch(["nice shot", "that was terrible"])
+
+    def no_lookup(messages):
+        raise AssertionError("looked up a cached message")
+
+    monkeypatch.setattr(database, "get_sentiment_scores", no_lookup)
+    assert list(analyzer.analyze_sentiment_batch(["that was terrible", "nice shot"])) == [first[1], first[0]]
+    assert len(scored) == 1
+    assert analyzer.cache.hits == 2
+
+
+def test_stored_scores_are_read_from_the_database(database, scored):
+    SentimentAnalyzer(database).analyze_sentiment_batch(["nice shot", "that was terrible"])
+    database.flush()
+    # A new analyzer has an empty cache, so the scores come from the database
+    analyzer = SentimentAnalyzer(database)
+    scores = analyzer.analyze_sentiment_batch(["that was terrible", "nice shot", "new message"])
+    assert scored == [["nice shot", "that was terrible"], ["new message"]]
+    assert scores[0] < 0 < scores[1]
+    assert analyzer.cache.get("that was terrible") == scores[0]
+
+
+def test_a_batch_found_in_the_database_never_scores(database, scored):
+    SentimentAnalyzer(database).analyze_sentiment_batch(["nice shot"])
+    database.flush()
+    scored.clear()
+    SentimentAnalyzer(database).analyze_sentiment_batch(["nice shot", " nice  shot"])
+    assert scored == []
+
+
+def test_cache_gauges_cover_every_live_analyzer(database):
+    import gc
+
+    import metrics
+
+    first = SentimentAnalyzer(database)
+    second = SentimentAnalyzer(database)
+    sentiment_analyzer._caches.clear()
+    sentiment_analyzer._caches.update((first.cache, second.cache))
+    first.analyze_sentiment_batch(["nice shot", "nice shot"])
+    second.analyze_sentiment_batch(["gg"])
+    second.analyze_sentiment_batch(["gg", "nice shot"])
+    # One hit out of four lookups: duplicates within a batch are looked up once
+    assert metrics.registry.gauges["sentiment.cache_hit_rate"].value == 0.25
+    assert metrics.registry.gauges["sentiment.cache_size"].value == 3
+    del second
+    gc.collect()
+    assert metrics.registry.gauges["sentiment.cache_hit_rate"].value == 0.0
+    assert metrics.registry.gauges["sentiment.cache_size"].value == 1
+
+
+def test_bypass_repetitive_comments_keeps_each_message_once_and_drops_spam():
+    messages = ["gg", "buy followers", "LUL", "buy followers", "gg", "lul", "buy followers", "buy followers"]
+    assert sentiment_analyzer.bypass_repetitive_comments(messages) == ["gg", "LUL", "lul"]
+    assert sentiment_analyzer.bypass_repetitive_comments(messages, max_repeats=1) == ["LUL", "lul"]
@@ -0,0 +1,48 @@
+from spam_filter import SpamFilter
+from text_normalizer import canonical_message
+
+COPYPASTA = "this streamer has never once hit a shot in his entire career and today is no different"
+
+
+def test_one_viewer_repeating_a_message_is_spam():
+    spam_filter = SpamFilter(window=30, max_repeats=3)
+    results = [spam_filter.is_spam("LUL", timestamp=second, user="ana") for second in range(5)]
+    assert results == [False, False, False, True, True]
+
+
+def test_emote_flood_from_many_viewers_is_not_spam():
+    spam_filter = SpamFilter(window=30, max_repeats=3)
+    assert not any(spam_filter.is_spam("PogChamp PogChamp", timestamp=1.0, user=f"viewer{index}") for index in range(200))
+    assert spam_filter.filtered == 0
+
+
+def test_copypasta_from_many_viewers_is_spam():
+    spam_filter = SpamFilter(window=30, max_repeats=3, copypasta_length=40)
+    results = [spam_filter.is_spam(COPYPASTA, timestamp=1.0, user=f"viewer{index}") for index in range(10)]
+    assert results == [False] * 3 + [True] * 7
+
+
+def test_repeats_age_out_of_the_window():
+    spam_filter = SpamFilter(window=30, max_repeats=1)
+    assert not spam_filter.is_spam("gg", timestamp=0, user="ana")
+    assert spam_filter.is_spam("gg", timestamp=1, user="ana")
+    assert not spam_filter.is_spam("gg", timestamp=45, user="ana")
+
+
+def test_without_users_messages_are_counted_across_the_chat():
+    assert SpamFilter(max_repeats=2).filter(["LUL", "lul", "LUL!!!", "gg"], timestamp=0) == ["LUL", "lul", "gg"]
+
+
+def test_canonical_message_collapses_a_repeated_phrase():
+    assert canonical_message("LUL LUL LUL") == "lul"
+    assert canonical_message("Pog Champ pog champ POG CHAMP") == "pog champ"
+    assert canonical_message("gg wp gg") == "gg wp gg"
+    assert canonical_message("") == ""
+
+
+def test_canonical_message_is_linear_in_the_message_length():
+    # Checking every period would take seconds here
+    words = " ".join(f"w{index}" for index in range(50000))
+    once = canonical_message(words)
+    assert len(once.split()) > 40000
+    assert canonical_message(words + " " + words) == once
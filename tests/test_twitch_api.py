@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+
+from fake_servers import FakeHelixServer
+from twitch_api import AsyncTwitchAPI, HelixRateLimiter
+
+
+@pytest.fixture
+def server():
+    server = FakeHelixServer()
+    yield server
+    server.close()
+
+
+def api_for(server, **options):
+    return AsyncTwitchAPI("client-id", "secret", access_token="token", refresh_token="refresh",
+                          base_url=server.helix_url, oauth_url=f"{server.oauth_url}/token", **options)
+
+
+def run(server, scenario, **options):
+    async def main():
+        api = api_for(server, **options)
+        try:
+            return await scenario(api)
+        finally:
+            await api.close()
+    return asyncio.run(main())
+
+
+def test_a_missing_client_id_fails_fast():
+    with pytest.raises(ValueError):
+        AsyncTwitchAPI(None, "secret")
+
+
+def test_requests_send_the_client_id_and_token(server):
+    user = run(server, lambda api: api.get_user_info())
+    assert user["login"] == "streamer"
+    _, _, headers = server.requests[0]
+    assert headers["Client-ID"] == "client-id"
+    assert headers["Authorization"] == "Bearer token"
+
+
+def test_lookups_are_batched_and_cached(server):
+    ids = [str(index) for index in range(250)]
+
+    async def scenario(api):
+        first = await api.get_users(ids=ids)
+        second = await api.get_users(ids=ids)
+        return first, second
+
+    first, second = run(server, scenario)
+    assert list(first) == ids and second == first
+    # 100 ids per request, and nothing fetched the second time
+    assert len(server.paths("/helix/users")) == 3
+
+
+def test_a_429_is_retried_after_the_reset(server):
+    server.responses.append((429, {"Ratelimit-Remaining": "0", "Ratelimit-Reset": str(time.time() + 0.2)}, {"error": "Too Many Requests"}))
+    start = time.monotonic()
+    user = run(server, lambda api: api.get_user_info())
+    assert user["login"] == "streamer"
+    assert time.monotonic() - start >= 0.15
+    assert len(server.requests) == 2
+
+
+def test_429_retries_are_capped(server):
+    for _ in range(5):
+        server.responses.append((429, {"Ratelimit-Remaining": "0", "Ratelimit-Reset": str(time.time())}, {"error": "Too Many Requests"}))
+    with pytest.raises(aiohttp.ClientResponseError) as error:
+        run(server, lambda api: api.get_user_info(), max_retries=2)
+    assert error.value.status == 429
+    assert len(server.requests) == 3
+
+
+def test_a_401_refreshes_the_token_once(server):
+    server.responses.append((401, {}, {"error": "Unauthorized"}))
+
+    async def scenario(api):
+        user = await api.get_user_info()
+        return user, api.access_token
+
+    user, token = run(server, scenario)
+    assert user["login"] == "streamer" and token == "refreshed"
+    assert server.paths() == ["/helix/users", "/oauth2/token", "/helix/users"]
+    assert server.requests[-1][2]["Authorization"] == "Bearer refreshed"
+
+
+def test_rate_limiter_spends_a_fresh_budget_after_the_reset():
+    async def scenario():
+        limiter = HelixRateLimiter(reserve=1, window=0.3)
+        limiter.update({"Ratelimit-Limit": "3", "Ratelimit-Remaining": "1", "Ratelimit-Reset": str(time.time() + 0.2)})
+        times = []
+
+        async def request():
+            await limiter.acquire()
+            times.append(time.monotonic())
+
+        start = time.monotonic()
+        await asyncio.gather(*(request() for _ in range(4)))
+        return [moment - start for moment in times]
+
+    times = asyncio.run(scenario())
+    # Two requests spend the budget of three down to the reserve, and the next two wait for the following window
+    assert all(0.15 <= moment < 0.4 for moment in times[:2])
+    assert all(0.45 <= moment < 0.8 for moment in times[2:])
@@ -0,0 +1,87 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from write_behind import WriteBehindQueue
+
+INSERT = "INSERT INTO rows (value) VALUES (?)"
+
+
+@pytest.fixture
+def database_path(tmp_path):
+    path = str(tmp_path / "rows.db")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE rows (value INTEGER)")
+    connection.close()
+    return path
+
+
+def stored(database_path):
+    connection = sqlite3.connect(database_path)
+    try:
+        return [value for (value,) in connection.execute("SELECT value FROM rows ORDER BY rowid")]
+    finally:
+        connection.close()
+
+
+def test_rows_are_written_in_order(database_path):
+    queue = WriteBehindQueue(database_path, batch_size=7, flush_interval=0.01)
+    for value in range(100):
+        queue.put(INSERT, (value,))
+    queue.close()
+    assert stored(database_path) == list(range(100))
+    assert queue.stats()["written"] == 100
+
+
+def test_the_default_policy_drops_the_oldest_rows_instead_of_blocking(database_path):
+    queue = WriteBehindQueue(database_path, max_queue_size=2)
+    queue._thread = threading.Thread(target=lambda: None)  # No writer yet, so the queue fills up
+    assert queue.overflow_policy == "drop_oldest"
+    for value in range(1, 4):
+        assert queue.put(INSERT, (value,))
+    assert queue.dropped == 1 and list(queue._pending) == [(INSERT, (2,)), (INSERT, (3,))]
+
+
+def test_drop_newest_discards_the_row_being_added(database_path):
+    queue = WriteBehindQueue(database_path, max_queue_size=2, overflow_policy="drop_newest")
+    queue._thread = threading.Thread(target=lambda: None)  # No writer yet, so the queue fills up
+    assert queue.put(INSERT, (1,)) and queue.put(INSERT, (2,))
+    assert queue.put(INSERT, (3,)) is False
+    assert queue.dropped == 1 and list(queue._pending) == [(INSERT, (1,)), (INSERT, (2,))]
+
+
+def test_blocking_put_is_refused_on_an_event_loop(database_path):
+    queue = WriteBehindQueue(database_path, overflow_policy="block")
+
+    async def put_from_loop():
+        queue.put(INSERT, (1,))
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(put_from_loop())
+    queue.close()
+
+
+def test_blocking_put_raises_when_the_queue_closes_while_it_waits(database_path):
+    queue = WriteBehindQueue(database_path, max_queue_size=1, overflow_policy="block")
+    queue._thread = threading.Thread(target=lambda: None)  # No writer, so room never appears
+    queue.put(INSERT, (1,))
+    errors = []
+
+    def blocked_put():
+        try:
+            queue.put(INSERT, (2,))
+        except RuntimeError as error:
+            errors.append(error)
+
+    producer = threading.Thread(target=blocked_put)
+    producer.start()
+    time.sleep(0.1)
+    with queue._condition:
+        queue._closed = True
+        queue._condition.notify_all()
+    producer.join(5)
+    assert len(errors) == 1
+    assert list(queue._pending) == [(INSERT, (1,))]
@@ -0,0 +1,48 @@
+"""
+The `text_normalizer.py` script is part of the StreamMatey OBS Plugin software. It provides helpers for turning raw chat messages into stable keys for caching and storage.
+
+The script provides the following functions:
+
+- `normalize_message(chat_message)`: Returns the message in Unicode NFC form with leading and trailing whitespace removed and internal runs of whitespace collapsed to a single space. Case is kept because VADER treats words in capitals as more intense, so "LUL" and "lul" can score differently.
+- `canonical_message(chat_message)`: Returns a looser form of the message for spotting near-duplicates such as copypasta and emote spam. On top of `normalize_message` it folds case, drops ASCII punctuation, shortens runs of a repeated character to two ("loooool" becomes "lool") and collapses a message that repeats one word or phrase ("LUL LUL LUL", "pog champ pog champ") to a single copy of it. It is not used for scoring, since it throws away what VADER reads as emphasis.
+"""
+
+import re
+import string
+import unicodedata
+
+_WHITESPACE = re.compile(r'\s+')
+_PUNCTUATION = str.maketrans('', '', string.punctuation)
+_CHARACTER_RUN = re.compile(r'(.)\1{2,}')
+
+
+def normalize_message(chat_message):
+    """
+    This function takes in a chat message and returns its normalized form, used as the key for cached and stored sentiment scores.
+    """
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFC', chat_message)).strip()
+
+
+def canonical_message(chat_message):
+    """
+    This function takes in a chat message and returns the form used to recognize near-duplicates of it.
+    """
+    text = normalize_message(chat_message).casefold().translate(_PUNCTUATION)
+    text = _CHARACTER_RUN.sub(r'\1\1', text)
+    words = []
+    for word in text.split():
+        if not words or words[-1] != word:
+            words.append(word)
+    # A message that is one phrase said several times becomes that phrase. The shortest such phrase is
+    # the message minus its longest proper prefix that is also a suffix (the KMP prefix function), in linear time
+    count = len(words)
+    border = [0] * count
+    for index in range(1, count):
+        length = border[index - 1]
+        while length and words[index] != words[length]:
+            length = border[length - 1]
+        border[index] = length + (words[index] == words[length])
+    period = count - border[-1] if words else 0
+    if period and count % period == 0:
+        return ' '.join(words[:period])
+    return ' '.join(words)
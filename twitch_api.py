@@ -1,7 +1,7 @@
 """
-The `twitch_api.py` script is part of the StreamMatey OBS Plugin software. It provides a `TwitchAPI` class for interacting with the Twitch API.
+The `twitch_api.py` script is part of the StreamMatey OBS Plugin software. It provides a `TwitchAPI` class for interacting with the Twitch API, and an `AsyncTwitchAPI` class for doing so from asyncio code.
 
-The `TwitchAPI` class is initialized with the client ID, client secret, and redirect URI for the Twitch API. It also sets the base URL for the Twitch API and the URL for OAuth authentication.
+The `TwitchAPI` class is initialized with the client ID, client secret, and redirect URI for the Twitch API. It also sets the base URL for the Twitch API and the URL for OAuth authentication, and opens a `requests.Session` so every call reuses the same connection and headers.
 
 The `TwitchAPI` class provides the following methods:
 
@@ -11,19 +11,41 @@ The `TwitchAPI` class provides the following methods:
 
 - `get_channel_info(broadcaster_id)`: This method takes a broadcaster ID as input and retrieves the channel's information from the Twitch API. It sends a GET request to the `/channels` endpoint of the Twitch API with the broadcaster ID, client ID, and access token in the headers. If the request is successful, it returns the first channel object in the response data.
 
+The `AsyncTwitchAPI` class offers the same calls as coroutines on one pooled `aiohttp` session, plus `get_users`, `get_user`, `get_channels` and `get_channel_info`, which cache what they fetch and look up many users or channels in as few requests as Helix allows. Every request first takes a slot from a `HelixRateLimiter`, which counts down the budget Twitch reports in its `Ratelimit-*` headers and, once the budget is spent, holds requests back until `Ratelimit-Reset` and then hands out a fresh budget of `Ratelimit-Limit` requests. A request answered with 429 is retried after the reset at most `max_retries` times before its error is raised, and one answered with 401 is retried once with a refreshed access token.
+
+Both classes need a client ID and raise `ValueError` without one, rather than sending requests Twitch would reject.
+
 In the main part of the script, an instance of the `TwitchAPI` class is created with the client ID, client secret, and redirect URI. The `authenticate` method is then called with an authorization code to authenticate with the Twitch API and set the access token.
 """
 
-import requests
+import asyncio
+import logging
+import time
+from cache import TTLCache
+
+HELIX_URL = 'https://api.twitch.tv/helix'
+OAUTH_URL = 'https://id.twitch.tv/oauth2/token'
+# Helix accepts at most 100 `id`/`login`/`broadcaster_id` parameters per request
+MAX_IDS_PER_REQUEST = 100
+
+def _require_client_id(client_id):
+    if not client_id:
+        raise ValueError("A Twitch client ID is required; set TWITCH_CLIENT_ID")
+    return client_id
 
 class TwitchAPI:
     def __init__(self, client_id, client_secret, redirect_uri):
+        _require_client_id(client_id)
         self.client_id = client_id
         self.client_secret = client_secret
         self.redirect_uri = redirect_uri
-        self.base_url = 'https://api.twitch.tv/helix'
-        self.oauth_url = 'https://id.twitch.tv/oauth2/token'
+        self.base_url = HELIX_URL
+        self.oauth_url = OAUTH_URL
         self.access_token = None
+        # One session keeps the TCP/TLS connection to Twitch open between calls
+        import requests
+        self.session = requests.Session()
+        self.session.headers['Client-ID'] = client_id
 
     def authenticate(self, code):
         data = {
@@ -33,25 +55,164 @@ class TwitchAPI:
             'grant_type': 'authorization_code',
             'redirect_uri': self.redirect_uri
         }
-        response = requests.post(self.oauth_url, data=data)
+        response = self.session.post(self.oauth_url, data=data)
         response.raise_for_status()  # Raise exception if the request failed
         self.access_token = response.json().get('access_token')
+        self.session.headers['Authorization'] = f'Bearer {self.access_token}'
 
     def get_user_info(self):
-        headers = {
-            'Client-ID': self.client_id,
-            'Authorization': f'Bearer {self.access_token}'
-        }
-        response = requests.get(f'{self.base_url}/users', headers=headers)
+        response = self.session.get(f'{self.base_url}/users')
         response.raise_for_status()  # Raise exception if the request failed
         return response.json().get('data', [{}])[0]  # Return the first user object
 
     def get_channel_info(self, broadcaster_id):
-        headers = {
-            'Client-ID': self.client_id,
-            'Authorization': f'Bearer {self.access_token}'
-        }
-        response = requests.get(f'{self.base_url}/channels?broadcaster_id={broadcaster_id}', headers=headers)
+        response = self.session.get(f'{self.base_url}/channels', params={'broadcaster_id': broadcaster_id})
         response.raise_for_status()  # Raise exception if the request failed
         return response.json().get('data', [{}])[0]  # Return the first channel object
 
+class HelixRateLimiter:
+    def __init__(self, reserve=1, limit=800, window=60.0):
+        self.reserve = reserve
+        # Helix's default bucket: 800 points, refilled over a minute
+        self.limit = limit
+        self.window = window
+        self.remaining = None
+        self.reset_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            if self.remaining is None:
+                return  # No budget reported yet
+            if self.remaining <= self.reserve:
+                delay = self.reset_at - time.time()
+                if delay > 0:
+                    logging.info(f"Twitch rate limit reached, waiting {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                # Requests still waiting are counted against the new budget until a response reports it
+                self.remaining = self.limit
+                self.reset_at = time.time() + self.window
+            self.remaining -= 1
+
+    def update(self, headers):
+        if 'Ratelimit-Limit' in headers:
+            self.limit = int(headers['Ratelimit-Limit'])
+        if 'Ratelimit-Remaining' in headers:
+            self.remaining = int(headers['Ratelimit-Remaining'])
+        if 'Ratelimit-Reset' in headers:
+            self.reset_at = float(headers['Ratelimit-Reset'])
+
+class AsyncTwitchAPI:
+    def __init__(self, client_id, client_secret, redirect_uri=None, access_token=None, refresh_token=None,
+                 cache_ttl=300.0, cache_size=10000, max_connections=10, base_url=HELIX_URL, oauth_url=OAUTH_URL, max_retries=3):
+        self.client_id = _require_client_id(client_id)
+        self.client_secret = client_secret
+        self.redirect_uri = redirect_uri
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.base_url = base_url
+        self.oauth_url = oauth_url
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.cache = TTLCache(max_size=cache_size, ttl=cache_ttl)
+        self.rate_limiter = HelixRateLimiter()
+        self._session = None
+        self._refresh_lock = asyncio.Lock()
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            # Imported on first request; aiohttp is the slowest import of the plugin
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                headers={'Client-ID': self.client_id},
+                raise_for_status=False,
+            )
+        return self._session
+
+    async def _request_token(self, data):
+        async with self._get_session().post(self.oauth_url, data={'client_id': self.client_id, 'client_secret': self.client_secret, **data}) as response:
+            response.raise_for_status()
+            token = await response.json()
+        self.access_token = token.get('access_token')
+        self.refresh_token = token.get('refresh_token', self.refresh_token)
+
+    async def authenticate(self, code):
+        await self._request_token({'code': code, 'grant_type': 'authorization_code', 'redirect_uri': self.redirect_uri})
+
+    async def refresh_access_token(self):
+        if self.refresh_token is None:
+            raise RuntimeError("No refresh token available")
+        stale_token = self.access_token
+        async with self._refresh_lock:
+            # Another request may have refreshed the token while this one waited
+            if self.access_token == stale_token:
+                await self._request_token({'grant_type': 'refresh_token', 'refresh_token': self.refresh_token})
+                logging.info("Refreshed Twitch access token")
+
+    async def _get(self, path, params):
+        refreshed = False
+        retries = 0
+        while True:
+            await self.rate_limiter.acquire()
+            headers = {'Authorization': f'Bearer {self.access_token}'}
+            async with self._get_session().get(f'{self.base_url}/{path}', params=params, headers=headers) as response:
+                self.rate_limiter.update(response.headers)
+                if response.status == 401 and self.refresh_token is not None and not refreshed:
+                    refreshed = True
+                    await self.refresh_access_token()
+                    continue
+                if response.status == 429 and retries < self.max_retries:
+                    retries += 1
+                    self.rate_limiter.remaining = 0
+                    self.rate_limiter.reset_at = max(self.rate_limiter.reset_at, time.time() + 1)
+                    continue
+                response.raise_for_status()
+                return (await response.json()).get('data', [])
+
+    async def get_user_info(self):
+        users = await self._get('users', [])
+        return users[0] if users else {}
+
+    async def _get_many(self, path, kind, parameter, keys):
+        found = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            cached = self.cache.get((kind, key))
+            if cached is None:
+                missing.append(key)
+            else:
+                found[key] = cached
+        chunks = [missing[offset:offset + MAX_IDS_PER_REQUEST] for offset in range(0, len(missing), MAX_IDS_PER_REQUEST)]
+        results = await asyncio.gather(*(self._get(path, [(parameter, key) for key in chunk]) for chunk in chunks))
+        return found, [item for items in results for item in items]
+
+    async def get_users(self, ids=(), logins=()):
+        found_ids, fetched_ids = await self._get_many('users', 'user', 'id', ids)
+        found_logins, fetched_logins = await self._get_many('users', 'login', 'login', [login.lower() for login in logins])
+        for user in fetched_ids + fetched_logins:
+            self.cache.set(('user', user['id']), user)
+            self.cache.set(('login', user['login']), user)
+            found_ids[user['id']] = user
+            found_logins[user['login']] = user
+        return {**{key: found_ids[key] for key in ids if key in found_ids},
+                **{login: found_logins[login.lower()] for login in logins if login.lower() in found_logins}}
+
+    async def get_user(self, user_id=None, login=None):
+        users = await self.get_users(ids=[user_id] if user_id else (), logins=[login] if login else ())
+        return users.get(user_id or login)
+
+    async def get_channels(self, broadcaster_ids):
+        found, fetched = await self._get_many('channels', 'channel', 'broadcaster_id', broadcaster_ids)
+        for channel in fetched:
+            self.cache.set(('channel', channel['broadcaster_id']), channel)
+            found[channel['broadcaster_id']] = channel
+        return {key: found[key] for key in broadcaster_ids if key in found}
+
+    async def get_channel_info(self, broadcaster_id):
+        return (await self.get_channels([broadcaster_id])).get(broadcaster_id, {})
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
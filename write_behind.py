@@ -0,0 +1,183 @@
+"""
+The `write_behind.py` script is part of the StreamMatey OBS Plugin software. It provides a `WriteBehindQueue` class that takes SQLite writes off the chat-processing path and applies them in batches.
+
+Callers hand the queue an SQL statement and its parameters with `put` and return immediately. A background thread gathers queued rows and writes them with `executemany`, one transaction per batch. A batch is flushed as soon as it reaches `batch_size` rows, or `flush_interval` seconds after its first row was queued, whichever comes first. The database is opened in WAL mode with `synchronous=NORMAL`, so a commit does not wait for a full fsync and readers on other connections are never blocked by the writer.
+
+The queue holds at most `max_queue_size` rows. When it is full, `overflow_policy` decides what `put` does:
+
+- `'drop_oldest'` (the default): Discard the oldest queued row to make room for the new one.
+- `'drop_newest'`: Discard the row being added.
+- `'block'`: Wait for the writer to make room (up to the `timeout` given to `put`, if any). Waiting on a slow disk would freeze an asyncio event loop, so `put` raises `RuntimeError` when a queue with this policy is used from a thread running an event loop.
+
+Dropped rows are counted in `dropped`, and `put` returns False when its row was not queued.
+
+The `WriteBehindQueue` class has the following methods:
+
+- `put(statement, params, timeout=None)`: Queues one row to be written. It raises `RuntimeError` once the queue is closed, including when the queue is closed while `put` waits for room.
+- `flush(timeout=None)`: Waits until every row queued before the call has been written or dropped.
+- `close()`: Flushes the queue, stops the writer thread and closes its connection. It should be called on shutdown.
+- `stats()`: Returns the queued, written and dropped row counts, the number of batches and the current queue depth.
+
+The writer thread is started on the first `put`, so creating a queue has no side effects.
+"""
+
+import asyncio
+import collections
+import logging
+import sqlite3
+import threading
+import time
+
+OVERFLOW_POLICIES = ('block', 'drop_newest', 'drop_oldest')
+
+
+def connect_wal(database_path):
+    """
+    This function opens a connection to `database_path` in WAL mode with `synchronous=NORMAL`, the settings used for batched writes.
+    """
+    connection = sqlite3.connect(database_path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+
+class WriteBehindQueue:
+    def __init__(self, database_path, batch_size=500, flush_interval=0.5, max_queue_size=50000, overflow_policy='drop_oldest'):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Invalid overflow policy: {overflow_policy}")
+        self.database_path = database_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.overflow_policy = overflow_policy
+        self._pending = collections.deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self._flush_requested = False
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.failed_batches = 0
+        # Queued rows that have left the queue, whether written or dropped
+        self._completed = 0
+
+    def put(self, statement, params, timeout=None):
+        if self.overflow_policy == 'block':
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+            else:
+                raise RuntimeError("A blocking WriteBehindQueue cannot be used from an event loop; use a dropping overflow policy")
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("WriteBehindQueue is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+            if len(self._pending) >= self.max_queue_size:
+                if self.overflow_policy == 'drop_newest':
+                    self.dropped += 1
+                    return False
+                if self.overflow_policy == 'drop_oldest':
+                    self._pending.popleft()
+                    self.dropped += 1
+                    self._completed += 1
+                elif not self._condition.wait_for(lambda: len(self._pending) < self.max_queue_size or self._closed, timeout):
+                    self.dropped += 1
+                    return False
+                elif self._closed:
+                    # The writer has stopped, so a row queued now would never be written
+                    raise RuntimeError("WriteBehindQueue is closed")
+            self._pending.append((statement, params))
+            self.queued += 1
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify_all()
+            return True
+
+    def flush(self, timeout=None):
+        with self._condition:
+            if self._thread is None:
+                return True
+            target = self.queued
+            self._flush_requested = True
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: self._completed >= target or not self._thread.is_alive(), timeout)
+
+    def close(self):
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def stats(self):
+        return {
+            'queued': self.queued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'failed_batches': self.failed_batches,
+            'queue_depth': len(self._pending),
+        }
+
+    def _next_batch(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending or self._closed)
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._pending) < self.batch_size and not self._closed and not self._flush_requested:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            if not self._pending:
+                self._flush_requested = False
+            # Wake producers blocked on a full queue
+            self._condition.notify_all()
+            return batch
+
+    def _write_batch(self, connection, batch):
+        # Group consecutive rows for the same statement so each group is one executemany
+        groups = []
+        for statement, params in batch:
+            if groups and groups[-1][0] == statement:
+                groups[-1][1].append(params)
+            else:
+                groups.append((statement, [params]))
+        try:
+            with connection:
+                for statement, rows in groups:
+                    connection.executemany(statement, rows)
+        except sqlite3.Error as e:
+            logging.error(f"Failed to write batch of {len(batch)} rows: {e}")
+            with self._condition:
+                self.failed_batches += 1
+                self.dropped += len(batch)
+                self._completed += len(batch)
+                self._condition.notify_all()
+            return
+        with self._condition:
+            self.written += len(batch)
+            self._completed += len(batch)
+            self.batches += 1
+            self._condition.notify_all()
+
+    def _run(self):
+        connection = connect_wal(self.database_path)
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch:
+                    self._write_batch(connection, batch)
+                elif self._closed:
+                    break
+        finally:
+            connection.close()
+            with self._condition:
+                self._condition.notify_all()